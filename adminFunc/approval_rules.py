@@ -0,0 +1,254 @@
+"""Compiled approval-rule matching.
+
+A company's active ApprovalRule rows and their ApprovalSteps are compiled once
+into an interval index: the amount axis is cut at every rule boundary and each
+resulting region stores, per category, the first rule that applies there in
+``-priority, min_amount`` order. Matching an expense is then a bisect plus a
+dict lookup. Compiled indexes are cached per process and tagged with a
+per-company version (``cache.Versions``), bumped by the signals in
+``adminFunc.signals``.
+"""
+import bisect
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import audit, inbox, stats
+from .cache import TTLCache, Versions
+from .models import ApprovalRule, AuditLog, Expense, ExpenseApproval
+
+CompiledStep = namedtuple('CompiledStep', 'id step_number approver_id can_auto_approve')
+CompiledRule = namedtuple(
+    'CompiledRule',
+    'id name rule_type min_amount max_amount category_ids approval_percentage '
+    'requires_manager_approval steps',
+)
+
+_versions = Versions('approval_rules')
+_compiled = TTLCache(maxsize=1024, ttl=3600)
+
+
+def rules_version(company_id):
+    return _versions.get(company_id)
+
+
+def invalidate(company_id):
+    """Called when a company's rules, steps or rule categories change"""
+    _compiled.delete(company_id)
+    _versions.bump(company_id)
+
+
+def _applies(rule, amount):
+    return rule.min_amount <= amount and (rule.max_amount is None or amount <= rule.max_amount)
+
+
+class RuleIndex:
+    """Interval/category index over one company's active rules"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.points = sorted(
+            {rule.min_amount for rule in rules} | {rule.max_amount for rule in rules if rule.max_amount is not None}
+        )
+        # Region 2*i+1 is the point points[i]; region 2*i is the open interval
+        # just below points[i] (region 2*len(points) is everything above)
+        self.regions = [self._compile_region(amount) for amount in self._representatives()]
+
+    def _representatives(self):
+        points = self.points
+        if not points:
+            return [0]
+        amounts = [points[0] - 1]
+        for i, point in enumerate(points):
+            amounts.append(point)
+            amounts.append((point + points[i + 1]) / 2 if i + 1 < len(points) else point + 1)
+        return amounts
+
+    def _compile_region(self, amount):
+        by_category = {}
+        for rule in self.rules:
+            if not _applies(rule, amount):
+                continue
+            if not rule.category_ids:
+                return by_category, rule
+            for category_id in rule.category_ids:
+                by_category.setdefault(category_id, rule)
+        return by_category, None
+
+    def _region(self, amount):
+        i = bisect.bisect_left(self.points, amount)
+        if i < len(self.points) and self.points[i] == amount:
+            return self.regions[2 * i + 1]
+        return self.regions[2 * i]
+
+    def match(self, amount, category_id):
+        """First applicable rule for an amount/category, or None"""
+        by_category, catch_all = self._region(amount)
+        return by_category.get(category_id, catch_all)
+
+
+def compile_rules(company_id):
+    """Load and compile a company's active rules (three queries)"""
+    rules = (
+        ApprovalRule.objects.filter(company_id=company_id, is_active=True)
+        .order_by('-priority', 'min_amount', 'id')
+        .prefetch_related('categories', 'approval_steps')
+    )
+    compiled = []
+    for rule in rules:
+        compiled.append(CompiledRule(
+            id=rule.id,
+            name=rule.name,
+            rule_type=rule.rule_type,
+            min_amount=rule.min_amount,
+            max_amount=rule.max_amount,
+            category_ids=frozenset(category.id for category in rule.categories.all()),
+            approval_percentage=rule.approval_percentage,
+            requires_manager_approval=rule.requires_manager_approval,
+            steps=tuple(
+                CompiledStep(step.id, step.step_number, step.approver_id, step.can_auto_approve)
+                for step in sorted(rule.approval_steps.all(), key=lambda step: step.step_number)
+            ),
+        ))
+    return RuleIndex(compiled)
+
+
+def get_rule_index(company_id):
+    version = rules_version(company_id)
+    entry = _compiled.get(company_id)
+    if entry is None or entry[0] != version:
+        entry = (version, compile_rules(company_id))
+        _compiled.set(company_id, entry)
+    return entry[1]
+
+
+def match_rule(expense, index=None):
+    index = index or get_rule_index(expense.company_id)
+    return index.match(expense.company_amount, expense.category_id)
+
+
+def build_approvals(expense, rule, manager_id=None):
+    """Unsaved ExpenseApproval rows for an expense routed through ``rule``.
+
+    The employee's manager, when required, approves first. Sequential rules
+    keep their step order; the other rule types ask all approvers at once.
+    An approver listed twice for the same step is asked once.
+    """
+    approvals = []
+    offset = 0
+    if manager_id and (rule is None or rule.requires_manager_approval):
+        approvals.append(ExpenseApproval(expense=expense, approver_id=manager_id, step_number=1))
+        offset = 1
+    if rule is not None:
+        # (step_number, approver_id) is unique per expense
+        seen = {(approval.step_number, approval.approver_id) for approval in approvals}
+        for step in rule.steps:
+            step_number = (step.step_number if rule.rule_type == 'SEQUENTIAL' else 1) + offset
+            if (step_number, step.approver_id) in seen:
+                continue
+            seen.add((step_number, step.approver_id))
+            approvals.append(ExpenseApproval(
+                expense=expense,
+                approval_step_id=step.id,
+                approver_id=step.approver_id,
+                step_number=step_number,
+            ))
+    return approvals
+
+
+def plan_routes(expenses, now=None):
+    """Route expenses in memory, writing nothing.
+
+    Sets each expense's status, current step and submitted/completed times
+    and returns ``(matched, approvals, transitions)``: the CompiledRule (or
+    None) of each expense, in the order given, the unsaved ExpenseApproval
+    rows and the stats transitions. The expenses need not be saved yet.
+    """
+    indexes = {}
+    matched = []
+    approvals = []
+    transitions = []
+    now = now or timezone.now()
+
+    for expense in expenses:
+        index = indexes.get(expense.company_id)
+        if index is None:
+            index = indexes[expense.company_id] = get_rule_index(expense.company_id)
+        rule = index.match(expense.company_amount, expense.category_id)
+        matched.append(rule)
+
+        expense_approvals = build_approvals(expense, rule, expense.employee.manager_id)
+        approvals.extend(expense_approvals)
+        old_state = expense.stats_state()
+        expense.submitted_at = expense.submitted_at or now
+        if expense_approvals:
+            expense.status = 'PENDING'
+            expense.current_approval_step = min(a.step_number for a in expense_approvals)
+        else:
+            # Nobody to ask: no matching rule and no manager
+            expense.status = 'APPROVED'
+            expense.current_approval_step = 0
+            expense.completed_at = now
+        transitions.append((old_state, expense.stats_state()))
+    return matched, approvals, transitions
+
+
+def route_expenses(expenses, batch_size=1000):
+    """Route submitted expenses to their approvers in bulk.
+
+    Expenses should come with ``employee`` selected (for the manager). Creates
+    the ExpenseApproval rows with ``bulk_create``, marks the expenses PENDING at
+    their first step (APPROVED when nobody needs to approve) and returns
+    ``{expense_id: CompiledRule or None}``. Expenses that already have
+    approval rows are routed already and are left out.
+    """
+    expenses = list(expenses)
+    with transaction.atomic():
+        routed = set(
+            ExpenseApproval.objects.filter(expense_id__in=[expense.id for expense in expenses])
+            .values_list('expense_id', flat=True)
+        )
+        expenses = [expense for expense in expenses if expense.id not in routed]
+        rules, approvals, transitions = plan_routes(expenses)
+        ExpenseApproval.objects.bulk_create(approvals, batch_size=batch_size)
+        Expense.objects.bulk_update(
+            expenses, ['status', 'current_approval_step', 'submitted_at', 'completed_at'], batch_size=batch_size,
+        )
+        stats.record_expense_transitions(transitions)
+    inbox.invalidate_counts(approval.approver_id for approval in approvals)
+    return {expense.id: rule for expense, rule in zip(expenses, rules)}
+
+
+def submit(employee, expense_ids, ip_address=None):
+    """Submit ``employee``'s draft expenses for approval.
+
+    Returns ``{'submitted': [...], 'skipped': [...]}``; skipped ids are not
+    the employee's drafts.
+    """
+    expense_ids = set(expense_ids)
+    with transaction.atomic():
+        drafts = list(
+            Expense.objects.select_for_update(of=('self',))
+            .filter(pk__in=expense_ids, employee=employee, status='DRAFT')
+            .select_related('employee')
+            .order_by()
+        )
+        matched = route_expenses(drafts)
+        audit.log_many(
+            AuditLog(
+                user=employee,
+                company_id=expense.company_id,
+                action='SUBMIT',
+                model_name='Expense',
+                object_id=expense.id,
+                description=f"Submitted {expense.expense_number}",
+                ip_address=ip_address,
+                metadata={'rule_id': matched[expense.id].id if matched[expense.id] else None, 'status': expense.status},
+            )
+            for expense in drafts if expense.id in matched
+        )
+    return {
+        'submitted': sorted(matched),
+        'skipped': sorted(expense_ids - matched.keys()),
+    }
@@ -0,0 +1,257 @@
+"""Asynchronous, batched AuditLog writer.
+
+Request handlers call ``log()``/``log_many()``; entries are handed to an
+in-process queue once the surrounding transaction commits, and a background
+thread writes them with ``bulk_create`` whenever AUDIT_BATCH_SIZE entries are
+waiting or AUDIT_FLUSH_INTERVAL seconds have passed. When the queue is full,
+the writer is disabled (AUDIT_ASYNC = False) or the process is shutting down,
+entries are written synchronously instead, and an ``atexit`` hook drains the
+queue, so a clean shutdown never drops events.
+
+A batch that fails is retried entry by entry, so one bad entry (e.g. a user
+deleted in the meantime) cannot hold back the rest. Entries still failing are
+kept for the next flush, at most AUDIT_MAX_RETRY of them; an entry that fails
+AUDIT_MAX_ATTEMPTS times, or that does not fit, is dropped with an error
+logged.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AuditWriter:
+
+    def __init__(self, batch_size=500, interval=1.0, max_queue=100000, max_attempts=3, max_retry=10000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.max_retry = max_retry
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._leftover = []
+        # Entries accepted but not yet written, for flush()
+        self._unwritten = 0
+        self._unwritten_changed = threading.Condition()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'written_sync': 0,
+            'flushes': 0,
+            'failures': 0,
+            'dropped': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0,
+        }
+
+    def metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['unwritten'] = self._unwritten
+        metrics['running'] = self._thread is not None and self._thread.is_alive()
+        metrics['avg_flush_seconds'] = (
+            metrics['total_flush_seconds'] / metrics['flushes'] if metrics['flushes'] else 0.0
+        )
+        return metrics
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped:
+            return
+        with self._lock:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _track(self, delta):
+        with self._unwritten_changed:
+            self._unwritten += delta
+            self._unwritten_changed.notify_all()
+
+    def submit(self, entries):
+        """Queue unsaved AuditLog instances, writing them inline if that is not possible"""
+        entries = list(entries)
+        if not entries:
+            return
+        self._ensure_started()
+        overflow = entries
+        # Holding the lock keeps stop() from draining between the check and the puts
+        with self._lock:
+            if not self._stopped:
+                overflow = []
+                for i, entry in enumerate(entries):
+                    try:
+                        self._queue.put_nowait(entry)
+                    except queue.Full:
+                        overflow = entries[i:]
+                        break
+                accepted = len(entries) - len(overflow)
+                self._track(accepted)
+                with self._metrics_lock:
+                    self._metrics['enqueued'] += accepted
+        if overflow:
+            # Stopped or backpressure: the caller pays for the write
+            self._write(overflow, sync=True)
+
+    def _write(self, batch, sync=False):
+        started = time.monotonic()
+        try:
+            AuditLog.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            with self._metrics_lock:
+                self._metrics['failures'] += 1
+            raise
+        elapsed = time.monotonic() - started
+        with self._metrics_lock:
+            self._metrics['written_sync' if sync else 'written'] += len(batch)
+            self._metrics['flushes'] += 1
+            self._metrics['last_flush_seconds'] = elapsed
+            self._metrics['total_flush_seconds'] += elapsed
+            self._metrics['max_flush_seconds'] = max(self._metrics['max_flush_seconds'], elapsed)
+
+    def _flush(self, pending, sync=False):
+        """Write ``pending``; returns the entries to retry with the next batch"""
+        try:
+            self._write(pending, sync)
+        except Exception:
+            logger.exception("Error writing %d audit log entries, retrying them one by one", len(pending))
+            close_old_connections()
+        else:
+            self._track(-len(pending))
+            return []
+
+        retry = []
+        for entry in pending:
+            try:
+                self._write([entry], sync)
+            except Exception:
+                close_old_connections()
+                entry._write_attempts = getattr(entry, '_write_attempts', 0) + 1
+                if entry._write_attempts < self.max_attempts:
+                    retry.append(entry)
+                else:
+                    self._drop([entry], f"failed {entry._write_attempts} times")
+            else:
+                self._track(-1)
+        if len(retry) > self.max_retry:
+            self._drop(retry[:-self.max_retry], "retry buffer full")
+            retry = retry[-self.max_retry:]
+        return retry
+
+    def _drop(self, entries, reason):
+        for entry in entries:
+            logger.error(
+                "Dropping audit log entry (%s): %s %s %s by user %s: %s",
+                reason, entry.action, entry.model_name, entry.object_id, entry.user_id, entry.description,
+            )
+        with self._metrics_lock:
+            self._metrics['dropped'] += len(entries)
+        self._track(-len(entries))
+
+    def _run(self):
+        pending = []
+        deadline = time.monotonic() + self.interval
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                if item is not None:
+                    pending.append(item)
+                if len(pending) >= self.batch_size or time.monotonic() >= deadline:
+                    if pending:
+                        pending = self._flush(pending)
+                    deadline = time.monotonic() + self.interval
+            if pending:
+                pending = self._flush(pending)
+        finally:
+            self._leftover = pending
+            connection.close()
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is written; False on timeout"""
+        with self._unwritten_changed:
+            return self._unwritten_changed.wait_for(lambda: self._unwritten <= 0, timeout)
+
+    def stop(self):
+        """Drain the queue and switch to synchronous writes"""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        # Whatever the thread could not write, plus anything queued after the stop marker
+        remaining = list(self._leftover)
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining.append(item)
+        if remaining:
+            leftover = self._flush(remaining, sync=True)
+            if leftover:
+                self._drop(leftover, "writer stopped")
+
+
+writer = AuditWriter(
+    batch_size=getattr(settings, 'AUDIT_BATCH_SIZE', 500),
+    interval=getattr(settings, 'AUDIT_FLUSH_INTERVAL', 1.0),
+    max_queue=getattr(settings, 'AUDIT_MAX_QUEUE', 100000),
+    max_attempts=getattr(settings, 'AUDIT_MAX_ATTEMPTS', 3),
+    max_retry=getattr(settings, 'AUDIT_MAX_RETRY', 10000),
+)
+
+
+def log_many(entries):
+    """Record unsaved AuditLog instances once the current transaction commits"""
+    entries = list(entries)
+    if not entries:
+        return
+    if not getattr(settings, 'AUDIT_ASYNC', True):
+        transaction.on_commit(lambda: AuditLog.objects.bulk_create(entries))
+        return
+    transaction.on_commit(lambda: writer.submit(entries))
+
+
+def log(user, action, model_name, object_id, description, ip_address=None, metadata=None):
+    log_many([AuditLog(
+        user=user,
+        company_id=getattr(user, 'company_id', None),
+        action=action,
+        model_name=model_name,
+        object_id=object_id,
+        description=description,
+        ip_address=ip_address,
+        metadata=metadata,
+    )])
+
+
+def flush(timeout=None):
+    return writer.flush(timeout)
+
+
+def metrics():
+    """Queue depth, write counts and flush latency of the background writer"""
+    return writer.metrics()
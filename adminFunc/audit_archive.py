@@ -0,0 +1,220 @@
+"""Monthly archival of AuditLog rows and a query layer over hot + archived data.
+
+``audit_logs`` keeps the last AUDIT_HOT_MONTHS months. Older months are
+streamed into gzip-compressed JSONL segments under AUDIT_ARCHIVE_DIR, one
+AuditLogSegment row per file, and deleted from the hot table. Each segment
+records its time range, object-id ranges per model and the companies it
+contains, so ``search()`` only opens files that can match. A segment file is
+written, fsynced and moved into place before the transaction that records it
+and deletes the rows commits, and removed again if that transaction rolls
+back; a crash in between leaves at most an unreferenced file, never lost rows.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AuditLog, AuditLogSegment
+
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'action', 'model_name', 'object_id', 'description',
+    'ip_address', 'metadata', 'created_at', 'company_id',
+)
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """Keeps full microsecond precision (DjangoJSONEncoder truncates to milliseconds)"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'AUDIT_ARCHIVE_DIR', settings.BASE_DIR / 'audit_archive'))
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(value):
+    if value.month == 12:
+        return datetime(value.year + 1, 1, 1, tzinfo=dt_timezone.utc)
+    return datetime(value.year, value.month + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def archive_cutoff(hot_months=None):
+    """Start of the oldest month that stays in the hot table"""
+    hot_months = getattr(settings, 'AUDIT_HOT_MONTHS', 3) if hot_months is None else hot_months
+    cutoff = month_start(timezone.now())
+    for _ in range(hot_months):
+        cutoff = month_start(cutoff - timedelta(days=1))
+    return cutoff
+
+
+def archivable_months(cutoff):
+    return [
+        month_start(month)
+        for month in AuditLog.objects.filter(created_at__lt=cutoff).datetimes('created_at', 'month', tzinfo=dt_timezone.utc)
+    ]
+
+
+def _segment_path(month):
+    # Unique per run, so concurrent or repeated archives of a month never collide
+    return archive_dir() / f'{month:%Y}' / f'audit-{month:%Y-%m}-{uuid.uuid4().hex}.jsonl.gz'
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # Not supported for directories on every platform
+    finally:
+        os.close(fd)
+
+
+def archive_month(month, batch_size=5000):
+    """Move one month of audit rows into a new segment; returns it (None if empty)"""
+    start, end = month_start(month), next_month(month)
+    rows = (
+        AuditLog.objects.filter(created_at__gte=start, created_at__lt=end)
+        .order_by('created_at', 'id')
+        .values(*ARCHIVE_FIELDS)
+    )
+    path = _segment_path(start)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    row_count = 0
+    max_id = min_created_at = max_created_at = None
+    object_ranges, company_ids = {}, set()
+    digest = hashlib.sha256()
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as out:
+                for row in rows.iterator(chunk_size=batch_size):
+                    line = (json.dumps(row, cls=ArchiveEncoder, separators=(',', ':')) + '\n').encode()
+                    out.write(line)
+                    digest.update(line)
+
+                    row_count += 1
+                    max_id = row['id'] if max_id is None else max(max_id, row['id'])
+                    min_created_at = min_created_at or row['created_at']
+                    max_created_at = row['created_at']
+                    object_id = row['object_id']
+                    low, high = object_ranges.get(row['model_name'], (object_id, object_id))
+                    object_ranges[row['model_name']] = [min(low, object_id), max(high, object_id)]
+                    if row['company_id'] is not None:
+                        company_ids.add(row['company_id'])
+            # Synced after the gzip trailer is written on close
+            raw.flush()
+            os.fsync(raw.fileno())
+        if not row_count:
+            os.unlink(tmp_path)
+            return None
+        os.replace(tmp_path, path)
+        _fsync_dir(path.parent)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    try:
+        # Durable: the rows may only be deleted by a commit of our own, once the file is in place
+        with transaction.atomic(durable=True):
+            segment = AuditLogSegment.objects.create(
+                month=start.date(),
+                path=str(path.relative_to(archive_dir())),
+                row_count=row_count,
+                min_created_at=min_created_at,
+                max_created_at=max_created_at,
+                min_object_id=min(low for low, _ in object_ranges.values()),
+                max_object_id=max(high for _, high in object_ranges.values()),
+                object_ranges=object_ranges,
+                company_ids=sorted(company_ids),
+                sha256=digest.hexdigest(),
+            )
+            AuditLog.objects.filter(created_at__gte=start, created_at__lt=end, id__lte=max_id).delete()
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return segment
+
+
+def read_segment(segment):
+    """Stream the rows of an archived segment"""
+    with gzip.open(archive_dir() / segment.path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+            yield row
+
+
+def _segment_may_match(segment, company_id, model_name, object_id):
+    if company_id is not None and company_id not in segment.company_ids:
+        return False
+    if model_name is not None and model_name not in segment.object_ranges:
+        return False
+    if object_id is not None:
+        if model_name is not None:
+            low, high = segment.object_ranges[model_name]
+        else:
+            low, high = segment.min_object_id, segment.max_object_id
+        if not low <= object_id <= high:
+            return False
+    return True
+
+
+def _row_matches(row, start, end, filters):
+    if start is not None and row['created_at'] < start:
+        return False
+    if end is not None and row['created_at'] >= end:
+        return False
+    return all(row[field] == value for field, value in filters.items())
+
+
+def search(start=None, end=None, company_id=None, model_name=None, object_id=None, user_id=None, action=None):
+    """Audit rows in ``[start, end)`` from archived segments and the hot table, oldest first.
+
+    Rows are dicts with the AuditLog columns, including the ``company_id``
+    recorded when the entry was written.
+    """
+    filters = {
+        field: value for field, value in (
+            ('company_id', company_id), ('model_name', model_name), ('object_id', object_id),
+            ('user_id', user_id), ('action', action),
+        ) if value is not None
+    }
+
+    segments = AuditLogSegment.objects.all()
+    if start is not None:
+        segments = segments.filter(max_created_at__gte=start)
+    if end is not None:
+        segments = segments.filter(min_created_at__lt=end)
+    for segment in segments.order_by('min_created_at', 'id'):
+        if not _segment_may_match(segment, company_id, model_name, object_id):
+            continue
+        for row in read_segment(segment):
+            if _row_matches(row, start, end, filters):
+                yield row
+
+    hot = AuditLog.objects.all()
+    if start is not None:
+        hot = hot.filter(created_at__gte=start)
+    if end is not None:
+        hot = hot.filter(created_at__lt=end)
+    hot = hot.filter(**filters)
+    yield from hot.order_by('created_at', 'id').values(*ARCHIVE_FIELDS).iterator()
@@ -0,0 +1,88 @@
+"""Authentication backend with a cached user loader.
+
+``CachedModelBackend.get_user`` is what ``AuthenticationMiddleware`` calls on
+every authenticated request. It loads the user with their company and
+manager in one query, and keeps the result in an in-process cache tagged with
+the versions (``cache.Versions``) of the user, their company and their
+manager. The signals in ``adminFunc.signals`` bump a version whenever the
+user, company or manager is saved or deleted. A warm request then costs one
+cache read and no queries; together with the ``cached_db`` session engine
+(the default with a shared cache, see SESSION_ENGINE in settings)
+authentication stays off the database.
+
+The versions are read on every request, so a change made in this process, or
+in any process when the cache is shared (``cache.shared()``), is seen at
+once. Without a shared cache a deactivation or password change made in
+another worker is only seen once the copy expires after AUTH_USER_CACHE_TTL
+seconds, which settings keeps short in that case.
+
+Each request gets its own unpickled copy, so a view that modifies
+``request.user`` never changes another request's user. ``QuerySet.update()``
+on users or companies does not send signals; call ``invalidate`` afterwards.
+"""
+import pickle
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+from .cache import TTLCache, Versions
+from .models import User
+
+_versions = Versions('auth_user', ttl=0)
+_loaded = TTLCache(maxsize=10000, ttl=600)
+
+
+def invalidate(kind, pk):
+    """Called when a user or company (``kind`` 'user' or 'company') changes"""
+    _versions.bump(f'{kind}:{pk}')
+
+
+def _version_names(user_id, company_id, manager_id):
+    names = [f'user:{user_id}']
+    if company_id is not None:
+        names.append(f'company:{company_id}')
+    if manager_id is not None:
+        names.append(f'user:{manager_id}')
+    return names
+
+
+def load_user(user_id):
+    """The user with ``company`` and ``manager`` loaded, None if there is none"""
+    entry = _loaded.get(user_id)
+    if entry is not None:
+        names, tag, data = entry
+        if _versions.get_many(names) == tag:
+            return pickle.loads(data)
+    # Versions are read before the query so a concurrent save is never masked
+    # (guessing the company and manager are unchanged)
+    if entry is not None:
+        names = entry[0]
+    else:
+        related = User.all_objects.filter(pk=user_id).values_list('company_id', 'manager_id').first()
+        if related is None:
+            return None
+        names = _version_names(user_id, *related)
+    for _ in range(2):
+        tag = _versions.get_many(names)
+        user = User.all_objects.select_related('company', 'manager').filter(pk=user_id).first()
+        if user is None:
+            return None
+        found = _version_names(user.pk, user.company_id, user.manager_id)
+        if found == names:
+            break
+        # The company or manager joined the tag: read them with their versions
+        names = found
+    _loaded.set(user_id, (names, tag, pickle.dumps(user)), ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 600))
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose ``get_user`` goes through ``load_user``"""
+
+    def get_user(self, user_id):
+        user = load_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
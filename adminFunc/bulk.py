@@ -0,0 +1,46 @@
+"""Fast multi-row INSERT for large loads.
+
+``bulk_create`` compiles every value through the ORM and, on SQLite, splits
+batches at 999 parameters (about 45 expenses per statement). ``insert_rows``
+builds the INSERT once, adapts values with the backend's column adapters and
+hands whole batches to ``cursor.executemany``. Signals, ``save()`` and
+``auto_now``/``auto_now_add`` are skipped (callers set those fields), and the
+objects do not get primary keys back.
+"""
+from functools import lru_cache
+
+from django.db import connection, models
+
+
+def _adapter(field):
+    ops = connection.ops
+    if isinstance(field, models.DecimalField):
+        return lambda value: ops.adapt_decimalfield_value(value, field.max_digits, field.decimal_places)
+    # Loads repeat the same few timestamps and dates over and over
+    if isinstance(field, models.DateTimeField):
+        return lru_cache(maxsize=4096)(ops.adapt_datetimefield_value)
+    if isinstance(field, models.DateField):
+        return lru_cache(maxsize=4096)(ops.adapt_datefield_value)
+    if isinstance(field, (models.JSONField, models.FileField)):
+        return lambda value: field.get_db_prep_save(value, connection)
+    return None
+
+
+def insert_rows(model, objs, batch_size=5000):
+    """INSERT ``objs`` (all concrete fields except the auto pk) in executemany batches"""
+    fields = [field for field in model._meta.concrete_fields if not isinstance(field, models.AutoField)]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+
+    getters = [(field.attname, _adapter(field)) for field in fields]
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            rows = []
+            for obj in objs[start:start + batch_size]:
+                values = obj.__dict__
+                rows.append(tuple(
+                    values[attname] if adapt is None or values[attname] is None else adapt(values[attname])
+                    for attname, adapt in getters
+                ))
+            cursor.executemany(sql, rows)
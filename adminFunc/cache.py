@@ -0,0 +1,132 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+_instances = weakref.WeakSet()
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after ``ttl`` seconds"""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is self._MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+def clear_local():
+    """Empty every TTLCache in this process (e.g. between tests, whose rolled back rows send no signals)"""
+    for instance in list(_instances):
+        instance.clear()
+
+
+def shared():
+    """Whether Django's cache is shared by every worker process (SHARED_CACHE).
+
+    Version bumps (``Versions``) and cached counters only reach the other
+    processes through a shared cache.
+    """
+    return getattr(settings, 'SHARED_CACHE', False)
+
+
+def _new_version():
+    # Not 1: a counter that was evicted must not restart at a value that
+    # data cached before the eviction is still tagged with
+    return time.time_ns()
+
+
+class Versions:
+    """Version counters in Django's cache, read through a short-lived local copy.
+
+    Cached data is tagged with the version it was built at and is stale once
+    the version moves. ``bump``, called by the signal handlers in
+    ``adminFunc.signals``, increments the counter and drops this process's
+    copy, so the process that made a change sees it at once. Other processes
+    read the counter again after CACHE_VERSION_TTL seconds: through a shared
+    cache (``shared()``) they then see the bump; with the per-process default
+    cache they never do, and data cached under an old version lives until its
+    own TTL. ``ttl`` overrides CACHE_VERSION_TTL; 0 reads the counters on
+    every call.
+    """
+
+    def __init__(self, prefix, maxsize=10000, ttl=None):
+        self.prefix = prefix
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=None)
+
+    def key(self, name=None):
+        return self.prefix + ':version' if name is None else f'{self.prefix}:version:{name}'
+
+    def get(self, name=None):
+        return self.get_many([name])[0]
+
+    def get_many(self, names):
+        """The versions of several names, with at most one cache round trip"""
+        versions = {name: self._local.get(name) for name in names}
+        missing = [name for name, version in versions.items() if version is None]
+        if missing:
+            found = cache.get_many([self.key(name) for name in missing])
+            ttl = self.ttl if self.ttl is not None else getattr(settings, 'CACHE_VERSION_TTL', 5)
+            for name in missing:
+                version = found.get(self.key(name))
+                if version is None:
+                    version = _new_version()
+                    if not cache.add(self.key(name), version, timeout=None):
+                        version = cache.get(self.key(name), version)
+                versions[name] = version
+                if ttl > 0:
+                    self._local.set(name, version, ttl=ttl)
+        return tuple(versions[name] for name in names)
+
+    def bump(self, name=None):
+        try:
+            cache.incr(self.key(name))
+        except ValueError:
+            cache.set(self.key(name), _new_version(), timeout=None)
+        self._local.delete(name)
+
+    def clear(self):
+        """Forget the local copies (the counters are left alone)"""
+        self._local.clear()
@@ -0,0 +1,184 @@
+"""Country -> currency resolution that never touches the network on the request path.
+
+Lookups are served from a bundled ISO-4217 dataset, optionally overlaid by a
+snapshot written by the ``warm_country_currencies`` command. Only that command
+talks to restcountries.com.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_DATASET = Path(__file__).resolve().parent / 'data' / 'countries.json'
+RESTCOUNTRIES_URL = 'https://restcountries.com/v3.1/all'
+DEFAULT_CURRENCY = ('USD', '$')
+
+_index = None
+_index_snapshot_mtime = None
+_index_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+_cache = TTLCache(
+    maxsize=512,
+    ttl=getattr(settings, 'COUNTRY_CURRENCY_CACHE_TTL', 3600),
+)
+
+
+def _normalize(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+def snapshot_path():
+    return Path(getattr(settings, 'COUNTRY_CURRENCY_SNAPSHOT', settings.BASE_DIR / 'country_currencies.json'))
+
+
+def load_entries(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def merge_entries(*datasets):
+    """Merge entry lists; later datasets win for the same country code"""
+    merged = {}
+    for entries in datasets:
+        for entry in entries:
+            merged[entry['cca2']] = entry
+    return sorted(merged.values(), key=lambda entry: entry['name'])
+
+
+def _snapshot_mtime(path):
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return None
+
+
+def _build_index(entries):
+    index = {}
+    for entry in entries:
+        value = (entry['currency'], entry.get('symbol') or entry['currency'])
+        for key in [entry['name'], entry['cca2'], *entry.get('aliases', [])]:
+            index[_normalize(key)] = value
+    return index
+
+
+def _get_index():
+    """Build the index on first use and rebuild it when the snapshot changes"""
+    global _index, _index_snapshot_mtime
+    path = snapshot_path()
+    mtime = _snapshot_mtime(path)
+    if _index is not None and mtime == _index_snapshot_mtime:
+        return _index
+
+    with _index_lock:
+        if _index is None or mtime != _index_snapshot_mtime:
+            datasets = [load_entries(BUNDLED_DATASET)]
+            if mtime is not None:
+                try:
+                    datasets.append(load_entries(path))
+                except (OSError, ValueError) as e:
+                    logger.warning("Ignoring unreadable currency snapshot %s: %s", path, e)
+            _index = _build_index(merge_entries(*datasets))
+            _index_snapshot_mtime = mtime
+            _cache.clear()
+    return _index
+
+
+def current_entries():
+    """Bundled entries overlaid by the snapshot, as used by the index"""
+    datasets = [load_entries(BUNDLED_DATASET)]
+    path = snapshot_path()
+    if path.exists():
+        datasets.append(load_entries(path))
+    return merge_entries(*datasets)
+
+
+def resolve_currency(country_name):
+    """Return ``(currency_code, currency_symbol)`` for a country name or ISO code"""
+    if not country_name:
+        return DEFAULT_CURRENCY
+    # Checked first: a new snapshot clears cached results
+    index = _get_index()
+    key = _normalize(country_name)
+    result = _cache.get(key)
+    if result is None:
+        result = index.get(key, DEFAULT_CURRENCY)
+        _cache.set(key, result)
+    return result
+
+
+def clear_cache():
+    global _index
+    with _index_lock:
+        _index = None
+        _cache.clear()
+
+
+def get_http_session():
+    """Shared pooled session, only used to refresh the dataset"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def fetch_upstream_entries(timeout=None):
+    """Download the country/currency table from restcountries.com"""
+    timeout = timeout or getattr(settings, 'COUNTRY_CURRENCY_HTTP_TIMEOUT', (3.05, 10))
+    response = get_http_session().get(
+        RESTCOUNTRIES_URL,
+        params={'fields': 'name,cca2,currencies'},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+
+    entries = []
+    for country in response.json():
+        currencies = country.get('currencies') or {}
+        if not currencies or not country.get('cca2'):
+            continue
+        code, details = next(iter(currencies.items()))
+        names = country.get('name') or {}
+        entry = {
+            'name': names.get('common') or country['cca2'],
+            'cca2': country['cca2'],
+            'currency': code,
+            'symbol': (details or {}).get('symbol') or code,
+        }
+        official = names.get('official')
+        if official and official != entry['name']:
+            entry['aliases'] = [official]
+        entries.append(entry)
+    return entries
+
+
+def write_snapshot(entries, path=None):
+    """Atomically replace the snapshot file so readers never see a partial write"""
+    path = Path(path or snapshot_path())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
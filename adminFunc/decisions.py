@@ -0,0 +1,145 @@
+"""Bulk approve/reject decisions.
+
+All of an approver's decisions are applied in one transaction: the actionable
+ExpenseApproval rows are locked with ``select_for_update(skip_locked=True)``
+(rows another approver is deciding right now are reported as skipped), the
+workflow is advanced in memory, and every write is a bulk statement (audit
+entries go through the batched writer in ``adminFunc.audit``).
+"""
+from collections import defaultdict
+from math import ceil
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import audit, inbox, stats
+from .models import AuditLog, Expense, ExpenseApproval, ExpenseComment
+
+# action -> (ExpenseApproval status, AuditLog action, past tense)
+DECISIONS = {
+    'approve': ('APPROVED', 'APPROVE', 'Approved'),
+    'reject': ('REJECTED', 'REJECT', 'Rejected'),
+}
+
+
+def _step_rule(step_approvals):
+    """The ApprovalRule behind a step; None for the manager step"""
+    for approval in step_approvals:
+        if approval.approval_step_id:
+            return approval.approval_step.approval_rule
+    return None
+
+
+def _required_approvals(step_approvals):
+    rule = _step_rule(step_approvals)
+    if rule is not None and rule.approval_percentage and rule.rule_type in ('PERCENTAGE', 'HYBRID'):
+        return ceil(len(step_approvals) * rule.approval_percentage / 100)
+    return len(step_approvals)
+
+
+def advance(expense, approvals, decided, now):
+    """Move ``expense`` forward after ``decided`` (one of ``approvals``) was actioned.
+
+    Percentage/hybrid steps complete once enough approvers agreed and only
+    fail once the threshold became unreachable; other steps need everyone.
+    An approver whose step allows auto-approval finishes the expense.
+    """
+    if decided.status == 'APPROVED' and decided.approval_step_id and decided.approval_step.can_auto_approve:
+        expense.status = 'APPROVED'
+        expense.completed_at = now
+        return
+
+    by_step = defaultdict(list)
+    for approval in approvals:
+        by_step[approval.step_number].append(approval)
+    step_approvals = by_step[expense.current_approval_step]
+    required = _required_approvals(step_approvals)
+    approved = sum(1 for approval in step_approvals if approval.status == 'APPROVED')
+    rejected = sum(1 for approval in step_approvals if approval.status == 'REJECTED')
+
+    if len(step_approvals) - rejected < required:
+        expense.status = 'REJECTED'
+        expense.completed_at = now
+    elif approved >= required:
+        later_steps = [step for step in by_step if step > expense.current_approval_step]
+        if later_steps:
+            expense.current_approval_step = min(later_steps)
+        else:
+            expense.status = 'APPROVED'
+            expense.completed_at = now
+
+
+def decide(approver, expense_ids, action, comment='', ip_address=None):
+    """Approve or reject ``expense_ids`` as ``approver``.
+
+    Returns ``{'decided': [...], 'skipped': [...]}``; skipped ids are not
+    waiting on this approver or are locked by a concurrent decision.
+    """
+    status, audit_action, verb = DECISIONS[action]
+    expense_ids = set(expense_ids)
+    now = timezone.now()
+
+    with transaction.atomic():
+        mine = list(
+            ExpenseApproval.objects.select_for_update(skip_locked=True, of=('self', 'expense'))
+            .filter(
+                approver=approver,
+                status='PENDING',
+                expense_id__in=expense_ids,
+                expense__status='PENDING',
+                step_number=F('expense__current_approval_step'),
+            )
+            .select_related('expense')
+            .order_by()
+        )
+        expenses = {approval.expense_id: approval.expense for approval in mine}
+        all_approvals = defaultdict(list)
+        for approval in (
+            ExpenseApproval.objects.filter(expense_id__in=expenses)
+            .select_related('approval_step__approval_rule')
+            .order_by()
+        ):
+            all_approvals[approval.expense_id].append(approval)
+
+        changed_approvals, audit_logs, transitions = [], [], []
+        for decided in mine:
+            expense = expenses[decided.expense_id]
+            approvals = all_approvals[expense.id]
+            # Work on the copy that carries the prefetched rule
+            decided = next(approval for approval in approvals if approval.id == decided.id)
+            decided.status = status
+            decided.comments = comment or None
+            decided.actioned_at = now
+            changed_approvals.append(decided)
+
+            old_state = expense.stats_state()
+            advance(expense, approvals, decided, now)
+            transitions.append((old_state, expense.stats_state()))
+            audit_logs.append(AuditLog(
+                user=approver,
+                company_id=expense.company_id,
+                action=audit_action,
+                model_name='Expense',
+                object_id=expense.id,
+                description=f"{verb} {expense.expense_number} at step {decided.step_number}",
+                ip_address=ip_address,
+                metadata={'approval_id': decided.id, 'step_number': decided.step_number, 'status': expense.status},
+            ))
+
+        ExpenseApproval.objects.bulk_update(changed_approvals, ['status', 'comments', 'actioned_at'])
+        Expense.objects.bulk_update(expenses.values(), ['status', 'current_approval_step', 'completed_at'])
+        audit.log_many(audit_logs)
+        if comment:
+            ExpenseComment.objects.bulk_create([
+                ExpenseComment(expense_id=expense_id, user=approver, comment=comment) for expense_id in expenses
+            ])
+        stats.record_expense_transitions(transitions)
+
+    inbox.invalidate_counts(
+        approval.approver_id for approvals in all_approvals.values() for approval in approvals
+    )
+    return {
+        'decided': sorted(expenses),
+        'skipped': sorted(expense_ids - expenses.keys()),
+    }
@@ -0,0 +1,175 @@
+"""Exchange-rate lookups backed by the CurrencyExchangeRate table.
+
+Rates resolve through an in-process LRU, then Django's cache framework, then
+the database; lookups that find no rate are cached too. Entries in both
+caches are tagged with a version (``cache.Versions``) that ``store_rates``
+and the CurrencyExchangeRate signals bump, since stored rates can be
+replaced. When no rate exists for the exact date, the nearest earlier rate
+within EXCHANGE_RATE_MAX_AGE_DAYS is used, and a stored inverse pair is
+accepted when the direct pair is missing.
+"""
+import bisect
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from . import stats
+from .cache import TTLCache, Versions
+from .models import CurrencyExchangeRate, Expense
+
+RATE_PLACES = Decimal('0.000001')
+AMOUNT_PLACES = Decimal('0.01')
+# Cached for pairs and dates without a rate
+NO_RATE = 'none'
+
+_versions = Versions('fx')
+_local = TTLCache(
+    maxsize=getattr(settings, 'EXCHANGE_RATE_LOCAL_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'EXCHANGE_RATE_LOCAL_CACHE_TTL', 300),
+)
+
+
+def _max_age():
+    return timedelta(days=getattr(settings, 'EXCHANGE_RATE_MAX_AGE_DAYS', 30))
+
+
+def _shared_timeout():
+    return getattr(settings, 'EXCHANGE_RATE_CACHE_TIMEOUT', 24 * 3600)
+
+
+def _shared_key(base, target, on_date, version):
+    return f'fx:{version}:{base}:{target}:{on_date.isoformat()}'
+
+
+def invalidate():
+    """Drop cached rates after the table changed"""
+    _local.clear()
+    _versions.bump()
+
+
+def _pair_rates(base, target, start, end):
+    """Rates for a pair (or its inverse) between two dates: one query, sorted by date"""
+    rows = CurrencyExchangeRate.objects.filter(
+        Q(base_currency=base, target_currency=target) | Q(base_currency=target, target_currency=base),
+        date__gte=start,
+        date__lte=end,
+    ).values_list('base_currency', 'rate', 'date').order_by('date')
+
+    by_date = {}
+    for row_base, rate, rate_date in rows:
+        if row_base == base:
+            by_date[rate_date] = rate
+        elif rate_date not in by_date and rate:
+            by_date[rate_date] = (Decimal(1) / rate).quantize(RATE_PLACES)
+    dates = sorted(by_date)
+    return dates, [by_date[d] for d in dates]
+
+
+def _nearest(dates, rates, on_date):
+    i = bisect.bisect_right(dates, on_date)
+    if i == 0:
+        return None
+    return rates[i - 1]
+
+
+def get_rate(base, target, on_date):
+    """Rate converting ``base`` into ``target`` on ``on_date``, or None if unknown"""
+    base, target = base.upper(), target.upper()
+    if base == target:
+        return Decimal(1)
+    version = _versions.get()
+    local_key = (base, target, on_date)
+    entry = _local.get(local_key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    shared_key = _shared_key(base, target, on_date, version)
+    rate = cache.get(shared_key)
+    if rate is None:
+        dates, rates = _pair_rates(base, target, on_date - _max_age(), on_date)
+        rate = _nearest(dates, rates, on_date)
+        cache.set(shared_key, NO_RATE if rate is None else rate, timeout=_shared_timeout())
+    elif rate == NO_RATE:
+        rate = None
+
+    _local.set(local_key, (version, rate))
+    return rate
+
+
+def convert(amount, rate):
+    return (Decimal(amount) * rate).quantize(AMOUNT_PLACES, rounding=ROUND_HALF_UP)
+
+
+def apply_conversion(expense):
+    """Fill converted_amount/conversion_rate on one expense; returns True if a rate was found"""
+    rate = get_rate(expense.currency_code, expense.company.currency_code, expense.expense_date)
+    if rate is None:
+        return False
+    expense.conversion_rate = rate
+    expense.converted_amount = convert(expense.amount, rate)
+    return True
+
+
+def convert_expenses(expenses, save=True, batch_size=1000):
+    """Fill conversions for a batch of expenses with one query per currency pair.
+
+    Expenses should come with ``company`` selected. Returns the expenses that
+    could not be converted because no rate was available.
+    """
+    by_pair = defaultdict(list)
+    for expense in expenses:
+        pair = (expense.currency_code.upper(), expense.company.currency_code.upper())
+        by_pair[pair].append(expense)
+
+    converted, missing, transitions = [], [], []
+    for (base, target), group in by_pair.items():
+        if base == target:
+            dates, rates = None, None
+        else:
+            expense_dates = [expense.expense_date for expense in group]
+            dates, rates = _pair_rates(base, target, min(expense_dates) - _max_age(), max(expense_dates))
+
+        for expense in group:
+            rate = Decimal(1) if dates is None else _nearest(dates, rates, expense.expense_date)
+            if rate is None:
+                missing.append(expense)
+                continue
+            old_state = expense.stats_state()
+            expense.conversion_rate = rate
+            expense.converted_amount = convert(expense.amount, rate)
+            converted.append(expense)
+            transitions.append((old_state, expense.stats_state()))
+
+    if save and converted:
+        with transaction.atomic():
+            Expense.objects.bulk_update(converted, ['conversion_rate', 'converted_amount'], batch_size=batch_size)
+            stats.record_expense_transitions(transitions)
+    return missing
+
+
+def store_rates(rows, batch_size=1000):
+    """Upsert ``(base, target, rate, date)`` rows and invalidate cached lookups"""
+    objs = [
+        CurrencyExchangeRate(
+            base_currency=base.upper(),
+            target_currency=target.upper(),
+            rate=Decimal(str(rate)).quantize(RATE_PLACES),
+            date=rate_date,
+        )
+        for base, target, rate, rate_date in rows
+    ]
+    for start in range(0, len(objs), batch_size):
+        CurrencyExchangeRate.objects.bulk_create(
+            objs[start:start + batch_size],
+            update_conflicts=True,
+            unique_fields=['base_currency', 'target_currency', 'date'],
+            update_fields=['rate'],
+        )
+    if objs:
+        invalidate()
+    return len(objs)
@@ -0,0 +1,211 @@
+"""Streaming expense export (CSV or JSON Lines).
+
+Expenses are read newest first with ``QuerySet.iterator(chunk_size=...)``
+(a server-side cursor on PostgreSQL), and each chunk's lines, approvals and
+comments are fetched with one ``prefetch_related`` query per relation, so
+memory stays bounded by the chunk size however many rows are exported. Output
+is produced in ~64 KB pieces and can be gzip-compressed on the fly.
+
+Every record carries the keyset cursor (see ``adminFunc.pagination``) of its
+expense; passing the last cursor received resumes the export right after it.
+In CSV the lines, approvals and comments are JSON-encoded lists.
+"""
+import csv
+import io
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .models import ExpenseApproval, ExpenseComment, ExpenseLine
+from .pagination import after_cursor, encode_cursor
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+CSV_COLUMNS = (
+    'cursor', 'id', 'expense_number', 'status', 'employee_id', 'employee_email', 'employee_name', 'category',
+    'description', 'amount', 'currency_code', 'converted_amount', 'conversion_rate', 'expense_date',
+    'merchant_name', 'employee_notes', 'current_approval_step', 'receipt_sha256', 'submitted_at',
+    'completed_at', 'created_at', 'lines', 'approvals', 'comments',
+)
+# Free-text columns a spreadsheet could otherwise evaluate as formulas
+TEXT_COLUMNS = ('employee_name', 'category', 'description', 'merchant_name', 'employee_notes')
+BUFFER_SIZE = 64 * 1024
+
+_encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def export_queryset(queryset):
+    """``queryset`` with the related data an export record needs"""
+    # to_attr lists: reading them does not build a related manager queryset per expense
+    return queryset.select_related('employee', 'category', 'receipt_blob').prefetch_related(
+        Prefetch('line_items', queryset=ExpenseLine.objects.select_related('category').order_by('id'),
+                 to_attr='export_lines'),
+        Prefetch('approvals', queryset=ExpenseApproval.objects.select_related('approver').order_by('step_number', 'id'),
+                 to_attr='export_approvals'),
+        Prefetch('comments', queryset=ExpenseComment.objects.select_related('user').order_by('created_at', 'id'),
+                 to_attr='export_comments'),
+    )
+
+
+def record(expense):
+    return {
+        'cursor': encode_cursor(expense.created_at, expense.id),
+        'id': expense.id,
+        'expense_number': expense.expense_number,
+        'status': expense.status,
+        'employee_id': expense.employee_id,
+        'employee_email': expense.employee.email,
+        'employee_name': expense.employee.get_full_name(),
+        'category': expense.category.name,
+        'description': expense.description,
+        'amount': expense.amount,
+        'currency_code': expense.currency_code,
+        'converted_amount': expense.converted_amount,
+        'conversion_rate': expense.conversion_rate,
+        'expense_date': expense.expense_date,
+        'merchant_name': expense.merchant_name,
+        'employee_notes': expense.employee_notes,
+        'current_approval_step': expense.current_approval_step,
+        'receipt_sha256': expense.receipt_blob.sha256 if expense.receipt_blob else None,
+        'submitted_at': expense.submitted_at,
+        'completed_at': expense.completed_at,
+        'created_at': expense.created_at,
+        'lines': [
+            {
+                'description': line.description,
+                'quantity': line.quantity,
+                'unit_price': line.unit_price,
+                'total_amount': line.total_amount,
+                'category': line.category.name if line.category else None,
+            }
+            for line in expense.export_lines
+        ],
+        'approvals': [
+            {
+                'step_number': approval.step_number,
+                'approver_email': approval.approver.email,
+                'status': approval.status,
+                'comments': approval.comments,
+                'assigned_at': approval.assigned_at,
+                'actioned_at': approval.actioned_at,
+            }
+            for approval in expense.export_approvals
+        ],
+        'comments': [
+            {
+                'user_email': comment.user.email,
+                'comment': comment.comment,
+                'is_internal': comment.is_internal,
+                'created_at': comment.created_at,
+            }
+            for comment in expense.export_comments
+        ],
+    }
+
+
+def records(queryset, cursor=None, chunk_size=2000):
+    """Export records for ``queryset`` in ``-created_at, -id`` order, starting after ``cursor``.
+
+    Raises ValueError for a malformed cursor.
+    """
+    queryset = export_queryset(after_cursor(queryset, cursor)).order_by('-created_at', '-id')
+    # Not a generator function, so a bad cursor fails before any output is sent
+    return map(record, queryset.iterator(chunk_size=chunk_size))
+
+
+def _csv_value(column, value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return _encoder.encode(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    value = str(value)
+    if column in TEXT_COLUMNS and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows, header=True):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow([_csv_value(column, row[column]) for column in CSV_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # The header alone when there is nothing to export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield _encoder.encode(row) + '\n'
+
+
+def encode(rows, export_format, header=True):
+    """Text pieces (one per record) of ``rows`` in ``export_format``"""
+    if export_format == 'csv':
+        return csv_lines(rows, header=header)
+    if export_format == 'jsonl':
+        return jsonl_lines(rows)
+    raise ValueError(f"Unsupported export format: {export_format!r} (expected csv or jsonl)")
+
+
+def buffered(pieces, size=BUFFER_SIZE):
+    """Join text pieces into UTF-8 chunks of about ``size`` bytes"""
+    batch = []
+    length = 0
+    for piece in pieces:
+        batch.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(batch).encode()
+            batch = []
+            length = 0
+    if batch:
+        yield ''.join(batch).encode()
+
+
+def gzipped(chunks, level=6):
+    """gzip-compress a stream of byte chunks as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(queryset, export_format='csv', cursor=None, compress=False, chunk_size=2000):
+    """Encoded export bytes for a streaming response; no header row when resuming"""
+    pieces = encode(records(queryset, cursor, chunk_size), export_format, header=cursor is None)
+    chunks = buffered(pieces)
+    return gzipped(chunks) if compress else chunks
+
+
+async def aiterate(chunks):
+    """Async iterator over ``stream()`` chunks, for ASGI responses.
+
+    Django's ASGI handler would otherwise read a sync iterator to the end
+    before sending anything. Each chunk is produced on the request's
+    thread-sensitive worker, where the database cursor lives.
+    """
+    chunks = iter(chunks)
+    produce = sync_to_async(next)
+    try:
+        while (chunk := await produce(chunks, None)) is not None:
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            await sync_to_async(chunks.close)()
+
+
+def content_type(export_format, compress=False):
+    if compress:
+        return 'application/gzip'
+    return 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8'
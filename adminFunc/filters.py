@@ -0,0 +1,46 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from .hierarchy import subordinates
+from .models import Expense
+
+EXPENSE_STATUSES = {code for code, _ in Expense.STATUS_CHOICES}
+
+
+def _parse(value, cast, name):
+    try:
+        return cast(value)
+    except (ValueError, InvalidOperation):
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+
+def filter_expenses(queryset, params):
+    """Apply the listing filters from query parameters.
+
+    Supported: ``status``, ``employee``, ``team`` (a manager id: everyone
+    reporting to them at any depth), ``category``, ``date_from``,
+    ``date_to``, ``min_amount`` and ``max_amount``. Raises ValueError for
+    malformed values.
+    """
+    status = params.get('status')
+    if status and status.lower() != 'all':
+        status = status.upper()
+        if status not in EXPENSE_STATUSES:
+            raise ValueError(f"Invalid status: {status!r}")
+        queryset = queryset.filter(status=status)
+
+    if params.get('employee'):
+        queryset = queryset.filter(employee_id=_parse(params['employee'], int, 'employee'))
+    if params.get('team'):
+        queryset = queryset.filter(employee__in=subordinates(_parse(params['team'], int, 'team')))
+    if params.get('category'):
+        queryset = queryset.filter(category_id=_parse(params['category'], int, 'category'))
+    if params.get('date_from'):
+        queryset = queryset.filter(expense_date__gte=_parse(params['date_from'], date.fromisoformat, 'date_from'))
+    if params.get('date_to'):
+        queryset = queryset.filter(expense_date__lte=_parse(params['date_to'], date.fromisoformat, 'date_to'))
+    if params.get('min_amount'):
+        queryset = queryset.filter(amount__gte=_parse(params['min_amount'], Decimal, 'min_amount'))
+    if params.get('max_amount'):
+        queryset = queryset.filter(amount__lte=_parse(params['max_amount'], Decimal, 'max_amount'))
+    return queryset
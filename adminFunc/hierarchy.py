@@ -0,0 +1,143 @@
+"""Manager hierarchy index.
+
+``UserHierarchy`` is a closure table over ``User.manager``: a row for every
+(ancestor, descendant) pair with the number of levels between them, and a
+depth-0 row for each user. Subtree, management-chain and depth questions are
+then each one indexed query, however deep the tree is.
+
+The signals in ``adminFunc.signals`` keep the table in step with saves and
+deletes of users. ``QuerySet.update(manager=...)`` bypasses them; run the
+``rebuild_user_hierarchy`` command (or ``rebuild``) after such bulk changes.
+"""
+from django.db import transaction
+from django.db.models import Max
+
+from . import bulk
+from .models import User, UserHierarchy
+
+
+def subordinates(manager_id, max_depth=None, include_self=False):
+    """Lazy ``descendant_id`` queryset of everyone under ``manager_id``.
+
+    Usable as a subquery, e.g. ``Expense.objects.filter(employee__in=subordinates(manager_id))``.
+    """
+    links = UserHierarchy.objects.filter(ancestor_id=manager_id, depth__gte=0 if include_self else 1)
+    if max_depth is not None:
+        links = links.filter(depth__lte=max_depth)
+    return links.values('descendant_id')
+
+
+def subordinate_ids(manager_id, max_depth=None, include_self=False):
+    return [row['descendant_id'] for row in subordinates(manager_id, max_depth, include_self)]
+
+
+def is_subordinate(user_id, manager_id):
+    """Whether ``user_id`` reports to ``manager_id``, directly or indirectly"""
+    return UserHierarchy.objects.filter(ancestor_id=manager_id, descendant_id=user_id, depth__gte=1).exists()
+
+
+def ancestor_ids(user_id):
+    """``user_id``'s management chain, direct manager first"""
+    return list(
+        UserHierarchy.objects.filter(descendant_id=user_id, depth__gte=1)
+        .order_by('depth').values_list('ancestor_id', flat=True)
+    )
+
+
+def depth(user_id):
+    """Levels between ``user_id`` and the top of its tree (0 for a user without a manager)"""
+    return UserHierarchy.objects.filter(descendant_id=user_id).aggregate(depth=Max('depth'))['depth'] or 0
+
+
+def attach(user_id, manager_id):
+    """Add a new user (with no reports yet) under ``manager_id``"""
+    with transaction.atomic():
+        UserHierarchy.objects.bulk_create(
+            [UserHierarchy(ancestor_id=user_id, descendant_id=user_id, depth=0)], ignore_conflicts=True,
+        )
+        if manager_id is not None:
+            move(user_id, manager_id)
+
+
+def move(user_id, manager_id):
+    """Re-link ``user_id`` and everyone under it below ``manager_id`` (None to detach)"""
+    with transaction.atomic():
+        subtree = list(UserHierarchy.objects.filter(ancestor_id=user_id).values_list('descendant_id', 'depth'))
+        if not subtree:
+            subtree = [(user_id, 0)]
+            UserHierarchy.objects.create(ancestor_id=user_id, descendant_id=user_id, depth=0)
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+        # Links from the old management chain into the subtree
+        UserHierarchy.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+        if manager_id is None:
+            return
+        chain = list(UserHierarchy.objects.filter(descendant_id=manager_id).values_list('ancestor_id', 'depth'))
+        if not chain:
+            # The manager predates the index
+            chain = [(manager_id, 0)]
+        UserHierarchy.objects.bulk_create(
+            [
+                UserHierarchy(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=above + below + 1)
+                for ancestor_id, above in chain
+                for descendant_id, below in subtree
+            ],
+            batch_size=1000,
+        )
+
+
+def detach_reports(manager_id):
+    """Make ``manager_id``'s direct reports top-level (their subtrees move with them)"""
+    for user_id in User.all_objects.filter(manager_id=manager_id).values_list('id', flat=True):
+        move(user_id, None)
+
+
+def closure_rows(managers):
+    """``(ancestor_id, descendant_id, depth)`` rows for a ``{user_id: manager_id}`` map.
+
+    Returns ``(rows, cyclic)``; users in a manager cycle keep only the part of
+    their chain below the cycle and are listed in ``cyclic``.
+    """
+    rows = []
+    cyclic = []
+    for user_id in managers:
+        rows.append((user_id, user_id, 0))
+        seen = {user_id}
+        ancestor_id = managers.get(user_id)
+        level = 1
+        while ancestor_id is not None:
+            if ancestor_id in seen:
+                cyclic.append(user_id)
+                break
+            seen.add(ancestor_id)
+            rows.append((ancestor_id, user_id, level))
+            ancestor_id = managers.get(ancestor_id)
+            level += 1
+    return rows, cyclic
+
+
+def rebuild(company_ids=None):
+    """Recompute the index from ``User.manager``; returns ``(rows written, users in cycles)``"""
+    users = User.all_objects.order_by()
+    if company_ids is not None:
+        users = users.filter(company_id__in=company_ids)
+    managers = dict(users.values_list('id', 'manager_id'))
+    if company_ids is not None:
+        # Managers outside the companies still head their reports' chains
+        outside = set(managers.values()) - set(managers) - {None}
+        managers.update(User.all_objects.filter(pk__in=outside).values_list('id', 'manager_id'))
+    rows, cyclic = closure_rows(managers)
+
+    with transaction.atomic():
+        links = UserHierarchy.objects.all()
+        if company_ids is not None:
+            links = links.filter(descendant__company_id__in=company_ids)
+        links.delete()
+        if company_ids is not None:
+            # The outside managers' own rows were not deleted
+            scoped = set(users.values_list('id', flat=True))
+            rows = [row for row in rows if row[1] in scoped]
+        bulk.insert_rows(UserHierarchy, [
+            UserHierarchy(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=level)
+            for ancestor_id, descendant_id, level in rows
+        ])
+    return len(rows), cyclic
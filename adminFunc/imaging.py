@@ -0,0 +1,43 @@
+"""Receipt image downscaling.
+
+Kept free of Django imports so it can run in ``spawn``-ed worker processes.
+"""
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+
+def render(source, targets, quality=80):
+    """Write downscaled copies of ``source``; returns the paths written.
+
+    ``targets`` is a list of ``(path, (max_width, max_height), format)``,
+    largest first. The image is decoded once: ``draft()`` lets the JPEG
+    decoder skip straight to the smallest DCT scale that still covers the
+    largest target, and each smaller target is reduced from the previous one.
+    """
+    written = []
+    with Image.open(source) as image:
+        largest = targets[0][1]
+        image.draft('RGB', largest)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for path, size, image_format in targets:
+            image.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            _save_atomic(image, path, image_format, quality)
+            written.append(path)
+    return written
+
+
+def _save_atomic(image, path, image_format, quality):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, format=image_format, quality=quality, optimize=image_format == 'JPEG')
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
@@ -0,0 +1,291 @@
+"""Bulk expense import from CSV or XLSX files.
+
+Rows are streamed from the file and handled in chunks: each row is validated
+against employee/category maps loaded once per import, the chunk's expense
+numbers are reserved in one block, currencies are converted with one rate
+query per pair, PENDING rows are routed to approvers in memory, and
+expenses and their lines are written with ``bulk.insert_rows``
+(executemany). Counters and rollups are updated once per chunk.
+
+Columns (header names, case-insensitive):
+
+* ``employee`` - email, username or employee id (required)
+* ``category`` - category name (required)
+* ``amount``, ``expense_date`` (YYYY-MM-DD), ``description`` (required)
+* ``currency_code`` (defaults to the company currency), ``merchant_name``,
+  ``status``, ``employee_notes``
+* ``reference`` - consecutive rows with the same reference form one expense,
+  each contributing a line; ``line_description``, ``line_quantity``,
+  ``line_unit_price`` and ``line_category`` describe the line. Without a
+  reference every row is its own expense, with a line if
+  ``line_description`` is given.
+
+An XLSX import needs the optional ``openpyxl`` package.
+"""
+import csv
+import io
+import time
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import approval_rules, bulk, exchange_rates, inbox, reference_data, stats
+from .models import Expense, ExpenseApproval, ExpenseLine, User
+
+IMPORT_STATUSES = ('DRAFT', 'PENDING', 'APPROVED', 'REJECTED', 'CANCELLED')
+REQUIRED_COLUMNS = ('employee', 'category', 'amount', 'expense_date', 'description')
+MAX_REPORTED_ERRORS = 1000
+MAX_AMOUNT = Decimal('1e10')  # Expense.amount has 12 digits, 2 of them decimals
+MAX_QUANTITY = Decimal('1e8')  # ExpenseLine.quantity has 10
+
+RowError = namedtuple('RowError', 'row message')
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.rows = 0
+        self.expenses = 0
+        self.lines = 0
+        self.unconverted = 0
+        self.error_count = 0
+        self.errors = []  # The first MAX_REPORTED_ERRORS RowErrors
+        self.seconds = 0.0
+
+    def add_error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(RowError(row, message))
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'expenses': self.expenses,
+            'lines': self.lines,
+            'unconverted': self.unconverted,
+            'error_count': self.error_count,
+            'errors': [error._asdict() for error in self.errors],
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows / self.seconds) if self.seconds else None,
+        }
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def read_csv(file):
+    """``(row_number, row)`` pairs from a binary CSV file; the header is row 1"""
+    reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    header = [column.strip().lower() for column in next(reader, [])]
+    for row_number, values in enumerate(reader, start=2):
+        if any(values):
+            yield row_number, dict(zip(header, (value.strip() for value in values)))
+
+
+def read_xlsx(file):
+    """``(row_number, row)`` pairs from the first sheet of an XLSX workbook"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX import needs 'pip install openpyxl'; upload a CSV file instead")
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [_cell(column).lower() for column in next(rows, ())]
+        for row_number, values in enumerate(rows, start=2):
+            if any(value is not None for value in values):
+                yield row_number, dict(zip(header, map(_cell, values)))
+    finally:
+        workbook.close()
+
+
+def read_rows(file, name):
+    if name.lower().endswith('.xlsx'):
+        return read_xlsx(file)
+    if name.lower().endswith('.csv'):
+        return read_csv(file)
+    raise ValueError(f"Unsupported import file: {name} (expected .csv or .xlsx)")
+
+
+def _decimal(value, name):
+    try:
+        number = Decimal(value.replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if not number.is_finite():
+        raise ValueError(f"Invalid {name}: {value!r}")
+    return number
+
+
+class ExpenseImporter:
+    """Imports rows for one company; reuse an instance only for that company"""
+
+    def __init__(self, company, default_status='APPROVED', chunk_size=5000, dry_run=False):
+        if default_status not in IMPORT_STATUSES:
+            raise ValueError(f"Invalid status: {default_status!r}")
+        self.company = company
+        self.default_status = default_status
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+
+        self.employees = {}
+        for user in User.objects.filter(company=company).only('id', 'email', 'username', 'employee_id', 'manager_id'):
+            for key in (user.employee_id, user.username, user.email):
+                if key:
+                    self.employees[key.lower()] = user
+        self.categories = {
+            category.name.lower(): category.id for category in reference_data.categories(company.pk).values()
+        }
+
+    def _lookup(self, mapping, value, name):
+        try:
+            return mapping[value.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown {name}: {value!r}")
+
+    def _build_expense(self, row):
+        missing = [column for column in REQUIRED_COLUMNS if not row.get(column)]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)}")
+        amount = _decimal(row['amount'], 'amount')
+        if not Decimal('0.01') <= amount < MAX_AMOUNT:
+            raise ValueError(f"Amount out of range: {row['amount']!r}")
+        try:
+            expense_date = date.fromisoformat(row['expense_date'][:10])
+        except ValueError:
+            raise ValueError(f"Invalid expense_date: {row['expense_date']!r}")
+        status = (row.get('status') or self.default_status).upper()
+        if status not in IMPORT_STATUSES:
+            raise ValueError(f"Invalid status: {row['status']!r}")
+
+        employee = self._lookup(self.employees, row['employee'], 'employee')
+        expense = Expense(
+            employee=employee,
+            company=self.company,
+            category_id=self._lookup(self.categories, row['category'], 'category'),
+            description=row['description'],
+            amount=amount.quantize(Decimal('0.01')),
+            currency_code=(row.get('currency_code') or self.company.currency_code).upper()[:10],
+            expense_date=expense_date,
+            merchant_name=row.get('merchant_name', '')[:255] or None,
+            employee_notes=row.get('employee_notes') or None,
+            # PENDING expenses start as drafts until routed
+            status='DRAFT' if status == 'PENDING' else status,
+            created_at=self._now,
+            updated_at=self._now,
+        )
+        if status in ('APPROVED', 'REJECTED', 'CANCELLED'):
+            expense.completed_at = self._now
+        return expense, status
+
+    def _build_line(self, row):
+        if not row.get('line_description'):
+            return None
+        quantity = _decimal(row.get('line_quantity') or '1', 'line_quantity')
+        unit_price = _decimal(row.get('line_unit_price') or row.get('amount', ''), 'line_unit_price')
+        total_amount = (quantity * unit_price).quantize(Decimal('0.01'))
+        if abs(quantity) >= MAX_QUANTITY or abs(unit_price) >= MAX_AMOUNT or abs(total_amount) >= MAX_AMOUNT:
+            raise ValueError(f"Line amount out of range: {row.get('line_quantity') or '1'} x {unit_price}")
+        category_id = self._lookup(self.categories, row['line_category'], 'line_category') if row.get('line_category') else None
+        return ExpenseLine(
+            description=row['line_description'][:255],
+            quantity=quantity,
+            unit_price=unit_price,
+            total_amount=total_amount,
+            category_id=category_id,
+        )
+
+    def _build(self, group, report):
+        """One expense from a group of rows; None (and the offending row reported) if any row is invalid"""
+        row_number, row = group[0]
+        try:
+            expense, status = self._build_expense(row)
+            lines = []
+            for row_number, row in group:
+                line = self._build_line(row)
+                if line is not None:
+                    lines.append(line)
+            if len(group) > 1:
+                # A multi-line expense is worth the sum of its lines; reported at the row completing it
+                amount = sum((line.total_amount for line in lines), Decimal(0)) or expense.amount
+                if not Decimal('0.01') <= amount < MAX_AMOUNT:
+                    raise ValueError(f"Total of the expense's lines out of range: {amount}")
+                expense.amount = amount
+        except (ValueError, KeyError) as e:
+            report.add_error(row_number, str(e))
+            return None
+        return expense, lines, status
+
+    def _groups(self, rows):
+        """Rows grouped into expenses: consecutive rows sharing a reference belong together"""
+        def key(item):
+            row_number, row = item
+            return row.get('reference') or f'\0{row_number}'
+        for _, group in groupby(rows, key=key):
+            yield list(group)
+
+    def _flush(self, built, report):
+        expenses = [expense for expense, _, _ in built]
+        report.unconverted += len(exchange_rates.convert_expenses(expenses, save=False))
+        # Routed before the INSERT so PENDING rows go in with their final status
+        pending = [expense for expense, _, status in built if status == 'PENDING']
+        _, approvals, _ = approval_rules.plan_routes(pending, self._now)
+
+        with transaction.atomic():
+            numbers = Expense.allocate_numbers(len(expenses), company=self.company)
+            for expense, number in zip(expenses, numbers):
+                expense.expense_number = number
+            bulk.insert_rows(Expense, expenses)
+            ids = dict(Expense.objects.filter(expense_number__in=numbers).values_list('expense_number', 'id'))
+
+            lines = []
+            for expense, expense_lines, _ in built:
+                expense.id = ids[expense.expense_number]
+                expense._state.adding = False
+                for line in expense_lines:
+                    line.expense_id = expense.id
+                    lines.append(line)
+            bulk.insert_rows(ExpenseLine, lines)
+            ExpenseApproval.objects.bulk_create(approvals, batch_size=1000)
+            stats.record_expense_transitions([(None, expense.stats_state()) for expense in expenses])
+            if self.dry_run:
+                transaction.set_rollback(True)
+        if approvals and not self.dry_run:
+            inbox.invalidate_counts(approval.approver_id for approval in approvals)
+        report.expenses += len(expenses)
+        report.lines += len(lines)
+
+    def run(self, rows):
+        """Import ``(row_number, row)`` pairs; returns an ImportReport"""
+        report = ImportReport()
+        started = time.monotonic()
+        self._now = timezone.now()
+        built = []
+        for group in self._groups(rows):
+            report.rows += len(group)
+            result = self._build(group, report)
+            if result is not None:
+                built.append(result)
+            if len(built) >= self.chunk_size:
+                self._flush(built, report)
+                built = []
+        if built:
+            self._flush(built, report)
+        report.seconds = time.monotonic() - started
+        return report
+
+
+def import_file(company, file, name, **options):
+    """Import an uploaded/opened binary file; raises ValueError for unreadable files"""
+    return ExpenseImporter(company, **options).run(read_rows(file, name))
@@ -0,0 +1,70 @@
+"""Approver inbox: pending ExpenseApproval rows at their expense's current step.
+
+The listing is a single query served by the partial ``(approver,
+step_number) WHERE status = 'PENDING'`` index, with the expense, employee and
+category joined in. Per-approver counts are cached, when the cache is shared
+by every process (``cache.shared()``), and dropped whenever a decision or a
+save of the expense moves one of the approver's expenses.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .cache import shared
+from .models import ExpenseApproval
+
+
+def _count_key(approver_id):
+    return f'inbox:count:{approver_id}'
+
+
+def pending_approvals(approver):
+    """Queryset of the approver's actionable approvals, oldest first"""
+    return (
+        ExpenseApproval.objects.filter(
+            approver=approver,
+            status='PENDING',
+            expense__status='PENDING',
+            step_number=F('expense__current_approval_step'),
+        )
+        .select_related('expense', 'expense__employee', 'expense__category')
+        .order_by('assigned_at', 'id')
+    )
+
+
+def pending_count(approver):
+    if not shared():
+        return pending_approvals(approver).order_by().count()
+    key = _count_key(approver.pk)
+    count = cache.get(key)
+    if count is None:
+        count = pending_approvals(approver).order_by().count()
+        cache.set(key, count, timeout=getattr(settings, 'INBOX_COUNT_CACHE_TIMEOUT', 300))
+    return count
+
+
+async def apending_count(approver):
+    """``pending_count`` for async views"""
+    if not shared():
+        return await pending_approvals(approver).order_by().acount()
+    key = _count_key(approver.pk)
+    count = await cache.aget(key)
+    if count is None:
+        count = await pending_approvals(approver).order_by().acount()
+        await cache.aset(key, count, timeout=getattr(settings, 'INBOX_COUNT_CACHE_TIMEOUT', 300))
+    return count
+
+
+def invalidate_counts(approver_ids):
+    if not shared():
+        return
+    cache.delete_many([_count_key(approver_id) for approver_id in set(approver_ids)])
+
+
+def invalidate_for_expenses(expense_ids):
+    """Drop counts for everyone routed on these expenses (their current step may have moved)"""
+    if not shared():
+        # Nothing is cached to drop
+        return
+    approver_ids = ExpenseApproval.objects.filter(expense_id__in=expense_ids).values_list('approver_id', flat=True)
+    invalidate_counts(approver_ids)
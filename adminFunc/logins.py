@@ -0,0 +1,185 @@
+"""Login pipeline: throttling and password hashing off the request thread.
+
+Every attempt is checked against two sliding-window failure counters, one per
+client IP and one per username. Each counter is kept in the shared cache as a
+count for the current and the previous fixed window, and the previous one is
+weighted by how much of it still overlaps the sliding window. With
+LOGIN_FAST_REJECT (the default) a throttled attempt is refused before any
+hashing. Otherwise it is hashed like any other attempt and then refused, so
+that response times do not reveal which usernames are throttled.
+
+``authenticate()`` (a PBKDF2 hash, by design slow) runs on a small bounded
+pool of LOGIN_HASH_WORKERS threads; hashlib releases the GIL while hashing.
+When LOGIN_HASH_QUEUE attempts are already in flight, new ones are refused as
+busy instead of queueing without bound, so a wave of attempts cannot take
+every request thread or core.
+"""
+import asyncio
+import contextvars
+import hashlib
+import math
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.db import close_old_connections
+
+# rejected: None, 'throttled' or 'busy'; retry_after in seconds
+LoginAttempt = namedtuple('LoginAttempt', 'user rejected retry_after')
+
+BUSY_RETRY_AFTER = 1
+
+
+def _window():
+    return getattr(settings, 'LOGIN_RATE_WINDOW', 300)
+
+
+def _limits():
+    return {
+        'ip': getattr(settings, 'LOGIN_MAX_FAILURES_PER_IP', 20),
+        'username': getattr(settings, 'LOGIN_MAX_FAILURES_PER_USERNAME', 5),
+    }
+
+
+def counter_keys(request, username):
+    """``{'ip': key, 'username': key}`` of the counters an attempt is checked against"""
+    normalized = (username or '').strip().lower()
+    return {
+        'ip': f"login:fail:ip:{request.META.get('REMOTE_ADDR') or 'unknown'}",
+        # Hashed: usernames are user input and cache keys have a restricted alphabet
+        'username': f"login:fail:user:{hashlib.sha256(normalized.encode()).hexdigest()}",
+    }
+
+
+def _bucket_keys(key, index):
+    return f'{key}:{index}', f'{key}:{index - 1}'
+
+
+def retry_after(keys, now=None):
+    """Seconds until no counter in ``keys`` is over its limit, 0 if none is now"""
+    window = _window()
+    now = time.time() if now is None else now
+    index, fraction = divmod(now / window, 1)
+    buckets = {name: _bucket_keys(key, int(index)) for name, key in keys.items()}
+    counts = cache.get_many([bucket for pair in buckets.values() for bucket in pair])
+    wait = None
+    for name, (current_key, previous_key) in buckets.items():
+        limit = _limits()[name]
+        current = counts.get(current_key, 0)
+        previous = counts.get(previous_key, 0)
+        if current + previous * (1 - fraction) < limit:
+            continue
+        if current < limit:
+            # Wait for the previous window's weight to decay
+            seconds = (1 - (limit - current) / previous - fraction) * window
+        else:
+            # Wait for this window to end and then decay in turn
+            seconds = (1 - fraction) * window + (1 - limit / current) * window
+        wait = max(wait or 0, seconds)
+    return 0 if wait is None else max(math.ceil(wait), 1)
+
+
+def record_failure(keys, now=None):
+    window = _window()
+    index = int((time.time() if now is None else now) // window)
+    for key in keys.values():
+        bucket = f'{key}:{index}'
+        # Two windows: the bucket is still read as the previous one
+        if not cache.add(bucket, 1, timeout=2 * window):
+            try:
+                cache.incr(bucket)
+            except ValueError:
+                cache.set(bucket, 1, timeout=2 * window)
+
+
+def record_success(keys, now=None):
+    """A successful login clears the username's failures (not the IP's)"""
+    index = int((time.time() if now is None else now) // _window())
+    cache.delete_many(_bucket_keys(keys['username'], index))
+
+
+class HashPool:
+    """Bounded thread pool that refuses work beyond a fixed number in flight"""
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._executor is None:
+                self._slots = threading.BoundedSemaphore(max(getattr(settings, 'LOGIN_HASH_QUEUE', 32), 1))
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(getattr(settings, 'LOGIN_HASH_WORKERS', 2), 1), thread_name_prefix='login-hash',
+                )
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """A Future for ``fn(*args, **kwargs)``, or None when the pool is full"""
+        executor = self._start()
+        if not self._slots.acquire(blocking=False):
+            return None
+        context = contextvars.copy_context()
+        try:
+            future = executor.submit(context.run, fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+pool = HashPool()
+
+
+def _authenticate(request, username, password):
+    try:
+        return authenticate(request, username=username, password=password)
+    finally:
+        # Pool threads live outside the request cycle that normally does this
+        close_old_connections()
+
+
+def _fast_reject():
+    return getattr(settings, 'LOGIN_FAST_REJECT', True)
+
+
+def _finish(keys, user, wait):
+    if wait:
+        return LoginAttempt(None, 'throttled', wait)
+    if user is None:
+        record_failure(keys)
+    else:
+        record_success(keys)
+    return LoginAttempt(user, None, 0)
+
+
+def attempt(request, username, password):
+    """Throttle-check and authenticate a login attempt; returns a ``LoginAttempt``"""
+    keys = counter_keys(request, username)
+    wait = retry_after(keys)
+    if wait and _fast_reject():
+        return LoginAttempt(None, 'throttled', wait)
+    future = pool.submit(_authenticate, request, username, password)
+    if future is None:
+        return LoginAttempt(None, 'busy', BUSY_RETRY_AFTER)
+    return _finish(keys, future.result(), wait)
+
+
+async def aattempt(request, username, password):
+    """``attempt`` for async views: waits for the hash without holding a thread"""
+    keys = counter_keys(request, username)
+    wait = await sync_to_async(retry_after)(keys)
+    if wait and _fast_reject():
+        return LoginAttempt(None, 'throttled', wait)
+    future = pool.submit(_authenticate, request, username, password)
+    if future is None:
+        return LoginAttempt(None, 'busy', BUSY_RETRY_AFTER)
+    user = await asyncio.wrap_future(future)
+    return await sync_to_async(_finish)(keys, user, wait)
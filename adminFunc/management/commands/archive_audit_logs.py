@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from adminFunc import audit_archive
+
+
+class Command(BaseCommand):
+    help = "Move audit log months older than AUDIT_HOT_MONTHS into compressed archive segments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hot-months', type=int, help="Months to keep in the hot table (default AUDIT_HOT_MONTHS)")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help="Only list the months that would be archived")
+
+    def handle(self, *args, **options):
+        cutoff = audit_archive.archive_cutoff(options['hot_months'])
+        months = audit_archive.archivable_months(cutoff)
+        if not months:
+            self.stdout.write(f"Nothing to archive before {cutoff:%Y-%m}")
+            return
+
+        for month in months:
+            if options['dry_run']:
+                self.stdout.write(f"Would archive {month:%Y-%m}")
+                continue
+            segment = audit_archive.archive_month(month, batch_size=options['batch_size'])
+            if segment is not None:
+                self.stdout.write(f"Archived {segment.row_count} rows for {month:%Y-%m} to {segment.path}")
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Archived {len(months)} months before {cutoff:%Y-%m}"))
@@ -0,0 +1,139 @@
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test.utils import override_settings
+
+from adminFunc.models import Company, Expense, ExpenseCategory, User
+from adminFunc.pagination import keyset_page
+from adminFunc.profiling import percentile
+from adminFunc.stats import get_company_stats
+
+# mode -> (settings overrides, database OPTIONS)
+MODES = {
+    'baseline': ({'SQLITE_PRODUCTION': False}, {}),
+    'tuned': ({'SQLITE_PRODUCTION': True}, {'transaction_mode': 'IMMEDIATE'}),
+}
+
+
+class Command(BaseCommand):
+    help = "Measure concurrent expense submissions and listings on a scratch SQLite database in each SQLite mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help="Threads submitting expenses")
+        parser.add_argument('--readers', type=int, default=4, help="Threads listing expenses")
+        parser.add_argument('--seconds', type=float, default=5.0, help="Duration of each run")
+        parser.add_argument('--mode', action='append', dest='modes', choices=list(MODES),
+                            help="Mode to run (repeatable; default all)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("benchmark_sqlite needs the SQLite database backend")
+        db_settings = connections.settings['default']
+        original = {key: db_settings.get(key) for key in ('NAME', 'OPTIONS')}
+        scratch = Path(tempfile.mkdtemp(prefix='benchmark_sqlite_'))
+        try:
+            template = scratch / 'template.sqlite3'
+            self._use_database(template, {})
+            call_command('migrate', verbosity=0, interactive=False)
+            self._seed()
+            connections.close_all()
+
+            self.stdout.write(f"{'mode':<14} {'writes/s':>9} {'write p95':>10} {'locked':>7} {'reads/s':>9} {'read p95':>9}")
+            for mode in options['modes'] or list(MODES):
+                overrides, db_options = MODES[mode]
+                path = scratch / f'{mode}.sqlite3'
+                shutil.copy(template, path)
+                self._use_database(path, db_options)
+                with override_settings(**overrides):
+                    result = self._run(options['writers'], options['readers'], options['seconds'])
+                connections.close_all()
+                self.stdout.write(
+                    f"{mode:<14} {result['writes'] / options['seconds']:>9.1f} {result['write_p95'] * 1000:>8.1f}ms "
+                    f"{result['locked']:>7} {result['reads'] / options['seconds']:>9.1f} {result['read_p95'] * 1000:>7.1f}ms"
+                )
+        finally:
+            connections.close_all()
+            db_settings.update(original)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def _use_database(self, path, db_options):
+        # Every thread's connection is built from this settings dict
+        connections.close_all()
+        db_settings = connections.settings['default']
+        db_settings['NAME'] = str(path)
+        db_settings['OPTIONS'] = dict(db_options)
+
+    def _seed(self):
+        company = Company.objects.create(name='Benchmark', country='Nowhere', currency_code='USD')
+        manager = User.objects.create_user('bench-manager', 'manager@bench.invalid', None, company=company, role='MANAGER')
+        for i in range(20):
+            User.objects.create_user(f'bench-{i}', f'{i}@bench.invalid', None, company=company, manager=manager)
+        ExpenseCategory.objects.create(company=company, name='Travel')
+
+    def _run(self, writers, readers, seconds):
+        company = Company.objects.get()
+        category = ExpenseCategory.objects.get()
+        employees = list(User.objects.filter(manager__isnull=False))
+        connection.close()
+
+        deadline = time.monotonic() + seconds
+        lock = threading.Lock()
+        result = {'writes': 0, 'reads': 0, 'locked': 0}
+        write_latencies = []
+        read_latencies = []
+
+        def submit(employee):
+            with transaction.atomic():
+                expense = Expense.objects.create(
+                    employee=employee, company=company, category=category, description='Benchmark',
+                    amount=Decimal('12.50'), currency_code='USD', expense_date=date.today(), status='PENDING',
+                )
+                expense.status = 'APPROVED'
+                expense.save(update_fields=['status', 'updated_at'])
+
+        def write_loop(employee):
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    submit(employee)
+                except OperationalError:
+                    with lock:
+                        result['locked'] += 1
+                    continue
+                with lock:
+                    result['writes'] += 1
+                    write_latencies.append(time.monotonic() - started)
+            connection.close()
+
+        def read_loop():
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    keyset_page(Expense.objects.filter(company=company), None, 50)
+                    get_company_stats(company)
+                except OperationalError:
+                    with lock:
+                        result['locked'] += 1
+                    continue
+                with lock:
+                    result['reads'] += 1
+                    read_latencies.append(time.monotonic() - started)
+            connection.close()
+
+        threads = [threading.Thread(target=write_loop, args=(employees[i % len(employees)],)) for i in range(writers)]
+        threads += [threading.Thread(target=read_loop) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result['write_p95'] = percentile(write_latencies, 0.95)
+        result['read_p95'] = percentile(read_latencies, 0.95)
+        return result
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from adminFunc import stats
+
+
+class Command(BaseCommand):
+    help = "Compare CompanyStats against the source tables and optionally repair drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="Only check this company id (repeatable)")
+        parser.add_argument('--repair', action='store_true', help="Rebuild the rows that drifted")
+
+    def handle(self, *args, **options):
+        drift = stats.find_drift(options['companies'])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Company stats are consistent"))
+            return
+
+        for company_id, fields in sorted(drift.items()):
+            details = ', '.join(f"{field}: {stored} != {actual}" for field, (stored, actual) in fields.items())
+            self.stdout.write(f"Company {company_id}: {details}")
+
+        if not options['repair']:
+            raise CommandError(f"Drift found for {len(drift)} companies (re-run with --repair)")
+        stats.rebuild(list(drift))
+        self.stdout.write(self.style.SUCCESS(f"Repaired stats for {len(drift)} companies"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from adminFunc import receipts
+
+
+class Command(BaseCommand):
+    help = "Compare receipt blob reference counts against expenses and optionally repair them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help="Reset drifted counts and delete unreferenced blobs")
+        parser.add_argument('--backfill', action='store_true',
+                            help="First move receipts stored before deduplication into blob storage")
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            migrated, missing = receipts.backfill()
+            self.stdout.write(f"Moved {migrated} receipts into blob storage")
+            for expense_number in missing:
+                self.stdout.write(self.style.WARNING(f"{expense_number}: receipt file is missing"))
+
+        drift = receipts.find_refcount_drift()
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Receipt reference counts are consistent"))
+            return
+
+        for blob_id, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f"Blob {blob_id}: ref_count {stored} != {actual}")
+
+        if not options['repair']:
+            raise CommandError(f"Drift found for {len(drift)} blobs (re-run with --repair)")
+        deleted = receipts.repair_refcounts(drift)
+        self.stdout.write(self.style.SUCCESS(f"Repaired {len(drift)} blobs, deleted {deleted} unreferenced"))
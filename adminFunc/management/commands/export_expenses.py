@@ -0,0 +1,65 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from adminFunc import exporter
+from adminFunc.filters import filter_expenses
+from adminFunc.models import Company, Expense
+
+
+class Command(BaseCommand):
+    help = "Export a company's expenses with their lines, approvals and comments to a CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('company', type=int, help="Company id")
+        parser.add_argument('output', help="Output file; a .gz suffix compresses it")
+        parser.add_argument('--format', choices=exporter.EXPORT_FORMATS,
+                            help="Default: jsonl for .jsonl[.gz] files, csv otherwise")
+        parser.add_argument('--cursor', help="Resume after this record's cursor, appending to the output")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--status')
+        parser.add_argument('--date-from', help="YYYY-MM-DD")
+        parser.add_argument('--date-to', help="YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        company = Company.objects.filter(pk=options['company']).first()
+        if company is None:
+            raise CommandError(f"Company {options['company']} does not exist")
+        path = options['output']
+        compress = path.endswith('.gz')
+        export_format = options['format'] or ('jsonl' if path.removesuffix('.gz').endswith('.jsonl') else 'csv')
+        cursor = options['cursor']
+
+        params = {key: options[key] for key in ('status', 'date_from', 'date_to') if options[key]}
+        try:
+            rows = exporter.records(filter_expenses(Expense.objects.filter(company=company), params),
+                                    cursor, options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # The cursor of the row being encoded, and of the last row written out
+        progress = {'pending': cursor, 'written': cursor, 'count': 0}
+
+        def tracked():
+            for row in rows:
+                progress['pending'] = row['cursor']
+                yield row
+
+        opener = gzip.open if compress else open
+        # Appending to a .gz file adds a gzip member; readers treat the members as one stream
+        mode = 'at' if cursor else 'wt'
+        try:
+            with opener(path, mode, encoding='utf-8', newline='') as f:
+                for piece in exporter.encode(tracked(), export_format, header=cursor is None):
+                    f.write(piece)
+                    if progress['written'] != progress['pending']:
+                        progress['written'] = progress['pending']
+                        progress['count'] += 1
+        except (KeyboardInterrupt, Exception) as e:
+            if progress['written'] is None:
+                raise
+            raise CommandError(
+                f"Export stopped after {progress['count']} expenses ({type(e).__name__}: {e}); "
+                f"resume with --cursor {progress['written']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Exported {progress['count']} expenses to {path}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from adminFunc import thumbnails
+from adminFunc.models import ReceiptBlob
+
+
+class Command(BaseCommand):
+    help = "Render receipt thumbnails/previews missing at the current THUMBNAIL_VERSION"
+
+    def handle(self, *args, **options):
+        rendered, failed = thumbnails.regenerate(ReceiptBlob.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"Rendered thumbnails for {rendered} receipts"))
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} receipts could not be read as images"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from adminFunc import importer
+from adminFunc.models import Company
+
+
+class Command(BaseCommand):
+    help = "Bulk import a company's expenses from a CSV or XLSX file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('company', type=int, help="Company id")
+        parser.add_argument('file')
+        parser.add_argument('--status', default='APPROVED', choices=importer.IMPORT_STATUSES,
+                            help="Status for rows without a status column (default APPROVED)")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help="Validate and write, then roll back")
+
+    def handle(self, *args, **options):
+        company = Company.objects.filter(pk=options['company']).first()
+        if company is None:
+            raise CommandError(f"Company {options['company']} does not exist")
+
+        try:
+            with open(options['file'], 'rb') as f:
+                report = importer.import_file(
+                    company, f, options['file'],
+                    default_status=options['status'], chunk_size=options['chunk_size'], dry_run=options['dry_run'],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in report.errors:
+            self.stdout.write(self.style.WARNING(f"Row {error.row}: {error.message}"))
+        if report.error_count > len(report.errors):
+            self.stdout.write(self.style.WARNING(f"... and {report.error_count - len(report.errors)} more errors"))
+        if report.unconverted:
+            self.stdout.write(self.style.WARNING(f"{report.unconverted} expenses have no exchange rate yet"))
+        summary = report.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Validated' if options['dry_run'] else 'Imported'} {report.expenses} expenses with {report.lines} lines "
+            f"from {report.rows} rows in {summary['seconds']}s ({summary['rows_per_second']} rows/s)"
+        ))
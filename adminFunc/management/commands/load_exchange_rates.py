@@ -0,0 +1,73 @@
+import csv
+import json
+from datetime import date
+from decimal import InvalidOperation
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from adminFunc import exchange_rates
+
+
+def _rows_from_csv(path):
+    """CSV with base_currency,target_currency,rate,date columns"""
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield row['base_currency'], row['target_currency'], row['rate'], date.fromisoformat(row['date'])
+
+
+def _rows_from_payload(payload):
+    """Feed-style ``{"base", "date", "rates": {...}}`` objects, or lists of them / of rows"""
+    if isinstance(payload, list):
+        for item in payload:
+            yield from _rows_from_payload(item)
+    elif 'rates' in payload:
+        rate_date = date.fromisoformat(payload['date'])
+        for target, rate in payload['rates'].items():
+            yield payload['base'], target, rate, rate_date
+    else:
+        yield (
+            payload['base_currency'], payload['target_currency'],
+            payload['rate'], date.fromisoformat(payload['date']),
+        )
+
+
+def _rows_from_json(path):
+    with open(path, encoding='utf-8') as f:
+        yield from _rows_from_payload(json.load(f))
+
+
+class Command(BaseCommand):
+    help = "Load exchange rates from CSV or JSON files into CurrencyExchangeRate"
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        for name in options['files']:
+            path = Path(name)
+            if path.suffix.lower() == '.csv':
+                rows = _rows_from_csv(path)
+            elif path.suffix.lower() == '.json':
+                rows = _rows_from_json(path)
+            else:
+                raise CommandError(f"Unsupported rate file: {path} (expected .csv or .json)")
+
+            batch = []
+            try:
+                for row in rows:
+                    if row[0].upper() == row[1].upper():
+                        continue
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        total += exchange_rates.store_rates(batch)
+                        batch = []
+                total += exchange_rates.store_rates(batch)
+            except (OSError, KeyError, ValueError, InvalidOperation) as e:
+                raise CommandError(f"Error reading {path}: {e}")
+            self.stdout.write(f"Loaded {path}")
+
+        self.stdout.write(self.style.SUCCESS(f"Stored {total} exchange rates"))
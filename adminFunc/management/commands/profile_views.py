@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from adminFunc import profiling
+from adminFunc.models import User
+
+
+class Command(BaseCommand):
+    help = "Request pages as a user and report per-view latency percentiles, query counts and budget overruns"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Paths to GET, e.g. /admin/dashboard/")
+        parser.add_argument('--user', required=True, help="Email or username to sign in as")
+        parser.add_argument('--requests', type=int, default=20, help="Requests per path after one warm-up request")
+        parser.add_argument('--strict', action='store_true', help="Fail when a request goes over its budget")
+
+    def handle(self, *args, **options):
+        user = User.all_objects.filter(email=options['user']).first() or \
+            User.all_objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"No user {options['user']!r}")
+
+        client = Client()
+        client.force_login(user)
+        with override_settings(PROFILING=True, PROFILING_BUDGET_ACTION='warn', ALLOWED_HOSTS=['testserver']):
+            for path in options['paths']:
+                # Warm caches first; only the measured requests are reported
+                response = client.get(path)
+                if response.status_code >= 400:
+                    raise CommandError(f"GET {path} returned {response.status_code}")
+            profiling.stats.reset()
+            for path in options['paths']:
+                for _ in range(options['requests']):
+                    client.get(path)
+            snapshot = profiling.stats.snapshot()
+
+        self.stdout.write(
+            f"{'view':<36} {'reqs':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'db p95':>8} {'over':>5}"
+        )
+        for view, row in snapshot.items():
+            self.stdout.write(
+                f"{view:<36} {row['requests']:>5} {row['p50_ms']:>6.1f}ms {row['p95_ms']:>6.1f}ms "
+                f"{row['p99_ms']:>6.1f}ms {row['max_queries']:>8} {row['p95_db_ms']:>6.1f}ms {row['over_budget']:>5}"
+            )
+        over = sum(row['over_budget'] for row in snapshot.values())
+        if over and options['strict']:
+            raise CommandError(f"{over} requests went over budget")
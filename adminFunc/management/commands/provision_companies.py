@@ -0,0 +1,33 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from adminFunc import provisioning
+
+
+class Command(BaseCommand):
+    help = "Provision companies from a JSON or JSON Lines file of tenants, using a company template"
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Tenants: name, country and optional currency_code, domain, users")
+        parser.add_argument('--template', help="Template JSON file (default: the signup categories)")
+        parser.add_argument('--batch-size', type=int, default=100, help="Companies per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and write, then roll back")
+
+    def handle(self, *args, **options):
+        try:
+            template = provisioning.load_template(options['template']) if options['template'] else None
+            # Batches commit one by one, except in a dry run
+            with open(options['file'], 'rb') as f, transaction.atomic() if options['dry_run'] else nullcontext():
+                results, seconds = provisioning.provision_file(f, template, options['batch_size'])
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        users = sum(len(result.users) for result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Validated' if options['dry_run'] else 'Provisioned'} {len(results)} companies with {users} users "
+            f"in {seconds:.2f}s ({len(results) / seconds if seconds else 0:.0f} companies/s)"
+        ))
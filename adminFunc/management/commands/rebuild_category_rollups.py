@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from adminFunc import rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-category day/month expense rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="Only rebuild this company id (repeatable)")
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild(options['companies'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} category rollup buckets"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from adminFunc import stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized dashboard counters (CompanyStats)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="Only rebuild this company id (repeatable)")
+
+    def handle(self, *args, **options):
+        count = stats.rebuild(options['companies'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} companies"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from adminFunc import hierarchy
+
+
+class Command(BaseCommand):
+    help = "Recompute the manager hierarchy index (user_hierarchy) from User.manager"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="Only rebuild this company id (repeatable)")
+
+    def handle(self, *args, **options):
+        count, cyclic = hierarchy.rebuild(options['companies'])
+        if cyclic:
+            self.stdout.write(self.style.WARNING(
+                f"{len(cyclic)} users are in a manager cycle: {', '.join(map(str, sorted(cyclic)[:20]))}"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} hierarchy rows"))
@@ -0,0 +1,37 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from adminFunc import ocr
+
+
+class Command(BaseCommand):
+    help = "Work off queued receipt OCR jobs in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help="Extractor processes (default: CPU count)")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Seconds between polls for new jobs")
+        parser.add_argument('--drain', action='store_true',
+                            help="Exit once no runnable jobs are left instead of polling forever")
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help="First queue jobs for expenses with a receipt but no OCR data")
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            self.stdout.write(f"Queued {ocr.submit_missing()} OCR jobs")
+
+        worker = ocr.Worker(options['processes'], options['poll_interval'], drain=options['drain'])
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after the running jobs finish")
+            worker.stopped = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f"OCR worker {worker.worker_id} running {worker.processes} processes")
+        processed = worker.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed['done'] + processed['failed']} jobs "
+            f"({processed['done']} done, {processed['failed']} failed attempts)"
+        ))
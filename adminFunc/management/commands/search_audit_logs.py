@@ -0,0 +1,45 @@
+import json
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from adminFunc import audit_archive
+
+
+def _parse_datetime(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: {value!r}")
+    if len(value) == 10:
+        parsed = datetime.combine(parsed.date(), time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Search audit logs across the hot table and archived segments, printing JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help="Inclusive start date/datetime (ISO 8601)")
+        parser.add_argument('--to', dest='end', help="Exclusive end date/datetime (ISO 8601)")
+        parser.add_argument('--company', type=int)
+        parser.add_argument('--model', dest='model_name')
+        parser.add_argument('--object-id', type=int)
+        parser.add_argument('--user', type=int, dest='user_id')
+        parser.add_argument('--action')
+
+    def handle(self, *args, **options):
+        rows = audit_archive.search(
+            start=_parse_datetime(options['start']) if options['start'] else None,
+            end=_parse_datetime(options['end']) if options['end'] else None,
+            company_id=options['company'],
+            model_name=options['model_name'],
+            object_id=options['object_id'],
+            user_id=options['user_id'],
+            action=options['action'].upper() if options['action'] else None,
+        )
+        for row in rows:
+            self.stdout.write(json.dumps(row, cls=audit_archive.ArchiveEncoder))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from adminFunc import countries
+
+
+class Command(BaseCommand):
+    help = "Refresh the country -> currency table and write it to the snapshot file"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--offline', action='store_true',
+            help="Do not contact restcountries.com; snapshot the bundled data only",
+        )
+        parser.add_argument('--output', help="Snapshot path (defaults to COUNTRY_CURRENCY_SNAPSHOT)")
+        parser.add_argument('--timeout', type=float, help="Upstream read timeout in seconds")
+
+    def handle(self, *args, **options):
+        entries = countries.current_entries()
+
+        if not options['offline']:
+            timeout = (3.05, options['timeout']) if options['timeout'] else None
+            try:
+                upstream = countries.fetch_upstream_entries(timeout=timeout)
+            except Exception as e:
+                raise CommandError(f"Error fetching upstream currencies: {e}")
+            entries = countries.merge_entries(entries, upstream)
+            self.stdout.write(f"Fetched {len(upstream)} countries from upstream")
+
+        path = countries.write_snapshot(entries, options['output'])
+        countries.clear_cache()
+        # Pre-warm the index so a long-running caller (e.g. a shell) is ready
+        for entry in entries:
+            countries.resolve_currency(entry['name'])
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(entries)} countries to {path}"))
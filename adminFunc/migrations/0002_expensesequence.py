@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('last_value', models.BigIntegerField(default=0)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expense_sequences', to='adminFunc.company')),
+            ],
+            options={
+                'db_table': 'expense_sequences',
+                'constraints': [models.UniqueConstraint(fields=('company', 'year'), name='unique_expense_sequence_company_year'), models.UniqueConstraint(condition=models.Q(('company__isnull', True)), fields=('year',), name='unique_expense_sequence_global_year')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0002_expensesequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyStats',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='adminFunc.company')),
+                ('total_expenses', models.IntegerField(default=0)),
+                ('draft_expenses', models.IntegerField(default=0)),
+                ('pending_expenses', models.IntegerField(default=0)),
+                ('approved_expenses', models.IntegerField(default=0)),
+                ('rejected_expenses', models.IntegerField(default=0)),
+                ('cancelled_expenses', models.IntegerField(default=0)),
+                ('pending_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('approved_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_users', models.IntegerField(default=0)),
+                ('admin_users', models.IntegerField(default=0)),
+                ('manager_users', models.IntegerField(default=0)),
+                ('employee_users', models.IntegerField(default=0)),
+                ('active_approval_rules', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Company Stats',
+                'db_table': 'company_stats',
+            },
+        ),
+    ]
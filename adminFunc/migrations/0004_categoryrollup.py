@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0003_companystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('MONTH', 'Month')], max_length=10)),
+                ('bucket_start', models.DateField()),
+                ('approved_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('approved_count', models.IntegerField(default=0)),
+                ('rejected_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('rejected_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='adminFunc.expensecategory')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_rollups', to='adminFunc.company')),
+            ],
+            options={
+                'db_table': 'category_rollups',
+                'unique_together': {('company', 'period', 'bucket_start', 'category')},
+            },
+        ),
+    ]
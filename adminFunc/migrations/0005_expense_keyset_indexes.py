@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0004_categoryrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['company', 'created_at', 'id'], name='expenses_company_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['company', 'status', 'created_at', 'id'], name='expenses_co_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0005_expense_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expenseapproval',
+            index=models.Index(fields=['approver', 'status', 'step_number'], name='exp_appr_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseapproval',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['approver', 'step_number'], name='exp_appr_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0006_expense_approval_inbox_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('path', models.CharField(max_length=500)),
+                ('row_count', models.IntegerField()),
+                ('min_created_at', models.DateTimeField()),
+                ('max_created_at', models.DateTimeField()),
+                ('min_object_id', models.BigIntegerField()),
+                ('max_object_id', models.BigIntegerField()),
+                ('object_ranges', models.JSONField(default=dict)),
+                ('company_ids', models.JSONField(default=list)),
+                ('sha256', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'audit_log_segments',
+                'ordering': ['month', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['created_at'], name='audit_logs_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlogsegment',
+            index=models.Index(fields=['min_created_at', 'max_created_at'], name='audit_log_s_min_cre_fb7d0c_idx'),
+        ),
+    ]
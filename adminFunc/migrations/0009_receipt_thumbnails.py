@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0008_receipt_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receiptblob',
+            name='thumbnails_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:58
+
+import adminFunc.models
+import django.contrib.auth.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0010_ocr_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', adminFunc.models.CompanyScopedUserManager()),
+                ('all_objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+    ]
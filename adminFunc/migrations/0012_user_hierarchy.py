@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_hierarchy(apps, schema_editor):
+    # The same closure rows as adminFunc.hierarchy.rebuild(); users in a manager cycle keep the chain below it
+    User = apps.get_model('adminFunc', 'User')
+    UserHierarchy = apps.get_model('adminFunc', 'UserHierarchy')
+    managers = dict(User.all_objects.values_list('id', 'manager_id'))
+    rows = []
+    for user_id in managers:
+        rows.append(UserHierarchy(ancestor_id=user_id, descendant_id=user_id, depth=0))
+        seen = {user_id}
+        ancestor_id = managers.get(user_id)
+        level = 1
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append(UserHierarchy(ancestor_id=ancestor_id, descendant_id=user_id, depth=level))
+            ancestor_id = managers.get(ancestor_id)
+            level += 1
+    UserHierarchy.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0011_company_scoped_managers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserHierarchy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to=settings.AUTH_USER_MODEL)),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_hierarchy',
+                'indexes': [models.Index(fields=['ancestor', 'depth', 'descendant'], name='user_hier_ancestor_idx'), models.Index(fields=['descendant', 'depth', 'ancestor'], name='user_hier_descendant_idx')],
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.RunPython(build_hierarchy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+"""PostgreSQL-only indexes, built with CREATE INDEX CONCURRENTLY.
+
+They are not declared on the models (SQLite has no GIN/BRIN), so Django's
+migration state does not track them; on other databases this migration does
+nothing. The builds run without DB_STATEMENT_TIMEOUT, and an index a failed
+run left INVALID is dropped and built again.
+"""
+from django.db import migrations
+
+POSTGRES_INDEXES = [
+    # JSON containment lookups (receipt_ocr_data__contains / metadata__contains)
+    ('expenses_ocr_data_gin', 'expenses USING gin (receipt_ocr_data jsonb_path_ops)'),
+    ('audit_logs_metadata_gin', 'audit_logs USING gin (metadata jsonb_path_ops)'),
+    # Append-only timestamps: block ranges are a fraction of a B-tree's size
+    ('audit_logs_created_brin', 'audit_logs USING brin (created_at)'),
+    ('expenses_created_brin', 'expenses USING brin (created_at)'),
+    # ocr.submit_missing: receipts still waiting for OCR
+    ('expenses_ocr_missing_idx', 'expenses (id) WHERE receipt_blob_id IS NOT NULL AND receipt_ocr_data IS NULL'),
+    # ocr.claim / ocr.requeue_stale only ever look at queued or running jobs
+    ('ocr_jobs_queued_idx', "ocr_jobs (run_after, id) WHERE status = 'QUEUED'"),
+    ('ocr_jobs_running_idx', "ocr_jobs (company_id, locked_at) WHERE status = 'RUNNING'"),
+]
+
+
+def _index_valid(schema_editor, name):
+    """True for a usable index, False for one a failed build left INVALID, None if there is none"""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)',
+            [name],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # DB_STATEMENT_TIMEOUT would cancel builds on large tables
+    schema_editor.execute('SET statement_timeout = 0')
+    try:
+        for name, definition in POSTGRES_INDEXES:
+            valid = _index_valid(schema_editor, name)
+            if valid:
+                continue
+            if valid is False:
+                # A cancelled CONCURRENTLY build leaves an INVALID index behind
+                schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            schema_editor.execute(f'CREATE INDEX CONCURRENTLY {name} ON {definition}')
+    finally:
+        schema_editor.execute('RESET statement_timeout')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('SET statement_timeout = 0')
+    try:
+        for name, _ in POSTGRES_INDEXES:
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    finally:
+        schema_editor.execute('RESET statement_timeout')
+
+
+class Migration(migrations.Migration):
+    # CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('adminFunc', '0012_user_hierarchy'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_company(apps, schema_editor):
+    # Rows whose user is already gone stay without a company
+    AuditLog = apps.get_model('adminFunc', 'AuditLog')
+    User = apps.get_model('adminFunc', 'User')
+    AuditLog.objects.filter(company__isnull=True, user__isnull=False).update(
+        company_id=Subquery(User.objects.filter(pk=OuterRef('user_id')).values('company_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0013_postgres_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='company',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='audit_logs', to='adminFunc.company'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['company', 'created_at'], name='audit_logs_company_created_idx'),
+        ),
+        migrations.RunPython(backfill_company, migrations.RunPython.noop),
+    ]
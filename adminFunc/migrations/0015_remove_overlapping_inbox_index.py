@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminFunc', '0014_audit_log_company'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='expenseapproval',
+            name='exp_appr_inbox_idx',
+        ),
+    ]
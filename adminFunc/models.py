@@ -1,9 +1,32 @@
-from django.db import models
-from django.contrib.auth.models import AbstractUser
+import re
+from collections import namedtuple
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.conf import settings
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from decimal import Decimal
 
+from .tenancy import current_company_id
+
+
+class CompanyScopedManager(models.Manager):
+    """Default manager that limits queries to the active tenant (see ``adminFunc.tenancy``)"""
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        company_id = current_company_id()
+        if company_id is None:
+            return queryset
+        return queryset.filter(company_id=company_id)
+
+
+class CompanyScopedUserManager(CompanyScopedManager, UserManager):
+    pass
+
 
 class User(AbstractUser):
     """Extended User model with role-based access"""
@@ -22,6 +45,9 @@ class User(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CompanyScopedUserManager()
+    all_objects = UserManager()
+    
     # Fix for AbstractUser clash
     groups = models.ManyToManyField(
         'auth.Group',
@@ -43,6 +69,54 @@ class User(AbstractUser):
         
     def __str__(self):
         return f"{self.get_full_name()} ({self.role})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded state so signal handlers can compute deltas
+        instance._loaded_stats = instance.stats_state()
+        if 'manager_id' in instance.__dict__:
+            instance._loaded_manager_id = instance.manager_id
+        return instance
+    
+    def save(self, *args, **kwargs):
+        manager_id = self.__dict__.get('manager_id')
+        if self.pk and manager_id is not None and manager_id != getattr(self, '_loaded_manager_id', None):
+            from .hierarchy import is_subordinate
+            if manager_id == self.pk or is_subordinate(manager_id, self.pk):
+                raise ValidationError({'manager': "A user cannot report to themselves or to one of their reports"})
+        super().save(*args, **kwargs)
+    
+    def stats_state(self):
+        """(company_id, role) as counted in CompanyStats, None if deferred"""
+        if {'company_id', 'role'} - self.__dict__.keys():
+            return None
+        return (self.company_id, self.role)
+
+
+class UserHierarchy(models.Model):
+    """Closure table over ``User.manager``: one row per (ancestor, descendant) pair.
+    
+    Every user has a depth-0 row for itself; a direct report is at depth 1.
+    Maintained by ``adminFunc.hierarchy``.
+    """
+    
+    ancestor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        db_table = 'user_hierarchy'
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            # Subtree of a manager, optionally limited in depth
+            models.Index(fields=['ancestor', 'depth', 'descendant'], name='user_hier_ancestor_idx'),
+            # Management chain of a user, nearest first
+            models.Index(fields=['descendant', 'depth', 'ancestor'], name='user_hier_descendant_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
 
 
 class Company(models.Model):
@@ -73,6 +147,9 @@ class ExpenseCategory(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = CompanyScopedManager()
+    all_objects = models.Manager()
+    
     class Meta:
         db_table = 'expense_categories'
         verbose_name_plural = 'Expense Categories'
@@ -82,6 +159,30 @@ class ExpenseCategory(models.Model):
         return self.name
 
 
+class ReceiptBlob(models.Model):
+    """A stored receipt file, content-addressed by its SHA-256 and shared by every expense that uses it"""
+    
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)  # receipts/sha256/ab/cd/<sha256><ext>
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100, blank=True)
+    ref_count = models.IntegerField(default=0)  # Expenses pointing at this blob
+    thumbnails_version = models.IntegerField(default=0)  # THUMBNAIL_VERSION the derivatives were rendered at
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'receipt_blobs'
+        
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes, {self.ref_count} refs)"
+
+
+ExpenseStatsState = namedtuple('ExpenseStatsState', 'company_id status amount category_id expense_date')
+
+# What converted_amount and conversion_rate are computed from
+CONVERSION_FIELDS = ('amount', 'currency_code', 'expense_date')
+
+
 class Expense(models.Model):
     """Main expense model for employee expense claims"""
     
@@ -105,7 +206,7 @@ class Expense(models.Model):
     
     # Converted amount in company's default currency
     converted_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
-    conversion_rate = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
+    conversion_rate = models.DecimalField(max_digits=18, decimal_places=6, null=True, blank=True)
     
     expense_date = models.DateField()
     merchant_name = models.CharField(max_length=255, blank=True, null=True)  # For OCR extraction
@@ -116,6 +217,7 @@ class Expense(models.Model):
     
     # Receipt management
     receipt_image = models.FileField(upload_to='receipts/%Y/%m/', blank=True, null=True)  # Changed to FileField
+    receipt_blob = models.ForeignKey(ReceiptBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='expenses')
     receipt_ocr_data = models.JSONField(blank=True, null=True)  # Store OCR extracted data
     
     # Comments and notes
@@ -127,6 +229,9 @@ class Expense(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CompanyScopedManager()
+    all_objects = models.Manager()
+    
     class Meta:
         db_table = 'expenses'
         ordering = ['-created_at']
@@ -134,28 +239,153 @@ class Expense(models.Model):
             models.Index(fields=['status', 'employee']),
             models.Index(fields=['expense_number']),
             models.Index(fields=['company', 'status']),
+            # Keyset pagination on (created_at, id), optionally by status
+            models.Index(fields=['company', 'created_at', 'id'], name='expenses_company_created_idx'),
+            models.Index(fields=['company', 'status', 'created_at', 'id'], name='expenses_co_status_created_idx'),
         ]
+        # PostgreSQL also gets GIN, BRIN and partial indexes from migration 0013
         
     def __str__(self):
         return f"{self.expense_number} - {self.employee.get_full_name()} - {self.amount} {self.currency_code}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded state so signal handlers can compute deltas
+        instance._loaded_stats = instance.stats_state()
+        # and so save() can tell when the conversion went stale
+        instance._loaded_conversion = instance.conversion_inputs()
+        return instance
+    
+    @property
+    def company_amount(self):
+        """Amount in the company currency (falls back to the raw amount until converted)"""
+        return self.converted_amount if self.converted_amount is not None else self.amount
+    
+    def stats_state(self):
+        """What CompanyStats and CategoryRollup count for this expense, None if deferred"""
+        if {'company_id', 'status', 'amount', 'converted_amount', 'category_id', 'expense_date'} - self.__dict__.keys():
+            return None
+        return ExpenseStatsState(self.company_id, self.status, self.company_amount, self.category_id, self.expense_date)
+    
+    def conversion_inputs(self):
+        """(amount, currency_code, expense_date), None if any is deferred"""
+        if set(CONVERSION_FIELDS) - self.__dict__.keys():
+            return None
+        return tuple(getattr(self, field) for field in CONVERSION_FIELDS)
+    
     def save(self, *args, **kwargs):
         # Auto-generate expense number if not set
         if not self.expense_number:
-            year = timezone.now().year
-            last_expense = Expense.objects.filter(
-                expense_number__startswith=f'EXP-{year}-'
-            ).order_by('-expense_number').first()
-            
-            if last_expense:
-                last_number = int(last_expense.expense_number.split('-')[-1])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.expense_number = f'EXP-{year}-{new_number:04d}'
+            self.expense_number = Expense.allocate_numbers(1, company=self.company)[0]
         
+        # Convert into the company currency when a rate is known, but only
+        # when a conversion input is among the fields saved: status-only saves
+        # on the approval paths never look up rates. A loaded expense whose
+        # amount, currency or date changed is converted again.
+        update_fields = kwargs.get('update_fields')
+        converting = update_fields is None or bool(set(CONVERSION_FIELDS) & set(update_fields))
+        inputs = self.conversion_inputs()
+        loaded = getattr(self, '_loaded_conversion', None)
+        stale = loaded is not None and inputs != loaded
+        if converting and (self.converted_amount is None or stale) and self.company_id and self.expense_date:
+            from .exchange_rates import apply_conversion
+            converted = apply_conversion(self)
+            if not converted and stale:
+                # No rate for the new values: fall back to the raw amount
+                self.converted_amount = self.conversion_rate = None
+            if (converted or stale) and update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'converted_amount', 'conversion_rate'}
+
         super().save(*args, **kwargs)
+        if converting and inputs is not None:
+            self._loaded_conversion = inputs
+    
+    @staticmethod
+    def allocate_numbers(count, company=None, year=None):
+        """Reserve ``count`` consecutive expense numbers in one round trip.
+        
+        Numbers are global unless EXPENSE_NUMBER_PER_COMPANY is enabled, in
+        which case each company gets its own sequence and a ``C<id>`` segment
+        keeps the numbers unique across companies.
+        """
+        year = year or timezone.now().year
+        if not getattr(settings, 'EXPENSE_NUMBER_PER_COMPANY', False):
+            company = None
+        first = ExpenseSequence.objects.reserve(year, count, company=company)
+        prefix = ExpenseSequence.number_prefix(year, company)
+        return [f'{prefix}{value:04d}' for value in range(first, first + count)]
+
+
+class ExpenseSequenceManager(models.Manager):
+    
+    def reserve(self, year, count=1, company=None):
+        """Atomically reserve ``count`` numbers and return the first one"""
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        
+        sequence = self.filter(company=company, year=year)
+        with transaction.atomic(using=self.db):
+            # The UPDATE takes the row (or, on SQLite, database) write lock
+            # before we read the value back, so concurrent callers serialize
+            if not sequence.update(last_value=F('last_value') + count):
+                try:
+                    with transaction.atomic(using=self.db):
+                        self.create(
+                            company=company,
+                            year=year,
+                            last_value=self.model.seed_value(year, company) + count,
+                        )
+                except IntegrityError:
+                    # Another transaction created the row first
+                    sequence.update(last_value=F('last_value') + count)
+            last_value = sequence.values_list('last_value', flat=True).get()
+        return last_value - count + 1
+
+
+class ExpenseSequence(models.Model):
+    """Per-year (optionally per-company) counter backing expense numbers"""
+    
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='expense_sequences', null=True, blank=True)
+    year = models.IntegerField()
+    last_value = models.BigIntegerField(default=0)
+    
+    objects = ExpenseSequenceManager()
+    
+    class Meta:
+        db_table = 'expense_sequences'
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'year'], name='unique_expense_sequence_company_year'),
+            models.UniqueConstraint(
+                fields=['year'],
+                condition=models.Q(company__isnull=True),
+                name='unique_expense_sequence_global_year',
+            ),
+        ]
+        
+    def __str__(self):
+        return f"{self.number_prefix(self.year, self.company_id)}{self.last_value}"
+    
+    @staticmethod
+    def number_prefix(year, company=None):
+        company_id = getattr(company, 'pk', company)
+        if company_id is None:
+            return f'EXP-{year}-'
+        return f'EXP-{year}-C{company_id}-'
+    
+    @classmethod
+    def seed_value(cls, year, company=None):
+        """Highest number already issued for the sequence (compared numerically)"""
+        prefix = cls.number_prefix(year, company)
+        pattern = re.compile(rf'^{re.escape(prefix)}(\d+)$')
+        # Unscoped: a global sequence seeded inside a tenant must see every company's numbers
+        numbers = Expense.all_objects.filter(expense_number__startswith=prefix).values_list('expense_number', flat=True)
+        highest = 0
+        for number in numbers.iterator():
+            match = pattern.match(number)
+            if match:
+                highest = max(highest, int(match.group(1)))
+        return highest
 
 
 class ExpenseLine(models.Model):
@@ -215,7 +445,10 @@ class ApprovalRule(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
+    objects = CompanyScopedManager()
+    all_objects = models.Manager()
+
     class Meta:
         db_table = 'approval_rules'
         ordering = ['-priority', 'min_amount']
@@ -269,6 +502,14 @@ class ExpenseApproval(models.Model):
         db_table = 'expense_approvals'
         ordering = ['step_number', 'assigned_at']
         unique_together = ('expense', 'step_number', 'approver')
+        indexes = [
+            # Approver inbox: pending rows for an approver at a given step
+            models.Index(
+                fields=['approver', 'step_number'],
+                condition=models.Q(status='PENDING'),
+                name='exp_appr_pending_idx',
+            ),
+        ]
         
     def __str__(self):
         return f"{self.expense.expense_number} - Step {self.step_number} - {self.approver.get_full_name()} - {self.status}"
@@ -296,7 +537,7 @@ class CurrencyExchangeRate(models.Model):
     
     base_currency = models.CharField(max_length=10)
     target_currency = models.CharField(max_length=10)
-    rate = models.DecimalField(max_digits=10, decimal_places=6)
+    rate = models.DecimalField(max_digits=18, decimal_places=6)
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -325,13 +566,16 @@ class AuditLog(models.Model):
     )
     
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='audit_logs')
+    # The acting user's company when the entry was written; kept when the user is deleted
+    company = models.ForeignKey(Company, on_delete=models.SET_NULL, null=True, blank=True, related_name='audit_logs')
     action = models.CharField(max_length=20, choices=ACTION_CHOICES)
     model_name = models.CharField(max_length=100)  # e.g., 'Expense', 'User'
     object_id = models.IntegerField()
     description = models.TextField()
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     metadata = models.JSONField(blank=True, null=True)  # Additional data
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Stamped when the entry is built, not when the (possibly deferred or retried) write lands
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         db_table = 'audit_logs'
@@ -339,7 +583,141 @@ class AuditLog(models.Model):
         indexes = [
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['model_name', 'object_id']),
+            # Month-range scans for archival and compliance queries
+            models.Index(fields=['created_at'], name='audit_logs_created_idx'),
+            models.Index(fields=['company', 'created_at'], name='audit_logs_company_created_idx'),
+        ]
+        # PostgreSQL also gets GIN and BRIN indexes from migration 0013
+        
+    def __str__(self):
+        return f"{self.action} - {self.model_name} - {self.user}"
+
+
+class CompanyStats(models.Model):
+    """Materialized per-company dashboard counters"""
+    
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    
+    total_expenses = models.IntegerField(default=0)
+    draft_expenses = models.IntegerField(default=0)
+    pending_expenses = models.IntegerField(default=0)
+    approved_expenses = models.IntegerField(default=0)
+    rejected_expenses = models.IntegerField(default=0)
+    cancelled_expenses = models.IntegerField(default=0)
+    
+    # In the company currency
+    pending_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    approved_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    
+    total_users = models.IntegerField(default=0)
+    admin_users = models.IntegerField(default=0)
+    manager_users = models.IntegerField(default=0)
+    employee_users = models.IntegerField(default=0)
+    
+    active_approval_rules = models.IntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'company_stats'
+        verbose_name_plural = 'Company Stats'
+        
+    def __str__(self):
+        return f"Stats for company {self.company_id}"
+
+
+class CategoryRollup(models.Model):
+    """Per-company, per-category expense totals by day and by month"""
+    
+    PERIOD_CHOICES = (
+        ('DAY', 'Day'),
+        ('MONTH', 'Month'),
+    )
+    
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='category_rollups')
+    category = models.ForeignKey(ExpenseCategory, on_delete=models.CASCADE, related_name='rollups')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    bucket_start = models.DateField()  # First day of the day/month bucket
+    
+    # In the company currency
+    approved_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    approved_count = models.IntegerField(default=0)
+    rejected_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    rejected_count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'category_rollups'
+        unique_together = ('company', 'period', 'bucket_start', 'category')
+        
+    def __str__(self):
+        return f"{self.category_id} {self.period} {self.bucket_start}: {self.approved_amount}"
+
+
+class AuditLogSegment(models.Model):
+    """A month of AuditLog rows archived to a compressed JSONL file"""
+    
+    month = models.DateField()  # First day of the archived month
+    path = models.CharField(max_length=500)  # Relative to AUDIT_ARCHIVE_DIR
+    row_count = models.IntegerField()
+    
+    # Pruning indexes for the query layer
+    min_created_at = models.DateTimeField()
+    max_created_at = models.DateTimeField()
+    min_object_id = models.BigIntegerField()
+    max_object_id = models.BigIntegerField()
+    object_ranges = models.JSONField(default=dict)  # {model_name: [min_object_id, max_object_id]}
+    company_ids = models.JSONField(default=list)
+    
+    sha256 = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'audit_log_segments'
+        ordering = ['month', 'id']
+        indexes = [
+            models.Index(fields=['min_created_at', 'max_created_at']),
+        ]
+        
+    def __str__(self):
+        return f"{self.path} ({self.row_count} rows)"
+
+
+class OcrJob(models.Model):
+    """A queued receipt extraction, worked off by the run_ocr_worker command"""
+    
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+    
+    idempotency_key = models.CharField(max_length=200, unique=True)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='ocr_jobs')
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='ocr_jobs')
+    receipt_blob = models.ForeignKey(ReceiptBlob, on_delete=models.CASCADE, related_name='ocr_jobs')
+    extractor = models.CharField(max_length=255)  # Dotted path of the extractor callable
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)  # Retry backoff
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)  # Lease start; stale leases are requeued
+    
+    result = models.JSONField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'ocr_jobs'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id'], name='ocr_jobs_runnable_idx'),
+            models.Index(fields=['company', 'status'], name='ocr_jobs_company_status_idx'),
         ]
+        # PostgreSQL also gets partial queued/running indexes from migration 0013
         
     def __str__(self):
-        return f"{self.action} - {self.model_name} - {self.user}"
\ No newline at end of file
+        return f"OCR job {self.pk} for expense {self.expense_id} ({self.status})"
@@ -0,0 +1,210 @@
+"""Receipt OCR job queue.
+
+Jobs are rows in ``ocr_jobs``; submitting one is a single INSERT, so uploads
+never wait on extraction. ``run_ocr_worker`` claims runnable jobs with a
+conditional UPDATE (several workers can share the table without a broker),
+runs the extractor in a process pool sized to the machine's cores, and writes
+the parsed merchant/total/date back to the expense. Failed jobs are retried
+with exponential backoff up to ``max_attempts``; a worker that dies leaves its
+jobs RUNNING until their lease (OCR_LEASE_SECONDS) expires and another worker
+requeues them. At most OCR_COMPANY_CONCURRENCY jobs per company run at once,
+so one company's backlog cannot starve the others.
+"""
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import ocr_extractors
+from .models import Expense, OcrJob
+
+logger = logging.getLogger(__name__)
+
+
+def default_extractor():
+    return getattr(settings, 'OCR_EXTRACTOR', 'adminFunc.ocr_extractors.local_text')
+
+
+def idempotency_key(expense, extractor):
+    """One job per expense, receipt content and extractor"""
+    return f'{expense.pk}:{expense.receipt_blob.sha256}:{extractor}'
+
+
+def submit(expense, extractor=None, key=None):
+    """Queue extraction of ``expense``'s receipt; returns ``(job, created)``.
+
+    Submitting the same key again returns the existing job, so retried
+    uploads and requests do not queue duplicate work.
+    """
+    extractor = extractor or default_extractor()
+    key = key or idempotency_key(expense, extractor)
+    job = OcrJob.objects.filter(idempotency_key=key).first()
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            return OcrJob.objects.create(
+                idempotency_key=key,
+                company_id=expense.company_id,
+                expense=expense,
+                receipt_blob_id=expense.receipt_blob_id,
+                extractor=extractor,
+                max_attempts=getattr(settings, 'OCR_MAX_ATTEMPTS', 3),
+            ), True
+    except IntegrityError:
+        return OcrJob.objects.get(idempotency_key=key), False
+
+
+def submit_missing(batch_size=1000):
+    """Queue a job for every expense with a receipt but no OCR data yet; returns the count"""
+    extractor = default_extractor()
+    expenses = (
+        Expense.objects.filter(receipt_blob__isnull=False, receipt_ocr_data__isnull=True)
+        .select_related('receipt_blob')
+        .only('id', 'company_id', 'receipt_blob__sha256')
+    )
+    created = 0
+    for expense in expenses.iterator(chunk_size=batch_size):
+        created += submit(expense, extractor)[1]
+    return created
+
+
+def requeue_stale(lease_seconds=None):
+    """Put back jobs whose worker stopped renewing its lease; returns the count"""
+    lease_seconds = lease_seconds or getattr(settings, 'OCR_LEASE_SECONDS', 300)
+    return OcrJob.objects.filter(
+        status='RUNNING', locked_at__lt=timezone.now() - timedelta(seconds=lease_seconds),
+    ).update(status='QUEUED', locked_by='', locked_at=None, run_after=timezone.now())
+
+
+def claim(worker_id, limit, company_limit=None):
+    """Lease up to ``limit`` runnable jobs to ``worker_id`` and return them"""
+    company_limit = company_limit or getattr(settings, 'OCR_COMPANY_CONCURRENCY', 4)
+    now = timezone.now()
+    running = dict(
+        OcrJob.objects.filter(status='RUNNING').values_list('company_id').annotate(count=Count('id')).order_by()
+    )
+    candidates = (
+        OcrJob.objects.filter(status='QUEUED', run_after__lte=now)
+        .order_by('run_after', 'id')
+        .values_list('id', 'company_id')[:limit * 4]
+    )
+    chosen = []
+    for job_id, company_id in candidates:
+        if running.get(company_id, 0) >= company_limit:
+            continue
+        running[company_id] = running.get(company_id, 0) + 1
+        chosen.append(job_id)
+        if len(chosen) >= limit:
+            break
+    if not chosen:
+        return []
+    # Only still-queued rows change hands, so concurrent workers never share a job
+    OcrJob.objects.filter(pk__in=chosen, status='QUEUED').update(
+        status='RUNNING', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+    )
+    return list(
+        OcrJob.objects.filter(pk__in=chosen, status='RUNNING', locked_by=worker_id)
+        .select_related('receipt_blob')
+    )
+
+
+def renew(worker_id, job_ids):
+    OcrJob.objects.filter(pk__in=job_ids, locked_by=worker_id, status='RUNNING').update(locked_at=timezone.now())
+
+
+def complete(job, result):
+    """Store a successful extraction on the job and its expense"""
+    now = timezone.now()
+    ocr_data = dict(result, extractor=job.extractor, sha256=job.receipt_blob.sha256, job_id=job.pk)
+    with transaction.atomic():
+        updated = OcrJob.objects.filter(pk=job.pk, status='RUNNING', locked_by=job.locked_by).update(
+            status='DONE', result=result, last_error='', finished_at=now, locked_by='', locked_at=None,
+        )
+        if not updated:
+            # The lease expired and another worker took over
+            return False
+        # Skip expenses whose receipt was replaced while the job ran
+        expense = Expense.objects.filter(pk=job.expense_id, receipt_blob_id=job.receipt_blob_id)
+        expense.update(receipt_ocr_data=ocr_data, updated_at=now)
+        if result.get('merchant'):
+            expense.filter(Q(merchant_name__isnull=True) | Q(merchant_name='')).update(merchant_name=result['merchant'])
+    return True
+
+
+def fail(job, error):
+    """Record a failed attempt, scheduling a retry with exponential backoff if attempts remain"""
+    base = getattr(settings, 'OCR_RETRY_BACKOFF', 30)
+    if job.attempts >= job.max_attempts:
+        changes = {'status': 'FAILED', 'finished_at': timezone.now()}
+    else:
+        changes = {'status': 'QUEUED', 'run_after': timezone.now() + timedelta(seconds=base * 2 ** (job.attempts - 1))}
+    OcrJob.objects.filter(pk=job.pk, status='RUNNING', locked_by=job.locked_by).update(
+        last_error=str(error)[:2000], locked_by='', locked_at=None, **changes,
+    )
+
+
+class Worker:
+    """Claims jobs and runs them in a process pool until stopped or, with ``drain``, idle"""
+
+    def __init__(self, processes=None, poll_interval=2.0, drain=False):
+        self.processes = processes or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.drain = drain
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stopped = False
+        self.processed = {'done': 0, 'failed': 0}
+
+    def _submit(self, pool, job):
+        path = default_storage.path(job.receipt_blob.file.name)
+        return pool.submit(ocr_extractors.run, job.extractor, path)
+
+    def _finish(self, job, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning("OCR job %s failed (attempt %d): %s", job.pk, job.attempts, e)
+            fail(job, f'{type(e).__name__}: {e}')
+            self.processed['failed'] += 1
+            return
+        complete(job, result)
+        self.processed['done'] += 1
+
+    def run(self):
+        # Keep a second batch queued in the pool so processes never idle between polls
+        capacity = self.processes * 2
+        in_flight = {}
+        lease_seconds = getattr(settings, 'OCR_LEASE_SECONDS', 300)
+        last_renewal = timezone.now()
+        with ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            while not self.stopped:
+                requeue_stale(lease_seconds)
+                if len(in_flight) < capacity:
+                    for job in claim(self.worker_id, capacity - len(in_flight)):
+                        in_flight[self._submit(pool, job)] = job
+                if not in_flight:
+                    if self.drain:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+
+                done, _ = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._finish(in_flight.pop(future), future)
+                if (timezone.now() - last_renewal).total_seconds() > lease_seconds / 3:
+                    renew(self.worker_id, [job.pk for job in in_flight.values()])
+                    last_renewal = timezone.now()
+            # Stopping: let the pool finish what it started
+            for future, job in in_flight.items():
+                self._finish(job, future)
+        return self.processed
@@ -0,0 +1,136 @@
+"""Receipt text extractors and the receipt text parser.
+
+Kept free of Django imports: the OCR worker runs these in ``spawn``-ed
+processes. An extractor is any callable taking a file path and returning the
+receipt's text; OCR_EXTRACTOR names the one to use by dotted path.
+"""
+import importlib
+import re
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from PIL import Image, UnidentifiedImageError
+
+MAX_TEXT_BYTES = 1024 * 1024
+# Stored alongside the parsed fields for reference
+MAX_STORED_TEXT = 4000
+
+
+def local_text(path):
+    """Deterministic extractor: text the file already carries.
+
+    Plain-text receipts, text drawn with ``Tj`` in uncompressed PDFs, and
+    the text chunks/comments of images. It needs no OCR engine, which keeps
+    tests and development setups self-contained.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(MAX_TEXT_BYTES)
+    if head.startswith(b'%PDF'):
+        literals = re.findall(rb'\(((?:\\.|[^\\)])*)\)\s*Tj', head)
+        return '\n'.join(literal.decode('latin-1').replace('\\(', '(').replace('\\)', ')') for literal in literals)
+    try:
+        with Image.open(path) as image:
+            chunks = [value for value in image.info.values() if isinstance(value, (str, bytes))]
+            return '\n'.join(value.decode('utf-8', 'ignore') if isinstance(value, bytes) else value for value in chunks)
+    except UnidentifiedImageError:
+        pass
+    return head.decode('utf-8', 'ignore')
+
+
+def tesseract_text(path):
+    """Tesseract OCR (needs the optional ``pytesseract`` package and the tesseract binary)"""
+    try:
+        import pytesseract
+    except ImportError:
+        raise RuntimeError("The tesseract extractor needs 'pip install pytesseract'")
+    with Image.open(path) as image:
+        # OCR accuracy is fine at ~2000px; draft() keeps large JPEG scans cheap to decode
+        image.draft('L', (2000, 2000))
+        return pytesseract.image_to_string(image)
+
+
+AMOUNT_RE = re.compile(r'(?<![\d.,])(\d{1,3}(?:[,\s]\d{3})*(?:[.,]\d{2})|\d+[.,]\d{2})(?![\d])')
+TOTAL_RE = re.compile(r'\b(grand\s+total|total\s+due|amount\s+due|balance\s+due|total)\b', re.IGNORECASE)
+SKIP_TOTAL_RE = re.compile(r'\b(sub\s*-?\s*total|tax|vat|tip|change|cash)\b', re.IGNORECASE)
+MONTHS = {name: i for i, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+DATE_PATTERNS = (
+    (re.compile(r'\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b'), ('y', 'm', 'd')),
+    (re.compile(r'\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})\b'), ('d', 'm', 'y')),
+    (re.compile(r'\b(\d{1,2})\s+([A-Za-z]{3})[a-z]*\.?,?\s+(\d{4})\b'), ('d', 'b', 'y')),
+    (re.compile(r'\b([A-Za-z]{3})[a-z]*\.?\s+(\d{1,2}),?\s+(\d{4})\b'), ('b', 'd', 'y')),
+)
+MERCHANT_SKIP_RE = re.compile(r'^(receipt|invoice|tax invoice|welcome|tel|phone|date|www\.|http)', re.IGNORECASE)
+
+
+def parse_amount(text):
+    text = text.replace(' ', '')
+    if ',' in text and '.' in text:
+        text = text.replace(',', '')
+    elif text.count(',') == 1 and len(text.rsplit(',', 1)[1]) == 2:
+        text = text.replace(',', '.')
+    else:
+        text = text.replace(',', '')
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        return None
+
+
+def parse_date(text):
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parts = dict(zip(order, match.groups()))
+            month = MONTHS.get(parts['b'][:3].lower()) if 'b' in parts else int(parts['m'])
+            try:
+                return date(int(parts['y']), month, int(parts['d']))
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+def parse_receipt(text):
+    """Merchant, total and date found in receipt text (each None if not found)"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+
+    merchant = next(
+        (line for line in lines[:5] if re.search(r'[A-Za-z]{2}', line) and not MERCHANT_SKIP_RE.match(line)
+         and not AMOUNT_RE.search(line)),
+        None,
+    )
+
+    total = None
+    for line in reversed(lines):
+        if TOTAL_RE.search(line) and not SKIP_TOTAL_RE.search(line):
+            amounts = [parse_amount(match) for match in AMOUNT_RE.findall(line)]
+            amounts = [amount for amount in amounts if amount is not None]
+            if amounts:
+                total = amounts[-1]
+                break
+    if total is None:
+        amounts = [parse_amount(match) for match in AMOUNT_RE.findall(text)]
+        amounts = [amount for amount in amounts if amount is not None]
+        total = max(amounts) if amounts else None
+
+    receipt_date = parse_date(text)
+    return {
+        'merchant': merchant[:255] if merchant else None,
+        'total': str(total) if total is not None else None,
+        'date': receipt_date.isoformat() if receipt_date else None,
+    }
+
+
+def load(dotted_path):
+    module_path, _, name = dotted_path.rpartition('.')
+    return getattr(importlib.import_module(module_path), name)
+
+
+def run(extractor_path, source):
+    """Worker entry point: extract ``source`` with the named extractor and parse it"""
+    started = time.monotonic()
+    text = load(extractor_path)(source) or ''
+    result = parse_receipt(text)
+    result['text'] = text[:MAX_STORED_TEXT]
+    result['extract_seconds'] = round(time.monotonic() - started, 3)
+    return result
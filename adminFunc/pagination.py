@@ -0,0 +1,56 @@
+"""Keyset (cursor) pagination on ``(created_at, id)``, newest first.
+
+Each page continues from the last row of the previous one with a
+``WHERE (created_at, id) < (cursor)`` predicate, so page N costs the same as
+page 1 as long as an index ends in ``created_at, id``.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(created_at, pk):
+    raw = f'{created_at.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, pk)``; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def after_cursor(queryset, cursor):
+    """Rows strictly after ``cursor`` in ``-created_at, -id`` order"""
+    if not cursor:
+        return queryset
+    created_at, pk = decode_cursor(cursor)
+    return queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+
+def keyset_page(queryset, cursor=None, limit=50):
+    """Return ``(rows, next_cursor)``; ``next_cursor`` is None on the last page"""
+    rows = list(after_cursor(queryset, cursor).order_by('-created_at', '-id')[:limit + 1])
+    return _page(rows, limit)
+
+
+async def akeyset_page(queryset, cursor=None, limit=50):
+    """``keyset_page`` for async views"""
+    page = after_cursor(queryset, cursor).order_by('-created_at', '-id')[:limit + 1]
+    return _page([row async for row in page], limit)
+
+
+def _page(rows, limit):
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if isinstance(last, dict):
+        return rows, encode_cursor(last['created_at'], last['id'])
+    return rows, encode_cursor(last.created_at, last.id)
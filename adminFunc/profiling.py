@@ -0,0 +1,222 @@
+"""Per-view query and latency profiling with budgets.
+
+``ProfilingMiddleware`` (first in MIDDLEWARE) times each request. A database
+execute wrapper installed on every connection counts the request's queries,
+their time and how often each query shape (its SQL with ``IN`` lists
+collapsed) repeats. The wrapper finds the request through a ``ContextVar``,
+so queries that async views run on worker threads are counted too. Repeated
+shapes are the signature of N+1 access, e.g. a ``__str__`` that follows a
+foreign key for every row of a list.
+
+Each response carries a ``Server-Timing`` header. The last PROFILING_SAMPLES
+requests of every view are kept in process for ``snapshot()`` (p50/p95/p99
+latency, query counts, DB time), which the admin metrics API and the
+``profile_views`` command report.
+
+Requests are checked against PROFILING_BUDGETS (per view name, falling back
+to PROFILING_DEFAULT_BUDGET) for ``queries``, ``duplicates`` (runs of one
+query shape), ``db_ms`` and ``ms``. PROFILING_BUDGET_ACTION 'warn' logs
+overruns; 'raise' raises ``BudgetExceeded`` so a test client call fails.
+Work done while a streaming response is consumed is not counted.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('adminFunc_query_log', default=None)
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class BudgetExceeded(AssertionError):
+    """A request went over its view's budget with PROFILING_BUDGET_ACTION = 'raise'"""
+
+
+def enabled():
+    return getattr(settings, 'PROFILING', False)
+
+
+def fingerprint(sql):
+    """The query's shape: its SQL with ``IN (%s, ...)`` lists collapsed"""
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+class QueryLog:
+    """Queries run on behalf of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, sql, seconds):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.shapes[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        """``[(shape, times)]`` of the query shapes run more than once, most repeated first"""
+        return [(shape, times) for shape, times in self.shapes.most_common() if times > 1]
+
+
+def _record(execute, sql, params, many, context):
+    log = _current.get()
+    if log is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        log.add(sql, time.perf_counter() - started)
+
+
+def install(db_connection):
+    """Add the query recorder to a connection (idempotent; from a ``connection_created`` receiver)"""
+    if _record not in db_connection.execute_wrappers:
+        db_connection.execute_wrappers.append(_record)
+
+
+class ViewStats:
+    """Rolling per-view samples of ``(ms, queries, db_ms)``"""
+
+    def __init__(self):
+        self._samples = {}
+        self._violations = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, view, ms, queries, db_ms, violated=False):
+        maxlen = getattr(settings, 'PROFILING_SAMPLES', 1000)
+        with self._lock:
+            samples = self._samples.get(view)
+            if samples is None or samples.maxlen != maxlen:
+                samples = self._samples[view] = deque(samples or (), maxlen=maxlen)
+            samples.append((ms, queries, db_ms))
+            if violated:
+                self._violations[view] += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = {view: list(rows) for view, rows in self._samples.items()}
+            violations = dict(self._violations)
+        result = {}
+        for view, rows in sorted(samples.items()):
+            latencies = [row[0] for row in rows]
+            queries = [row[1] for row in rows]
+            db_times = [row[2] for row in rows]
+            result[view] = {
+                'requests': len(rows),
+                'p50_ms': round(percentile(latencies, 0.50), 1),
+                'p95_ms': round(percentile(latencies, 0.95), 1),
+                'p99_ms': round(percentile(latencies, 0.99), 1),
+                'max_ms': round(max(latencies), 1),
+                'p50_queries': percentile(queries, 0.50),
+                'p95_queries': percentile(queries, 0.95),
+                'max_queries': max(queries),
+                'p95_db_ms': round(percentile(db_times, 0.95), 1),
+                'over_budget': violations.get(view, 0),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._violations.clear()
+
+
+stats = ViewStats()
+
+
+def budget_for(view):
+    budgets = getattr(settings, 'PROFILING_BUDGETS', {})
+    return budgets.get(view, getattr(settings, 'PROFILING_DEFAULT_BUDGET', {}))
+
+
+def check_budget(view, log, ms):
+    """Descriptions of the budget limits this request went over"""
+    budget = budget_for(view)
+    duplicates = log.duplicates()
+    measured = {
+        'queries': log.count,
+        'duplicates': duplicates[0][1] if duplicates else 0,
+        'db_ms': log.seconds * 1000,
+        'ms': ms,
+    }
+    problems = [
+        f"{name} {measured[name]:.0f} > {limit}" for name, limit in budget.items()
+        if name in measured and measured[name] > limit
+    ]
+    if problems and duplicates:
+        problems.append(f"most repeated ({duplicates[0][1]}x): {duplicates[0][0][:300]}")
+    return problems
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class ProfilingMiddleware:
+    """Records queries and latency per view; put it first in MIDDLEWARE"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        log, started = QueryLog(), time.perf_counter()
+        token = _current.set(log)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, log, started)
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        log, started = QueryLog(), time.perf_counter()
+        token = _current.set(log)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, log, started)
+
+    def _finish(self, request, response, log, started):
+        ms = (time.perf_counter() - started) * 1000
+        view = view_name(request)
+        problems = check_budget(view, log, ms)
+        stats.add(view, ms, log.count, log.seconds * 1000, violated=bool(problems))
+        response['Server-Timing'] = (
+            f'db;desc="{log.count} queries";dur={log.seconds * 1000:.1f}, total;dur={ms:.1f}'
+        )
+        if problems:
+            message = f"{view} over budget: {'; '.join(problems)}"
+            if getattr(settings, 'PROFILING_BUDGET_ACTION', 'warn') == 'raise':
+                raise BudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,337 @@
+"""Company (tenant) provisioning from a declarative template.
+
+A template is a dict (or JSON file) describing what every new company starts
+with::
+
+    {
+        "categories": ["Travel", {"name": "Meals", "description": "..."}],
+        "users": [
+            {"key": "cfo", "email": "cfo@{domain}", "first_name": "Casey", "role": "MANAGER",
+             "manager": "admin"}
+        ],
+        "approval_rules": [
+            {"name": "Large expenses", "rule_type": "SEQUENTIAL", "min_amount": "1000",
+             "categories": ["Travel"], "steps": [{"approver": "cfo"}, {"approver": "admin"}]}
+        ]
+    }
+
+Users are referred to by ``key`` (default: their username, which defaults to
+their email). ``{slug}`` and ``{domain}`` in a template user's username or
+email are filled in per company. A user gets ``password`` hashed,
+``password_hash`` stored as given, or else an unusable password; hashing is
+deliberately slow, so prefer ``password_hash`` for large batches.
+
+``provision_many`` writes a whole batch of companies with a fixed number of
+statements whatever its size: one INSERT per table (per manager level for
+users), with the primary keys read back through RETURNING. Signals are not
+sent; the hierarchy index, CompanyStats rows and cached reference data are
+written or invalidated directly.
+"""
+import json
+import time
+from collections import Counter, defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.hashers import make_password
+from django.db import NotSupportedError, connection, transaction
+from django.utils.text import slugify
+
+from . import approval_rules, bulk, hierarchy, reference_data, stats
+from .countries import resolve_currency
+from .models import (
+    ApprovalRule, ApprovalStep, Company, CompanyStats, ExpenseCategory, User, UserHierarchy,
+)
+
+DEFAULT_CATEGORIES = (
+    'Travel', 'Meals', 'Accommodation', 'Office Supplies',
+    'Entertainment', 'Transportation', 'Utilities', 'Other',
+)
+DEFAULT_TEMPLATE = {
+    'categories': [
+        {'name': name, 'description': f"Default {name} expense category"} for name in DEFAULT_CATEGORIES
+    ],
+}
+COMPANY_FIELDS = ('name', 'country', 'currency_code', 'currency_symbol', 'address')
+USER_FIELDS = (
+    'username', 'email', 'first_name', 'last_name', 'role', 'employee_id', 'phone_number',
+    'is_staff', 'is_superuser', 'is_active',
+)
+RULE_FIELDS = ('name', 'rule_type', 'approval_percentage', 'requires_manager_approval', 'is_active', 'priority')
+
+Provisioned = namedtuple('Provisioned', 'company users')  # users: {key: User}
+
+
+def _list(value, name):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValueError(f"{name} must be a list")
+    return value
+
+
+def _amount(value, name):
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+
+def compile_template(template):
+    """Validate a template and return it in normalized form; raises ValueError"""
+    if not isinstance(template, dict):
+        raise ValueError("A template must be a JSON object")
+    unknown = set(template) - {'categories', 'users', 'approval_rules'}
+    if unknown:
+        raise ValueError(f"Unknown template sections: {', '.join(sorted(unknown))}")
+
+    categories = []
+    for entry in _list(template.get('categories'), 'categories'):
+        entry = {'name': entry} if isinstance(entry, str) else entry
+        if not isinstance(entry, dict) or not entry.get('name'):
+            raise ValueError(f"Invalid category: {entry!r}")
+        categories.append({
+            'name': entry['name'],
+            'description': entry.get('description'),
+            'is_active': entry.get('is_active', True),
+        })
+    category_names = [category['name'] for category in categories]
+    if len(set(category_names)) != len(category_names):
+        raise ValueError("Category names must be unique")
+
+    rule_types = dict(ApprovalRule.RULE_TYPE_CHOICES)
+    rules = []
+    for entry in _list(template.get('approval_rules'), 'approval_rules'):
+        if not isinstance(entry, dict) or not entry.get('name'):
+            raise ValueError(f"Invalid approval rule: {entry!r}")
+        if entry.get('rule_type') not in rule_types:
+            raise ValueError(f"Rule {entry['name']!r}: rule_type must be one of {', '.join(rule_types)}")
+        missing = set(_list(entry.get('categories'), 'categories')) - set(category_names)
+        if missing:
+            raise ValueError(f"Rule {entry['name']!r} names unknown categories: {', '.join(sorted(missing))}")
+        steps = []
+        for step in _list(entry.get('steps'), 'steps'):
+            if not isinstance(step, dict) or not step.get('approver'):
+                raise ValueError(f"Rule {entry['name']!r}: every step needs an approver")
+            steps.append({'approver': step['approver'], 'can_auto_approve': bool(step.get('can_auto_approve'))})
+        rules.append({
+            **{field: entry[field] for field in RULE_FIELDS if field in entry},
+            'min_amount': _amount(entry.get('min_amount', 0), 'min_amount'),
+            'max_amount': _amount(entry.get('max_amount'), 'max_amount'),
+            'categories': list(entry.get('categories') or []),
+            'steps': steps,
+        })
+
+    users = _list(template.get('users'), 'users')
+    for user in users:
+        if not isinstance(user, dict) or not (user.get('email') or user.get('username')):
+            raise ValueError(f"Invalid template user: {user!r}")
+    return {'categories': categories, 'users': users, 'approval_rules': rules}
+
+
+def load_template(path):
+    with open(path, encoding='utf-8') as f:
+        return compile_template(json.load(f))
+
+
+def read_tenants(f):
+    """Tenants from a JSON list or JSON Lines file object"""
+    text = f.read()
+    if isinstance(text, bytes):
+        text = text.decode('utf-8-sig')
+    if text.lstrip().startswith('['):
+        tenants = json.loads(text)
+    else:
+        tenants = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not all(isinstance(tenant, dict) for tenant in tenants):
+        raise ValueError("Every tenant must be a JSON object")
+    return tenants
+
+
+def _tenant_users(tenant, template):
+    """The tenant's own users followed by the template's, keyed and filled in"""
+    slug = slugify(tenant['name']) or 'company'
+    context = {'slug': slug, 'domain': tenant.get('domain') or f'{slug}.invalid'}
+    users = {}
+    for position, spec in enumerate(_list(tenant.get('users'), 'users') + template['users']):
+        spec = dict(spec)
+        if position >= len(tenant.get('users') or []):
+            for field in ('username', 'email'):
+                if isinstance(spec.get(field), str):
+                    try:
+                        spec[field] = spec[field].format(**context)
+                    except (KeyError, IndexError, ValueError):
+                        raise ValueError(f"Template user {field} {spec[field]!r}: only {{slug}} and {{domain}} are filled in")
+        spec['email'] = User.objects.normalize_email(spec.get('email') or '')
+        spec['username'] = User.normalize_username(spec.get('username') or spec['email'])
+        if not spec['username']:
+            raise ValueError(f"{tenant['name']}: a user needs a username or email")
+        key = spec.get('key') or spec['username']
+        if key in users:
+            raise ValueError(f"{tenant['name']}: duplicate user {key!r}")
+        users[key] = spec
+    return users
+
+
+def _levels(tenant_name, users):
+    """``{key: depth}`` from the manager keys; raises ValueError for unknown keys and cycles"""
+    levels = {}
+    for key in users:
+        chain = []
+        current = key
+        while current is not None and current not in levels:
+            if current in chain:
+                raise ValueError(f"{tenant_name}: manager cycle through {current!r}")
+            chain.append(current)
+            manager = users[current].get('manager')
+            if manager is not None and manager not in users:
+                raise ValueError(f"{tenant_name}: {current!r} has unknown manager {manager!r}")
+            current = manager
+        depth = levels[current] + 1 if current is not None else 0
+        for member in reversed(chain):
+            levels[member] = depth
+            depth += 1
+    return levels
+
+
+def _check_unique(plans):
+    usernames = Counter(user['username'] for plan in plans for user in plan['users'].values())
+    emails = Counter(user['email'] for plan in plans for user in plan['users'].values() if user['email'])
+    duplicates = {name for counts in (usernames, emails) for name, count in counts.items() if count > 1}
+    if duplicates:
+        raise ValueError(f"Users appear more than once: {', '.join(sorted(duplicates)[:10])}")
+    taken = set()
+    names = list(usernames)
+    addresses = list(emails)
+    for start in range(0, max(len(names), len(addresses)), 500):
+        taken.update(User.all_objects.filter(username__in=names[start:start + 500]).values_list('username', flat=True))
+        taken.update(User.all_objects.filter(email__in=addresses[start:start + 500]).values_list('email', flat=True))
+    if taken:
+        raise ValueError(f"Users already exist: {', '.join(sorted(taken)[:10])}")
+
+
+def _plan(tenant, template):
+    if not tenant.get('name') or not tenant.get('country'):
+        raise ValueError(f"A company needs a name and a country: {tenant!r}")
+    company = Company(**{field: tenant[field] for field in COMPANY_FIELDS if tenant.get(field) is not None})
+    if not company.currency_code:
+        company.currency_code, company.currency_symbol = resolve_currency(company.country)
+    users = _tenant_users(tenant, template)
+    levels = _levels(company.name, users)
+    for rule in template['approval_rules']:
+        for step in rule['steps']:
+            if step['approver'] not in users:
+                raise ValueError(f"{company.name}: rule {rule['name']!r} has unknown approver {step['approver']!r}")
+    return {'company': company, 'users': users, 'levels': levels}
+
+
+def _build_user(spec, company, manager):
+    user = User(**{field: spec[field] for field in USER_FIELDS if field in spec}, company=company, manager=manager)
+    if spec.get('password_hash'):
+        user.password = spec['password_hash']
+    else:
+        user.password = make_password(spec.get('password'))  # None: unusable
+    return user
+
+
+def _write_batch(plans, template):
+    companies = Company.objects.bulk_create([plan['company'] for plan in plans])
+
+    # Users one manager level at a time, so every manager has its id first
+    created = [{} for _ in plans]
+    for depth in range(max((max(plan['levels'].values(), default=-1) for plan in plans), default=-1) + 1):
+        level = [
+            (index, key, _build_user(spec, companies[index], created[index].get(spec.get('manager'))))
+            for index, plan in enumerate(plans)
+            for key, spec in plan['users'].items()
+            if plan['levels'][key] == depth
+        ]
+        User.objects.bulk_create([user for _, _, user in level])
+        for index, key, user in level:
+            created[index][key] = user
+
+    managers = {user.pk: user.manager_id for users in created for user in users.values()}
+    rows, _ = hierarchy.closure_rows(managers)
+    bulk.insert_rows(UserHierarchy, [
+        UserHierarchy(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=level)
+        for ancestor_id, descendant_id, level in rows
+    ])
+
+    categories = ExpenseCategory.objects.bulk_create([
+        ExpenseCategory(company=company, **category) for company in companies for category in template['categories']
+    ])
+    category_ids = defaultdict(dict)
+    for category in categories:
+        category_ids[category.company_id][category.name] = category.pk
+
+    rule_specs = [(index, spec) for index in range(len(plans)) for spec in template['approval_rules']]
+    rules = ApprovalRule.objects.bulk_create([
+        ApprovalRule(
+            company=companies[index], min_amount=spec['min_amount'], max_amount=spec['max_amount'],
+            **{field: spec[field] for field in RULE_FIELDS if field in spec},
+        )
+        for index, spec in rule_specs
+    ])
+    ApprovalStep.objects.bulk_create([
+        ApprovalStep(
+            approval_rule=rule, step_number=number, approver=created[index][step['approver']],
+            can_auto_approve=step['can_auto_approve'],
+        )
+        for rule, (index, spec) in zip(rules, rule_specs)
+        for number, step in enumerate(spec['steps'], start=1)
+    ])
+    RuleCategory = ApprovalRule.categories.through
+    RuleCategory.objects.bulk_create([
+        RuleCategory(approvalrule_id=rule.pk, expensecategory_id=category_ids[rule.company_id][name])
+        for rule, (_, spec) in zip(rules, rule_specs)
+        for name in spec['categories']
+    ])
+
+    deltas = defaultdict(Counter)
+    for users in created:
+        for user in users.values():
+            stats.user_state_delta(None, user.stats_state(), deltas)
+    active_rules = Counter(rule.company_id for rule in rules if rule.is_active)
+    CompanyStats.objects.bulk_create([
+        CompanyStats(company=company, active_approval_rules=active_rules[company.pk], **deltas[company.pk])
+        for company in companies
+    ])
+    return [Provisioned(company, users) for company, users in zip(companies, created)]
+
+
+def provision_many(tenants, template=None, batch_size=100):
+    """Create companies from tenant dicts; returns a ``Provisioned`` per tenant.
+
+    A tenant has ``name``, ``country`` and optionally ``currency_code``,
+    ``currency_symbol``, ``address``, ``domain`` and its own ``users`` (placed
+    before the template's, e.g. the signing-up admin). Each batch is written in
+    one transaction; raises ValueError before writing anything of a batch
+    that does not validate.
+    """
+    if not connection.features.can_return_rows_from_bulk_insert:
+        raise NotSupportedError("Provisioning needs a database that returns ids from bulk inserts")
+    template = compile_template(DEFAULT_TEMPLATE if template is None else template)
+    results = []
+    for start in range(0, len(tenants), batch_size):
+        plans = [_plan(tenant, template) for tenant in tenants[start:start + batch_size]]
+        _check_unique(plans)
+        with transaction.atomic():
+            results.extend(_write_batch(plans, template))
+    for result in results:
+        reference_data.invalidate('categories', result.company.pk)
+        reference_data.invalidate('manager_tree', result.company.pk)
+        approval_rules.invalidate(result.company.pk)
+    return results
+
+
+def provision(tenant, template=None):
+    """Create one company; see ``provision_many``"""
+    return provision_many([tenant], template)[0]
+
+
+def provision_file(f, template=None, batch_size=100):
+    """Provision every tenant in a JSON / JSON Lines file; returns ``(results, seconds)``"""
+    started = time.monotonic()
+    results = provision_many(read_tenants(f), template, batch_size)
+    return results, time.monotonic() - started
@@ -0,0 +1,232 @@
+"""Content-addressed receipt storage.
+
+Uploads are hashed while they stream in: ``HashingUploadHandler`` spools each
+file to a temporary file and feeds every chunk to SHA-256, so large scans never
+sit in memory and the digest is known before the view runs. Files are stored
+once, under ``receipts/sha256/ab/cd/<digest><ext>``, as a ReceiptBlob that
+every expense carrying the same receipt points at; ``ref_count`` tracks how
+many do. Uploading a receipt that is already stored only bumps the count, and a
+blob whose last reference goes away is deleted together with its file.
+"""
+import hashlib
+import mimetypes
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import content_disposition_header
+
+from . import thumbnails
+from .models import Expense, ReceiptBlob
+
+CHUNK_SIZE = 64 * 1024
+# Form field of receipt uploads, limited to RECEIPT_MAX_UPLOAD_SIZE
+RECEIPT_FIELD = 'receipt'
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Spool uploads to disk, hashing them chunk by chunk.
+
+    A ``receipt`` file is dropped as soon as it grows past
+    RECEIPT_MAX_UPLOAD_SIZE, and the request is flagged with
+    ``receipt_too_large``, so an oversized upload is never spooled in full.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.max_size = settings.RECEIPT_MAX_UPLOAD_SIZE if field_name == RECEIPT_FIELD else None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.max_size is not None and start + len(raw_data) > self.max_size:
+            self.request.receipt_too_large = True
+            raise SkipFile(f"Receipt larger than {self.max_size} bytes")
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+def file_digest(file):
+    """SHA-256 of ``file``, reusing the digest computed while it was uploaded"""
+    digest = getattr(file, 'sha256', None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for chunk in file.chunks(CHUNK_SIZE):
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+        file.seek(0)
+    return digest
+
+
+def blob_path(digest, name=''):
+    ext = os.path.splitext(name or '')[1].lower()[:10]
+    return f'receipts/sha256/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def store(file):
+    """The ReceiptBlob holding ``file``'s content, writing it only if it is new.
+
+    Returns ``(blob, created)``. The new blob has no references yet; use
+    ``attach()`` to point an expense at it.
+    """
+    digest = file_digest(file)
+    blob = ReceiptBlob.objects.filter(sha256=digest).first()
+    if blob is not None:
+        return blob, False
+
+    # FileSystemStorage moves spooled uploads into place rather than copying them
+    name = default_storage.save(blob_path(digest, file.name), file)
+    content_type = getattr(file, 'content_type', None) or mimetypes.guess_type(file.name or '')[0] or ''
+    try:
+        with transaction.atomic():
+            return ReceiptBlob.objects.create(sha256=digest, file=name, size=file.size, content_type=content_type), True
+    except IntegrityError:
+        # A concurrent upload of the same content won
+        default_storage.delete(name)
+        return ReceiptBlob.objects.get(sha256=digest), False
+
+
+def attach(expense, file):
+    """Store ``file`` as ``expense``'s receipt; returns ``(blob, created)``"""
+    with transaction.atomic():
+        while True:
+            blob, created = store(file)
+            if blob.pk == expense.receipt_blob_id:
+                return blob, created
+            # Zero rows means release() deleted the blob in the meantime; store again
+            if ReceiptBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+                break
+
+        previous_id = expense.receipt_blob_id
+        expense.receipt_blob = blob
+        expense.receipt_image = blob.file.name
+        expense.save(update_fields=['receipt_blob', 'receipt_image', 'updated_at'])
+        if previous_id:
+            release([previous_id])
+    return blob, created
+
+
+def known_to_company(company_id, file):
+    """Whether one of the company's expenses already carries ``file``'s content.
+
+    Blobs are shared by every company, so whether ``store()`` found one must
+    not be reported to the uploader: it would reveal what other companies
+    have uploaded.
+    """
+    return Expense.all_objects.filter(company_id=company_id, receipt_blob__sha256=file_digest(file)).exists()
+
+
+def duplicates_of(expense):
+    """Numbers of the company's other expenses that carry the same receipt"""
+    if not expense.receipt_blob_id:
+        return []
+    return list(
+        Expense.objects.filter(company_id=expense.company_id, receipt_blob_id=expense.receipt_blob_id)
+        .exclude(pk=expense.pk)
+        .order_by('created_at', 'id')
+        .values_list('expense_number', flat=True)
+    )
+
+
+def release(blob_ids):
+    """Drop one reference per id; blobs left unreferenced are deleted with their files"""
+    counts = Counter(blob_id for blob_id in blob_ids if blob_id)
+    for blob_id, count in counts.items():
+        ReceiptBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - count)
+    _delete_unreferenced(ReceiptBlob.objects.filter(pk__in=counts, ref_count__lte=0))
+
+
+def _delete_unreferenced(blobs):
+    deleted_count, names = 0, []
+    for blob in blobs.filter(expenses__isnull=True):
+        # Re-checked so an attach() that raced us keeps its blob
+        deleted, _ = ReceiptBlob.objects.filter(pk=blob.pk, ref_count__lte=0, expenses__isnull=True).delete()
+        if deleted:
+            deleted_count += 1
+            names.append(blob.file.name)
+            names.extend(thumbnails.derivative_names(blob))
+    if names:
+        transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+    return deleted_count
+
+
+def file_response(name, content_type, etag, request=None, filename=None):
+    """Serve a stored file that never changes under ``name``.
+
+    The web server sends it when RECEIPT_SENDFILE_HEADER is set; otherwise it
+    goes out through FileResponse, which WSGI servers hand to
+    ``wsgi.file_wrapper`` (sendfile) instead of reading it into Python.
+    """
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age=31536000, immutable'}
+    if request is not None and request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified(headers=headers)
+
+    content_type = content_type or 'application/octet-stream'
+    filename = filename or os.path.basename(name)
+    sendfile_header = getattr(settings, 'RECEIPT_SENDFILE_HEADER', '')
+    if sendfile_header:
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response[sendfile_header] = getattr(settings, 'RECEIPT_SENDFILE_PREFIX', '/protected-media/') + name
+        response['Content-Disposition'] = content_disposition_header(False, filename)
+        return response
+
+    response = FileResponse(default_storage.open(name, 'rb'), content_type=content_type, filename=filename)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def receipt_response(blob, request=None, filename=None):
+    """Serve a blob's original file"""
+    return file_response(blob.file.name, blob.content_type, f'"{blob.sha256}"', request, filename)
+
+
+def find_refcount_drift():
+    """``{blob_id: (stored, actual)}`` for blobs whose ref_count disagrees with the expenses"""
+    actual = dict(
+        Expense.objects.filter(receipt_blob__isnull=False)
+        .values_list('receipt_blob_id').annotate(count=Count('id')).order_by()
+    )
+    return {
+        blob_id: (stored, actual.get(blob_id, 0))
+        for blob_id, stored in ReceiptBlob.objects.values_list('id', 'ref_count')
+        if stored != actual.get(blob_id, 0)
+    }
+
+
+def repair_refcounts(drift):
+    """Reset drifted counts and delete blobs nothing references; returns the number deleted"""
+    with transaction.atomic():
+        for blob_id, (_, actual) in drift.items():
+            ReceiptBlob.objects.filter(pk=blob_id).update(ref_count=actual)
+        return _delete_unreferenced(ReceiptBlob.objects.filter(ref_count__lte=0))
+
+
+def backfill(batch_size=500):
+    """Move receipts uploaded before blob storage into it; returns ``(migrated, missing)``"""
+    migrated, missing = 0, []
+    legacy = (
+        Expense.objects.filter(receipt_blob__isnull=True)
+        .exclude(receipt_image='').exclude(receipt_image__isnull=True)
+    )
+    for expense in legacy.iterator(chunk_size=batch_size):
+        old_name = expense.receipt_image.name
+        if not default_storage.exists(old_name):
+            missing.append(expense.expense_number)
+            continue
+        with default_storage.open(old_name, 'rb') as f:
+            blob, _ = attach(expense, File(f, name=old_name))
+        if blob.file.name != old_name and not Expense.objects.filter(receipt_image=old_name).exists():
+            default_storage.delete(old_name)
+        migrated += 1
+    return migrated, missing
@@ -0,0 +1,103 @@
+"""Per-tenant reference data cached in process.
+
+Categories and the manager tree change rarely but are read on most requests.
+Each is loaded once per company into an in-process cache, tagged with a
+per-company version (``cache.Versions``); the signals in ``adminFunc.signals``
+bump the version when the data changes, so this process reloads at once and
+the others once they see the bump (see ``Versions`` for how that depends on
+a shared cache). Approval rules are cached the same way in
+``adminFunc.approval_rules``. ``QuerySet.update()`` does not send signals;
+call ``invalidate`` after bulk updates of categories or managers.
+"""
+from collections import namedtuple
+
+from .cache import TTLCache, Versions
+from .models import ExpenseCategory, User
+
+Category = namedtuple('Category', 'id name is_active')
+
+_versions = Versions('reference_data')
+_loaded = TTLCache(maxsize=4096, ttl=3600)
+
+
+def version(kind, company_id):
+    return _versions.get(f'{kind}:{company_id}')
+
+
+def invalidate(kind, company_id):
+    """Called when a company's ``kind`` ('categories' or 'manager_tree') changes"""
+    _loaded.delete((kind, company_id))
+    _versions.bump(f'{kind}:{company_id}')
+
+
+def _get(kind, company_id, load):
+    current = version(kind, company_id)
+    entry = _loaded.get((kind, company_id))
+    if entry is None or entry[0] != current:
+        entry = (current, load(company_id))
+        _loaded.set((kind, company_id), entry)
+    return entry[1]
+
+
+def _load_categories(company_id):
+    rows = ExpenseCategory.all_objects.filter(company_id=company_id).order_by('name').values_list('id', 'name', 'is_active')
+    return {row[0]: Category(*row) for row in rows}
+
+
+def categories(company_id):
+    """``{category_id: Category}`` for a company, ordered by name"""
+    return _get('categories', company_id, _load_categories)
+
+
+def category(company_id, category_id):
+    """One category, reloading once if it is newer than the cached copy"""
+    found = categories(company_id).get(category_id)
+    if found is None:
+        # Created in a process whose version bump this process has not seen
+        # (e.g. with a per-process cache backend)
+        _loaded.delete(('categories', company_id))
+        found = categories(company_id).get(category_id)
+    return found
+
+
+def category_name(company_id, category_id):
+    found = category(company_id, category_id)
+    return found.name if found else None
+
+
+def category_names(company_id, category_ids):
+    """``{category_id: name}`` for several categories, reloading at most once"""
+    wanted = set(category_ids) - {None}
+    loaded = categories(company_id)
+    if not wanted <= loaded.keys():
+        _loaded.delete(('categories', company_id))
+        loaded = categories(company_id)
+    return {category_id: loaded[category_id].name for category_id in wanted if category_id in loaded}
+
+
+class ManagerTree:
+    """Who reports to whom within one company"""
+
+    def __init__(self, managers):
+        self.managers = managers  # {user_id: manager_id or None}
+        self.reports = {}
+        for user_id, manager_id in managers.items():
+            if manager_id is not None:
+                self.reports.setdefault(manager_id, []).append(user_id)
+
+    def manager_of(self, user_id):
+        return self.managers.get(user_id)
+
+    def direct_reports(self, user_id):
+        # Deeper questions are answered by the index in adminFunc.hierarchy
+        return self.reports.get(user_id, [])
+
+
+def _load_manager_tree(company_id):
+    return ManagerTree(dict(
+        User.all_objects.filter(company_id=company_id, is_active=True).values_list('id', 'manager_id')
+    ))
+
+
+def manager_tree(company_id):
+    return _get('manager_tree', company_id, _load_manager_tree)
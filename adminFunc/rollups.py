@@ -0,0 +1,221 @@
+"""Pre-aggregated "Expenses by Category" totals (CategoryRollup).
+
+Every approved or rejected expense is counted in a DAY bucket and a MONTH
+bucket for its category, in the company currency. A date range is answered by
+combining whole months with the days at its ragged edges, so the cost of a
+category chart depends on the length of the range, not on the number of
+expenses.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from . import reference_data
+from .models import CategoryRollup, Expense
+
+ROLLUP_STATUSES = {
+    'APPROVED': ('approved_amount', 'approved_count'),
+    'REJECTED': ('rejected_amount', 'rejected_count'),
+}
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _contribution(state, sign, deltas):
+    fields = ROLLUP_STATUSES.get(state.status)
+    if fields is None or state.expense_date is None:
+        return
+    amount_field, count_field = fields
+    for period, bucket_start in (('DAY', state.expense_date), ('MONTH', _month_start(state.expense_date))):
+        delta = deltas[(state.company_id, state.category_id, period, bucket_start)]
+        delta[amount_field] += sign * Decimal(state.amount or 0)
+        delta[count_field] += sign
+
+
+def rollup_delta(old_state, new_state, deltas=None):
+    """Accumulate bucket changes between two ``Expense.stats_state()`` values"""
+    deltas = defaultdict(Counter) if deltas is None else deltas
+    if old_state == new_state:
+        return deltas
+    if old_state is not None:
+        _contribution(old_state, -1, deltas)
+    if new_state is not None:
+        _contribution(new_state, 1, deltas)
+    return deltas
+
+
+def apply_rollup_deltas(deltas, batch_size=500):
+    """Apply bucket deltas with one CASE UPDATE and one bulk INSERT per batch of buckets"""
+    deltas = {key: delta for key, delta in deltas.items() if any(delta.values())}
+    keys = list(deltas)
+    for start in range(0, len(keys), batch_size):
+        _apply_batch({key: deltas[key] for key in keys[start:start + batch_size]})
+
+
+def _apply_batch(deltas, retry=True):
+    existing = {}
+    candidates = CategoryRollup.objects.filter(
+        company_id__in={key[0] for key in deltas},
+        category_id__in={key[1] for key in deltas},
+        period__in={key[2] for key in deltas},
+        bucket_start__in={key[3] for key in deltas},
+    ).values_list('id', 'company_id', 'category_id', 'period', 'bucket_start')
+    for pk, *key in candidates:
+        if tuple(key) in deltas:
+            existing[tuple(key)] = pk
+
+    if existing:
+        changes = {}
+        for field in {field for key in existing for field, value in deltas[key].items() if value}:
+            output_field = CategoryRollup._meta.get_field(field)
+            changes[field] = F(field) + Case(
+                *(When(pk=pk, then=Value(deltas[key][field], output_field=output_field))
+                  for key, pk in existing.items() if deltas[key][field]),
+                default=Value(0, output_field=output_field),
+                output_field=output_field,
+            )
+        CategoryRollup.objects.filter(pk__in=existing.values()).update(**changes)
+
+    # Nothing to insert for pure removals (e.g. cascading deletes)
+    missing = [
+        key for key, delta in deltas.items()
+        if key not in existing and any(value > 0 for value in delta.values())
+    ]
+    if not missing:
+        return
+    # A missing bucket that also loses counts was out of step with the
+    # expenses: count it afresh rather than insert negative totals
+    recount = [key for key in missing if any(value < 0 for value in deltas[key].values())]
+    rows = _count_buckets(recount)
+    rows += [
+        CategoryRollup(
+            company_id=company_id, category_id=category_id, period=period, bucket_start=bucket_start,
+            **deltas[(company_id, category_id, period, bucket_start)],
+        )
+        for company_id, category_id, period, bucket_start in missing
+        if (company_id, category_id, period, bucket_start) not in recount
+    ]
+    try:
+        with transaction.atomic():
+            CategoryRollup.objects.bulk_create(rows)
+    except IntegrityError:
+        if not retry:
+            raise
+        # Some were created concurrently: another pass updates them
+        _apply_batch({key: deltas[key] for key in missing}, retry=False)
+
+
+def _aggregates():
+    aggregates = {}
+    for status, (amount_field, count_field) in ROLLUP_STATUSES.items():
+        aggregates[amount_field] = Sum(
+            Coalesce('converted_amount', 'amount'), filter=Q(status=status), default=Decimal(0),
+        )
+        aggregates[count_field] = Count('id', filter=Q(status=status))
+    return aggregates
+
+
+def _count_buckets(keys):
+    """Rows for ``(company_id, category_id, period, bucket_start)`` buckets counted from the expenses (a query each)"""
+    rows = []
+    for company_id, category_id, period, bucket_start in keys:
+        end = bucket_start + timedelta(days=1) if period == 'DAY' else _next_month(bucket_start)
+        totals = Expense.objects.filter(
+            company_id=company_id,
+            category_id=category_id,
+            status__in=ROLLUP_STATUSES,
+            expense_date__gte=bucket_start,
+            expense_date__lt=end,
+        ).aggregate(**_aggregates())
+        if any(totals[count_field] for _, count_field in ROLLUP_STATUSES.values()):
+            rows.append(CategoryRollup(
+                company_id=company_id, category_id=category_id, period=period, bucket_start=bucket_start, **totals,
+            ))
+    return rows
+
+
+def rebuild(company_ids=None, batch_size=1000):
+    """Recompute all buckets from the expenses table; returns the number of rows written"""
+    rollups = CategoryRollup.objects.all()
+    expenses = Expense.objects.filter(status__in=ROLLUP_STATUSES).order_by()
+    if company_ids is not None:
+        rollups = rollups.filter(company_id__in=company_ids)
+        expenses = expenses.filter(company_id__in=company_ids)
+
+    aggregates = _aggregates()
+    rows = []
+    for period, bucket_start in (('DAY', F('expense_date')), ('MONTH', TruncMonth('expense_date'))):
+        buckets = (
+            expenses.annotate(bucket=bucket_start)
+            .values('company_id', 'category_id', 'bucket')
+            .annotate(**aggregates)
+        )
+        for bucket in buckets:
+            rows.append(CategoryRollup(
+                company_id=bucket.pop('company_id'),
+                category_id=bucket.pop('category_id'),
+                period=period,
+                bucket_start=bucket.pop('bucket'),
+                **bucket,
+            ))
+
+    with transaction.atomic():
+        rollups.delete()
+        CategoryRollup.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def _bucket_filter(start, end):
+    """Q covering [start, end] with MONTH buckets inside it and DAY buckets at the edges"""
+    first_full_month = start if start.day == 1 else _next_month(start)
+    after_last_full_month = _month_start(end + timedelta(days=1))
+    if first_full_month >= after_last_full_month:
+        return Q(period='DAY', bucket_start__gte=start, bucket_start__lte=end)
+    return (
+        Q(period='MONTH', bucket_start__gte=first_full_month, bucket_start__lt=after_last_full_month)
+        | Q(period='DAY', bucket_start__gte=start, bucket_start__lt=first_full_month)
+        | Q(period='DAY', bucket_start__gte=after_last_full_month, bucket_start__lte=end)
+    )
+
+
+def category_totals(company_id, start=None, end=None):
+    """Approved/rejected totals per category over ``[start, end]`` (inclusive).
+
+    Returns dicts sorted by approved amount, each with the category name and
+    its share of the approved total as ``percent``.
+    """
+    if start is None or end is None:
+        # The current date in TIME_ZONE, as expense dates are entered
+        today = timezone.localdate()
+        start = start or today.replace(month=1, day=1)
+        end = end or today
+
+    totals = (
+        CategoryRollup.objects.filter(_bucket_filter(start, end), company_id=company_id)
+        .values('category_id')
+        .annotate(
+            approved_amount=Sum('approved_amount'),
+            approved_count=Sum('approved_count'),
+            rejected_amount=Sum('rejected_amount'),
+            rejected_count=Sum('rejected_count'),
+        )
+        .order_by('-approved_amount')
+    )
+    totals = [row for row in totals if row['approved_count'] or row['rejected_count']]
+    grand_total = sum(row['approved_amount'] for row in totals) or Decimal(0)
+    names = reference_data.category_names(company_id, [row['category_id'] for row in totals])
+    for row in totals:
+        row['category_name'] = names.get(row['category_id'])
+        row['percent'] = round(row['approved_amount'] * 100 / grand_total) if grand_total else 0
+    return totals
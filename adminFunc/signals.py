@@ -0,0 +1,136 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import (
+    approval_rules, backends, exchange_rates, hierarchy, inbox, profiling, receipts, reference_data, sqlite_mode, stats,
+    thumbnails,
+)
+from .models import (
+    ApprovalRule, ApprovalStep, Company, CurrencyExchangeRate, Expense, ExpenseApproval, ExpenseCategory, ReceiptBlob,
+    User,
+)
+
+
+@receiver([post_save, post_delete], sender=ApprovalRule)
+def approval_rule_changed(sender, instance, **kwargs):
+    approval_rules.invalidate(instance.company_id)
+    stats.refresh_rule_count(instance.company_id)
+
+
+@receiver([post_save, post_delete], sender=ApprovalStep)
+def approval_step_changed(sender, instance, **kwargs):
+    company_id = ApprovalRule.objects.filter(pk=instance.approval_rule_id).values_list('company_id', flat=True).first()
+    if company_id is not None:
+        approval_rules.invalidate(company_id)
+
+
+@receiver(m2m_changed, sender=ApprovalRule.categories.through)
+def approval_rule_categories_changed(sender, instance, action, **kwargs):
+    # ``instance`` is the rule or, when edited from the other side, the
+    # category; both belong to the company whose rules changed
+    if action.startswith('post_'):
+        approval_rules.invalidate(instance.company_id)
+
+
+# Expense fields that decide whose inbox an expense is in
+INBOX_FIELDS = {'status', 'current_approval_step'}
+
+
+@receiver(post_save, sender=Expense)
+def expense_saved(sender, instance, created, update_fields=None, **kwargs):
+    old_state = None if created else getattr(instance, '_loaded_stats', None)
+    new_state = instance.stats_state()
+    if created or old_state is not None:
+        stats.record_expense_transitions([(old_state, new_state)])
+    # Without a loaded state (deferred fields) the counters are left to the
+    # consistency check
+    instance._loaded_stats = new_state
+    # A new expense has no approvers yet
+    if not created and (update_fields is None or INBOX_FIELDS & set(update_fields)):
+        inbox.invalidate_for_expenses([instance.pk])
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, **kwargs):
+    old_state = getattr(instance, '_loaded_stats', None) or instance.stats_state()
+    stats.record_expense_transitions([(old_state, None)])
+    if instance.receipt_blob_id:
+        receipts.release([instance.receipt_blob_id])
+
+
+# User fields the cached manager tree depends on
+MANAGER_TREE_FIELDS = {'manager', 'manager_id', 'company', 'company_id', 'is_active'}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    old_state = None if created else getattr(instance, '_loaded_stats', None)
+    new_state = instance.stats_state()
+    if created or old_state is not None:
+        stats.apply_deltas(stats.user_state_delta(old_state, new_state))
+    instance._loaded_stats = new_state
+    backends.invalidate('user', instance.pk)
+    if created:
+        hierarchy.attach(instance.pk, instance.manager_id)
+    elif 'manager_id' in instance.__dict__ and (update_fields is None or {'manager', 'manager_id'} & set(update_fields)):
+        if instance.manager_id != getattr(instance, '_loaded_manager_id', object()):
+            hierarchy.move(instance.pk, instance.manager_id)
+    if 'manager_id' in instance.__dict__:
+        instance._loaded_manager_id = instance.manager_id
+    # Logins save only last_login and leave the tree alone
+    if update_fields is None or MANAGER_TREE_FIELDS & set(update_fields):
+        company_ids = {instance.company_id, old_state[0] if old_state else None} - {None}
+        for company_id in company_ids:
+            reference_data.invalidate('manager_tree', company_id)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # Deleting a manager sets its reports' manager to NULL without signals
+    hierarchy.detach_reports(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    old_state = getattr(instance, '_loaded_stats', None) or instance.stats_state()
+    stats.apply_deltas(stats.user_state_delta(old_state, None))
+    backends.invalidate('user', instance.pk)
+    if instance.company_id:
+        reference_data.invalidate('manager_tree', instance.company_id)
+
+
+@receiver([post_save, post_delete], sender=Company)
+def company_changed(sender, instance, **kwargs):
+    backends.invalidate('company', instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ExpenseCategory)
+def expense_category_changed(sender, instance, **kwargs):
+    reference_data.invalidate('categories', instance.company_id)
+
+
+@receiver([post_save, post_delete], sender=ExpenseApproval)
+def expense_approval_changed(sender, instance, **kwargs):
+    inbox.invalidate_for_expenses([instance.expense_id])
+
+
+@receiver([post_save, post_delete], sender=CurrencyExchangeRate)
+def exchange_rate_changed(sender, instance, **kwargs):
+    # store_rates() writes in bulk and invalidates once itself
+    exchange_rates.invalidate()
+
+
+@receiver(post_save, sender=ReceiptBlob)
+def receipt_blob_saved(sender, instance, created, **kwargs):
+    if created:
+        thumbnails.schedule(instance)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite' and sqlite_mode.enabled():
+        sqlite_mode.apply_pragmas(connection)
+    # Always installed: PROFILING can be switched on at runtime, and outside
+    # a profiled request the recorder only reads a ContextVar
+    profiling.install(connection)
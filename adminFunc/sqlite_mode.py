@@ -0,0 +1,44 @@
+"""SQLite production mode for small single-node installs.
+
+Enabled with SQLITE_PRODUCTION:
+
+* every new SQLite connection switches the database to WAL and sets
+  ``synchronous=NORMAL``, ``busy_timeout``, ``mmap_size``, ``cache_size`` and
+  in-memory temp storage (``apply_pragmas``, from a ``connection_created``
+  receiver). In WAL mode readers work from a snapshot and never wait for a
+  writer;
+* transactions begin IMMEDIATE (see ``settings.DATABASES``), so a
+  transaction takes the write lock up front and waits ``busy_timeout`` for
+  it, instead of failing with "database is locked" when a read transaction
+  later tries to upgrade to a write.
+
+``benchmark_sqlite`` measures the modes on this machine; on one core with 8
+writer and 4 reader threads it showed about 27 writes/s for the defaults and
+118 writes/s for the pragmas and IMMEDIATE transactions. (Funnelling every
+write path through one writer thread avoided the occasional lock timeout but
+cut that to 32 writes/s, so it is not offered.)
+"""
+from django.conf import settings
+
+
+def enabled():
+    return getattr(settings, 'SQLITE_PRODUCTION', False)
+
+
+def pragmas():
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': getattr(settings, 'SQLITE_BUSY_TIMEOUT', 5000),
+        'mmap_size': getattr(settings, 'SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': getattr(settings, 'SQLITE_CACHE_SIZE', -64000),
+        'temp_store': 'MEMORY',
+    }
+
+
+def apply_pragmas(db_connection, values=None):
+    """Set connection pragmas on a new SQLite connection (``values`` defaults to ``pragmas()``)"""
+    with db_connection.cursor() as cursor:
+        for name, value in (values or pragmas()).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
@@ -0,0 +1,183 @@
+"""Materialized dashboard counters (CompanyStats).
+
+Counters are kept up to date incrementally: single saves go through the
+signal handlers in ``adminFunc.signals``, while bulk service paths (which
+bypass signals) report their status transitions with
+``record_expense_transitions``, which also feeds the category rollups.
+``rebuild`` recomputes rows from scratch and ``find_drift`` compares stored
+rows against a fresh aggregation.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from . import rollups
+from .models import ApprovalRule, CompanyStats, Expense, User
+
+EXPENSE_COUNT_FIELDS = {
+    'DRAFT': 'draft_expenses',
+    'PENDING': 'pending_expenses',
+    'APPROVED': 'approved_expenses',
+    'REJECTED': 'rejected_expenses',
+    'CANCELLED': 'cancelled_expenses',
+}
+EXPENSE_AMOUNT_FIELDS = {
+    'PENDING': 'pending_amount',
+    'APPROVED': 'approved_amount',
+}
+USER_COUNT_FIELDS = {
+    'ADMIN': 'admin_users',
+    'MANAGER': 'manager_users',
+    'EMPLOYEE': 'employee_users',
+}
+COUNTER_FIELDS = (
+    ['total_expenses', *EXPENSE_COUNT_FIELDS.values(), *EXPENSE_AMOUNT_FIELDS.values()]
+    + ['total_users', *USER_COUNT_FIELDS.values(), 'active_approval_rules']
+)
+
+
+def _expense_contribution(status, amount, sign, delta):
+    delta['total_expenses'] += sign
+    delta[EXPENSE_COUNT_FIELDS[status]] += sign
+    if status in EXPENSE_AMOUNT_FIELDS and amount:
+        delta[EXPENSE_AMOUNT_FIELDS[status]] += sign * Decimal(amount)
+
+
+def _user_contribution(role, sign, delta):
+    delta['total_users'] += sign
+    if role in USER_COUNT_FIELDS:
+        delta[USER_COUNT_FIELDS[role]] += sign
+
+
+def apply_deltas(deltas):
+    """Apply ``{company_id: Counter(field=delta)}`` with one UPDATE per company"""
+    for company_id, delta in deltas.items():
+        changes = {field: F(field) + value for field, value in delta.items() if value}
+        if company_id and changes:
+            # A missing row is built from the source tables on first read
+            CompanyStats.objects.filter(company_id=company_id).update(**changes)
+
+
+def expense_state_delta(old_state, new_state, deltas=None):
+    """Accumulate the change between two ``Expense.stats_state()`` values"""
+    deltas = defaultdict(Counter) if deltas is None else deltas
+    if old_state == new_state:
+        return deltas
+    if old_state is not None:
+        _expense_contribution(old_state.status, old_state.amount, -1, deltas[old_state.company_id])
+    if new_state is not None:
+        _expense_contribution(new_state.status, new_state.amount, 1, deltas[new_state.company_id])
+    return deltas
+
+
+def user_state_delta(old_state, new_state, deltas=None):
+    """Accumulate the change between two ``User.stats_state()`` values"""
+    deltas = defaultdict(Counter) if deltas is None else deltas
+    if old_state == new_state:
+        return deltas
+    if old_state is not None and old_state[0]:
+        _user_contribution(old_state[1], -1, deltas[old_state[0]])
+    if new_state is not None and new_state[0]:
+        _user_contribution(new_state[1], 1, deltas[new_state[0]])
+    return deltas
+
+
+def record_expense_transitions(transitions):
+    """Update counters and category rollups given ``(old_state, new_state)`` pairs"""
+    deltas = defaultdict(Counter)
+    bucket_deltas = defaultdict(Counter)
+    for old_state, new_state in transitions:
+        expense_state_delta(old_state, new_state, deltas)
+        rollups.rollup_delta(old_state, new_state, bucket_deltas)
+    apply_deltas(deltas)
+    rollups.apply_rollup_deltas(bucket_deltas)
+
+
+def refresh_rule_count(company_id):
+    CompanyStats.objects.filter(company_id=company_id).update(
+        active_approval_rules=ApprovalRule.objects.filter(company_id=company_id, is_active=True).count()
+    )
+
+
+def compute(company_ids=None):
+    """Fresh counters per company, aggregated from the source tables"""
+    def scoped(queryset):
+        return queryset if company_ids is None else queryset.filter(company_id__in=company_ids)
+
+    amount = Coalesce('converted_amount', 'amount')
+    expense_aggregates = {
+        'total_expenses': Count('id'),
+        **{field: Count('id', filter=Q(status=status)) for status, field in EXPENSE_COUNT_FIELDS.items()},
+        **{field: Sum(amount, filter=Q(status=status), default=Decimal(0))
+           for status, field in EXPENSE_AMOUNT_FIELDS.items()},
+    }
+    user_aggregates = {
+        'total_users': Count('id'),
+        **{field: Count('id', filter=Q(role=role)) for role, field in USER_COUNT_FIELDS.items()},
+    }
+
+    results = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    if company_ids is not None:
+        # Requested companies without any rows still get a zeroed entry
+        for company_id in company_ids:
+            results[company_id]
+    for row in scoped(Expense.objects.order_by()).values('company_id').annotate(**expense_aggregates):
+        results[row.pop('company_id')].update(row)
+    for row in scoped(User.objects.exclude(company=None).order_by()).values('company_id').annotate(**user_aggregates):
+        results[row.pop('company_id')].update(row)
+    rules = scoped(ApprovalRule.objects.filter(is_active=True).order_by()).values('company_id')
+    for row in rules.annotate(active_approval_rules=Count('id')):
+        results[row.pop('company_id')].update(row)
+    return dict(results)
+
+
+def rebuild(company_ids=None, batch_size=500):
+    """Recompute and upsert stats rows; returns the number of rows written"""
+    fresh = compute(company_ids)
+    rows = [CompanyStats(company_id=company_id, **values) for company_id, values in fresh.items()]
+    CompanyStats.objects.bulk_create(
+        rows,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['company'],
+        update_fields=COUNTER_FIELDS + ['updated_at'],
+    )
+    return len(rows)
+
+
+def find_drift(company_ids=None):
+    """``{company_id: {field: (stored, actual)}}`` for every counter that is off"""
+    fresh = compute(company_ids)
+    stored = CompanyStats.objects.filter(company_id__in=fresh.keys()).in_bulk()
+    drift = {}
+    for company_id, values in fresh.items():
+        row = stored.get(company_id)
+        diff = {
+            field: (getattr(row, field) if row else None, value)
+            for field, value in values.items()
+            if row is None or getattr(row, field) != value
+        }
+        if diff:
+            drift[company_id] = diff
+    return drift
+
+
+def get_company_stats(company):
+    """The dashboard read path: one row, built on first access"""
+    try:
+        return CompanyStats.objects.get(company=company)
+    except CompanyStats.DoesNotExist:
+        rebuild([company.pk])
+        return CompanyStats.objects.get(company=company)
+
+
+async def aget_company_stats(company):
+    """``get_company_stats`` for async views"""
+    try:
+        return await CompanyStats.objects.aget(company=company)
+    except CompanyStats.DoesNotExist:
+        await sync_to_async(rebuild)([company.pk])
+        return await CompanyStats.objects.aget(company=company)
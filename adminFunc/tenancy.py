@@ -0,0 +1,74 @@
+"""Tenant (company) context.
+
+``TenantMiddleware`` activates the signed-in user's company for the duration
+of a request. While a company is active, the default ``objects`` manager of
+company-owned models (``CompanyScopedManager``) adds ``company_id = <active
+company>`` to every query, so a view that forgets to scope a query cannot
+read another tenant's rows. Outside a tenant (anonymous requests, management
+commands, workers) the managers are unfiltered; ``all_objects`` is always
+unfiltered.
+
+The context is a ``ContextVar``, so it follows the request across async code
+and never leaks between threads.
+"""
+from contextlib import contextmanager
+from functools import partial
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+_company_id = ContextVar('adminFunc_company_id', default=None)
+
+
+def current_company_id():
+    """The active tenant's company id, None outside a tenant"""
+    return _company_id.get()
+
+
+@contextmanager
+def using(company_id):
+    """Run a block as tenant ``company_id`` (None for no tenant)"""
+    token = _company_id.set(company_id)
+    try:
+        yield
+    finally:
+        _company_id.reset(token)
+
+
+def unscoped():
+    """Run a block without a tenant, e.g. for a deliberate cross-company query"""
+    return using(None)
+
+
+class TenantMiddleware:
+    """Activates the signed-in user's company; must follow AuthenticationMiddleware"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        user = getattr(request, 'user', None)
+        company_id = user.company_id if user is not None and user.is_authenticated else None
+        if user is not None:
+            # An async view behind this sync chain would load the user again
+            request.auser = partial(_resolved, user)
+        with using(company_id):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # request.user would query the session synchronously
+        user = await request.auser() if hasattr(request, 'auser') else None
+        company_id = user.company_id if user is not None and user.is_authenticated else None
+        with using(company_id):
+            return await self.get_response(request)
+
+
+async def _resolved(user):
+    return user
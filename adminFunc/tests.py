@@ -1,3 +1,1598 @@
-from django.test import TestCase
+import csv
+import gzip
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from pathlib import Path
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F, QuerySet
+from django import test
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import cache as cache_module
+from . import (
+    approval_rules, audit, audit_archive, backends, countries, decisions, exchange_rates, exporter, hierarchy, imaging,
+    importer, inbox, logins, ocr, ocr_extractors, profiling, provisioning, receipts, reference_data, rollups,
+    sqlite_mode, stats, tenancy, thumbnails,
+)
+from .pagination import keyset_page
+from .cache import TTLCache, clear_local
+from .models import ApprovalRule, ApprovalStep, AuditLog, AuditLogSegment, CategoryRollup, Company, CompanyStats, CurrencyExchangeRate, Expense, ExpenseApproval, ExpenseCategory, ExpenseComment, ExpenseLine, ExpenseSequence, OcrJob, ReceiptBlob, User, UserHierarchy
+
+
+class TestCase(test.TestCase):
+    """Starts each test with empty in-process caches: they outlive the rolled back rows of earlier tests"""
+
+    def setUp(self):
+        clear_local()
+
+
+def make_company(name='Acme', currency_code='USD'):
+    return Company.objects.create(name=name, country='United States', currency_code=currency_code)
+
+
+def make_user(company, username, role='EMPLOYEE', manager=None, password=None):
+    # No password by default: hashing one takes most of a test's time
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password=password,
+        company=company, role=role, manager=manager,
+    )
+
+
+def make_expense(employee, category, amount='100.00', currency_code=None, expense_date=None, **fields):
+    return Expense.objects.create(
+        employee=employee,
+        company=employee.company,
+        category=category,
+        description='Taxi',
+        amount=Decimal(amount),
+        currency_code=currency_code or employee.company.currency_code,
+        expense_date=expense_date or date(2026, 3, 10),
+        **fields,
+    )
+
+
+class Worker:
+    """One simulated worker process: its own in-process caches, and the given Django cache"""
+
+    LOCAL_CACHES = [
+        (backends, '_loaded'), (exchange_rates, '_local'), (exchange_rates._versions, '_local'),
+        (reference_data, '_loaded'), (reference_data._versions, '_local'),
+    ]
+    CACHE_USERS = [exchange_rates, cache_module]
+
+    def __init__(self, django_cache):
+        self.cache = django_cache
+        self.local = {owner: TTLCache(maxsize=100, ttl=600) for owner, _ in self.LOCAL_CACHES}
+
+    def __enter__(self):
+        self._patches = [mock.patch.object(owner, name, self.local[owner]) for owner, name in self.LOCAL_CACHES]
+        self._patches += [mock.patch.object(module, 'cache', self.cache) for module in self.CACHE_USERS]
+        for patch in self._patches:
+            patch.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patch in reversed(self._patches):
+            patch.stop()
+
+
+class CachedUserLoaderTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.user = make_user(self.company, 'alice')
+
+    @override_settings(SHARED_CACHE=True)
+    def test_deactivation_reaches_other_workers_through_shared_cache(self):
+        shared_cache = LocMemCache('shared', {})
+        worker_a, worker_b = Worker(shared_cache), Worker(shared_cache)
+        with worker_a:
+            self.assertIsNotNone(backends.CachedModelBackend().get_user(self.user.pk))
+            with self.assertNumQueries(0):
+                self.assertIsNotNone(backends.CachedModelBackend().get_user(self.user.pk))
+        with worker_b:
+            user = User.all_objects.get(pk=self.user.pk)
+            user.is_active = False
+            user.save()
+        with worker_a:
+            self.assertIsNone(backends.CachedModelBackend().get_user(self.user.pk))
+
+    @override_settings(SHARED_CACHE=False, AUTH_USER_CACHE_TTL=5)
+    def test_per_process_caches_are_invalidated_by_signals(self):
+        backends.CachedModelBackend().get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(backends.CachedModelBackend().get_user(self.user.pk))
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(backends.CachedModelBackend().get_user(self.user.pk))
+
+    @override_settings(SHARED_CACHE=False, AUTH_USER_CACHE_TTL=5)
+    def test_per_process_caches_serve_another_workers_change_once_expired(self):
+        worker_a = Worker(LocMemCache('worker-a', {}))
+        worker_b = Worker(LocMemCache('worker-b', {}))
+        with worker_a:
+            self.assertIsNotNone(backends.CachedModelBackend().get_user(self.user.pk))
+        with worker_b:
+            user = User.all_objects.get(pk=self.user.pk)
+            user.set_password('an0ther-Passw0rd')
+            user.is_active = False
+            user.save()
+        with worker_a:
+            self.assertIsNotNone(backends.CachedModelBackend().get_user(self.user.pk))
+            with mock.patch('time.monotonic', return_value=time.monotonic() + 6):
+                self.assertIsNone(backends.CachedModelBackend().get_user(self.user.pk))
+
+    def test_evicted_versions_never_match_an_old_tag(self):
+        backends.CachedModelBackend().get_user(self.user.pk)
+        User.all_objects.filter(pk=self.user.pk).update(is_active=False)
+        cache.delete(backends._versions.key(f'user:{self.user.pk}'))
+        self.assertIsNone(backends.CachedModelBackend().get_user(self.user.pk))
+
+
+class ExpenseConversionTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company(currency_code='EUR')
+        self.employee = make_user(self.company, 'bob')
+        self.category = ExpenseCategory.objects.create(name='Travel', company=self.company)
+        exchange_rates.store_rates([
+            ('USD', 'EUR', '0.900000', date(2026, 3, 1)),
+            ('GBP', 'EUR', '1.200000', date(2026, 3, 1)),
+        ])
+
+    def test_converts_on_create(self):
+        expense = make_expense(self.employee, self.category, '100.00', 'USD')
+        self.assertEqual(expense.converted_amount, Decimal('90.00'))
+        self.assertEqual(expense.conversion_rate, Decimal('0.900000'))
+
+    def test_reconverts_when_an_input_changes(self):
+        expense = Expense.objects.get(pk=make_expense(self.employee, self.category, '100.00', 'USD').pk)
+
+        expense.amount = Decimal('200.00')
+        expense.save()
+        self.assertEqual(Expense.objects.get(pk=expense.pk).converted_amount, Decimal('180.00'))
+
+        expense.currency_code = 'GBP'
+        expense.save(update_fields=['currency_code'])
+        stored = Expense.objects.get(pk=expense.pk)
+        self.assertEqual((stored.converted_amount, stored.conversion_rate), (Decimal('240.00'), Decimal('1.200000')))
+
+    def test_clears_the_conversion_when_no_rate_covers_the_new_date(self):
+        expense = Expense.objects.get(pk=make_expense(self.employee, self.category, '100.00', 'USD').pk)
+        expense.expense_date = date(2025, 1, 1)
+        expense.save(update_fields=['expense_date'])
+        stored = Expense.objects.get(pk=expense.pk)
+        self.assertIsNone(stored.converted_amount)
+        self.assertEqual(stored.company_amount, Decimal('100.00'))
+
+    def test_lookups_and_misses_are_cached_in_process(self):
+        on_date = date(2026, 3, 10)
+        exchange_rates.get_rate('USD', 'EUR', on_date)
+        self.assertIsNone(exchange_rates.get_rate('JPY', 'EUR', on_date))
+        with self.assertNumQueries(0):
+            self.assertEqual(exchange_rates.get_rate('USD', 'EUR', on_date), Decimal('0.900000'))
+            self.assertIsNone(exchange_rates.get_rate('JPY', 'EUR', on_date))
+
+    def test_saved_rates_replace_cached_misses(self):
+        on_date = date(2026, 3, 10)
+        self.assertIsNone(exchange_rates.get_rate('JPY', 'EUR', on_date))
+        CurrencyExchangeRate.objects.create(
+            base_currency='JPY', target_currency='EUR', rate=Decimal('0.006100'), date=date(2026, 3, 1),
+        )
+        self.assertEqual(exchange_rates.get_rate('JPY', 'EUR', on_date), Decimal('0.006100'))
+
+    def test_large_inverse_rates_fit(self):
+        company = make_company('Nusantara', currency_code='IDR')
+        category = ExpenseCategory.objects.create(name='Travel', company=company)
+        exchange_rates.store_rates([
+            ('IDR', 'USD', '0.000063', date(2026, 3, 1)),
+            ('EUR', 'IDR', '17150.250000', date(2026, 3, 1)),
+        ])
+        expense = make_expense(make_user(company, 'putri'), category, '100.00', 'USD')
+        stored = Expense.objects.get(pk=expense.pk)
+        self.assertEqual(stored.conversion_rate, Decimal('15873.015873'))
+        self.assertEqual(stored.converted_amount, Decimal('1587301.59'))
+        self.assertEqual(CurrencyExchangeRate.objects.get(base_currency='EUR').rate, Decimal('17150.250000'))
+
+    @override_settings(SHARED_CACHE=True, CACHE_VERSION_TTL=0)
+    def test_replaced_rates_reach_other_workers(self):
+        shared_cache = LocMemCache('shared', {})
+        worker_a, worker_b = Worker(shared_cache), Worker(shared_cache)
+        with worker_a:
+            self.assertEqual(exchange_rates.get_rate('USD', 'EUR', date(2026, 3, 10)), Decimal('0.900000'))
+            with self.assertNumQueries(0):
+                exchange_rates.get_rate('USD', 'EUR', date(2026, 3, 10))
+        with worker_b:
+            exchange_rates.store_rates([('USD', 'EUR', '0.950000', date(2026, 3, 1))])
+        with worker_a:
+            self.assertEqual(exchange_rates.get_rate('USD', 'EUR', date(2026, 3, 10)), Decimal('0.950000'))
+
+    def test_status_only_saves_keep_the_conversion(self):
+        expense = Expense.objects.get(pk=make_expense(self.employee, self.category, '100.00', 'USD').pk)
+        expense.amount = Decimal('500.00')
+        expense.status = 'PENDING'
+        with mock.patch.object(exchange_rates, 'apply_conversion') as apply_conversion:
+            expense.save(update_fields=['status'])
+        apply_conversion.assert_not_called()
+        self.assertEqual(Expense.objects.get(pk=expense.pk).converted_amount, Decimal('90.00'))
+
+
+@override_settings(THUMBNAIL_WORKERS=0, OCR_AUTO_SUBMIT=False, RECEIPT_MAX_UPLOAD_SIZE=4096)
+class ReceiptUploadTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.acme, self.globex = make_company('Acme'), make_company('Globex')
+        self.alice, self.gina = make_user(self.acme, 'alice'), make_user(self.globex, 'gina')
+        self.travel = ExpenseCategory.objects.create(name='Travel', company=self.acme)
+        self.meals = ExpenseCategory.objects.create(name='Meals', company=self.globex)
+
+    def upload(self, user, expense, content):
+        self.client.force_login(user)
+        return self.client.post(
+            reverse('adminFunc:upload_receipt_api', args=[expense.pk]),
+            {'receipt': SimpleUploadedFile('receipt.pdf', content, content_type='application/pdf')},
+        )
+
+    def test_already_stored_only_reflects_the_uploaders_company(self):
+        content = b'%PDF-1.4 receipt'
+        response = self.upload(self.alice, make_expense(self.alice, self.travel), content)
+        self.assertIs(response.json()['already_stored'], False)
+
+        # Stored once for both companies, but Globex is not told Acme has it
+        response = self.upload(self.gina, make_expense(self.gina, self.meals), content)
+        self.assertIs(response.json()['already_stored'], False)
+        self.assertEqual(response.json()['duplicate_of'], [])
+        self.assertEqual(ReceiptBlob.objects.get().ref_count, 2)
+
+        response = self.upload(self.gina, make_expense(self.gina, self.meals), content)
+        self.assertIs(response.json()['already_stored'], True)
+        self.assertEqual(len(response.json()['duplicate_of']), 1)
+
+    def test_oversized_receipts_are_dropped_while_streaming(self):
+        response = self.upload(self.alice, make_expense(self.alice, self.travel), b'x' * 10000)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "Receipt file is too large")
+        self.assertFalse(ReceiptBlob.objects.exists())
+
+
+@override_settings(THUMBNAIL_WORKERS=0, THUMBNAIL_FORMAT='JPEG')
+class ReceiptThumbnailTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.media_root = Path(media_root)
+        company = make_company()
+        self.alice = make_user(company, 'alice')
+        self.expense = make_expense(self.alice, ExpenseCategory.objects.create(name='Travel', company=company))
+
+        image = BytesIO()
+        Image.new('RGB', (2400, 1200), 'red').save(image, format='JPEG')
+        self.blob, _ = receipts.attach(self.expense, SimpleUploadedFile('receipt.jpg', image.getvalue(), content_type='image/jpeg'))
+        self.client.force_login(self.alice)
+
+    def derivatives(self):
+        return sorted(path.name for path in self.media_root.rglob('*.v*.*'))
+
+    def test_render_downscales_to_each_size(self):
+        source = self.media_root / self.blob.file.name
+        targets = [(str(self.media_root / f'{size}.jpg'), dimensions, 'JPEG') for size, dimensions in thumbnails.SIZES.items()]
+        imaging.render(str(source), targets)
+        sizes = {}
+        for path, _, _ in targets:
+            with Image.open(path) as image:
+                sizes[Path(path).stem] = image.size
+        self.assertEqual(sizes, {'preview': (1200, 600), 'thumb': (160, 80)})
+
+    def test_derivatives_are_rendered_on_the_first_request(self):
+        url = thumbnails.thumbnail_url(self.blob, 'thumb')
+        self.assertEqual(self.derivatives(), [])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (160, 80))
+        self.assertEqual(len(self.derivatives()), len(thumbnails.SIZES))
+        self.blob.refresh_from_db()
+        self.assertEqual(self.blob.thumbnails_version, thumbnails.THUMBNAIL_VERSION)
+
+        response = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_a_stale_version_redirects_to_the_current_url(self):
+        url = reverse('adminFunc:receipt_thumbnail', kwargs={
+            'sha256': self.blob.sha256, 'size': 'thumb', 'version': thumbnails.THUMBNAIL_VERSION - 1, 'ext': 'jpg',
+        })
+        self.assertRedirects(self.client.get(url), thumbnails.thumbnail_url(self.blob, 'thumb'), fetch_redirect_response=False)
+
+    def test_a_version_bump_renders_new_derivatives(self):
+        self.assertIsNotNone(thumbnails.ensure(self.blob, 'thumb'))
+        with mock.patch.object(thumbnails, 'THUMBNAIL_VERSION', thumbnails.THUMBNAIL_VERSION + 1):
+            name = thumbnails.ensure(self.blob, 'thumb')
+            self.assertIn(f'.v{thumbnails.THUMBNAIL_VERSION}.', name)
+            self.assertEqual(len(self.derivatives()), 2 * len(thumbnails.SIZES))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.expense.delete()
+        self.assertFalse(ReceiptBlob.objects.exists())
+        self.assertEqual(list(self.media_root.rglob('*.*')), [])
+
+
+@override_settings(OCR_MAX_ATTEMPTS=3, OCR_RETRY_BACKOFF=30, OCR_COMPANY_CONCURRENCY=2)
+class OcrQueueTests(TestCase):
+
+    RECEIPT = b'Corner Cafe\n2026-03-09\nCoffee 4.50\nTotal 12.75\n'
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.acme, self.globex = make_company('Acme'), make_company('Globex')
+        self.alice, self.gina = make_user(self.acme, 'alice'), make_user(self.globex, 'gina')
+        self.travel = ExpenseCategory.objects.create(name='Travel', company=self.acme)
+        self.meals = ExpenseCategory.objects.create(name='Meals', company=self.globex)
+
+    def submit(self, user, category, content=None):
+        expense = make_expense(user, category)
+        content = content or self.RECEIPT + str(expense.pk).encode()
+        receipts.attach(expense, SimpleUploadedFile('receipt.txt', content, content_type='text/plain'))
+        return ocr.submit(expense)[0]
+
+    def test_the_same_receipt_is_queued_once(self):
+        job = self.submit(self.alice, self.travel)
+        self.assertEqual(job.extractor, 'adminFunc.ocr_extractors.local_text')
+        again, created = ocr.submit(job.expense)
+        self.assertEqual((again.pk, created), (job.pk, False))
+        self.assertEqual(OcrJob.objects.count(), 1)
+
+        [claimed] = ocr.claim('w1', 10)
+        result = ocr_extractors.run(claimed.extractor, default_storage.path(claimed.receipt_blob.file.name))
+        self.assertTrue(ocr.complete(claimed, result))
+        expense = Expense.objects.get(pk=job.expense_id)
+        self.assertEqual(expense.merchant_name, 'Corner Cafe')
+        self.assertEqual(expense.receipt_ocr_data['total'], '12.75')
+        self.assertEqual(ocr.submit(expense)[0].status, 'DONE')
+
+    def test_a_claim_only_takes_jobs_that_are_still_queued(self):
+        first, second = self.submit(self.alice, self.travel), self.submit(self.alice, self.travel)
+        real_update = QuerySet.update
+
+        def update(queryset, **kwargs):
+            if kwargs.get('locked_by') == 'w1':
+                # Another worker wins the first job between our SELECT and UPDATE
+                real_update(OcrJob.objects.filter(pk=first.pk), status='RUNNING', locked_by='w2')
+            return real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            claimed = ocr.claim('w1', 10)
+        self.assertEqual([job.pk for job in claimed], [second.pk])
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual(OcrJob.objects.get(pk=first.pk).locked_by, 'w2')
+        self.assertEqual(ocr.claim('w3', 10), [])
+
+    def test_each_company_runs_at_most_its_share(self):
+        acme_jobs = [self.submit(self.alice, self.travel) for _ in range(3)]
+        globex_job = self.submit(self.gina, self.meals)
+        claimed = ocr.claim('w1', 10)
+        self.assertEqual(sorted(job.pk for job in claimed), sorted([acme_jobs[0].pk, acme_jobs[1].pk, globex_job.pk]))
+        self.assertEqual(ocr.claim('w2', 10), [])
+
+        ocr.complete(claimed[0], {'merchant': None})
+        self.assertEqual([job.pk for job in ocr.claim('w2', 10)], [acme_jobs[2].pk])
+
+    def test_failures_back_off_until_max_attempts(self):
+        job = self.submit(self.alice, self.travel)
+        for attempt, backoff in ((1, 30), (2, 60)):
+            [claimed] = ocr.claim('w1', 10)
+            self.assertEqual(claimed.attempts, attempt)
+            before = timezone.now()
+            ocr.fail(claimed, 'boom')
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'QUEUED')
+            self.assertAlmostEqual((job.run_after - before).total_seconds(), backoff, delta=1)
+            # Not runnable until the backoff has passed
+            self.assertEqual(ocr.claim('w1', 10), [])
+            OcrJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+        [claimed] = ocr.claim('w1', 10)
+        ocr.fail(claimed, 'boom')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('FAILED', 3, 'boom'))
+        self.assertEqual(ocr.claim('w1', 10), [])
+
+    def test_jobs_of_a_dead_worker_are_requeued_after_the_lease(self):
+        job = self.submit(self.alice, self.travel)
+        [lost] = ocr.claim('w1', 10)
+        self.assertEqual(ocr.requeue_stale(lease_seconds=300), 0)
+        OcrJob.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=301))
+        self.assertEqual(ocr.requeue_stale(lease_seconds=300), 1)
+
+        [taken] = ocr.claim('w2', 10)
+        self.assertEqual(taken.attempts, 2)
+        # The late worker's result is discarded
+        self.assertFalse(ocr.complete(lost, {'merchant': 'Late'}))
+        self.assertTrue(ocr.complete(taken, {'merchant': 'On time'}))
+        self.assertEqual(Expense.objects.get(pk=job.expense_id).merchant_name, 'On time')
+
+
+class AuditWriterTests(TransactionTestCase):
+
+    def entry(self, object_id):
+        return AuditLog(action='UPDATE', model_name='Expense', object_id=object_id, description='Edited')
+
+    def test_a_failing_entry_does_not_hold_back_the_batch(self):
+        writer = audit.AuditWriter(max_attempts=2)
+        broken = self.entry(None)  # object_id is NOT NULL
+        with self.assertLogs(audit.logger, 'ERROR'):
+            retry = writer._flush([self.entry(1), broken, self.entry(2)])
+        self.assertEqual(retry, [broken])
+        self.assertEqual(sorted(AuditLog.objects.values_list('object_id', flat=True)), [1, 2])
+
+        with self.assertLogs(audit.logger, 'ERROR') as logs:
+            retry = writer._flush(retry + [self.entry(3)])
+        self.assertEqual(retry, [])
+        self.assertIn('Dropping audit log entry (failed 2 times)', '\n'.join(logs.output))
+        self.assertEqual(AuditLog.objects.count(), 3)
+        self.assertEqual(writer.metrics()['dropped'], 1)
+
+    def test_the_retry_buffer_is_capped(self):
+        writer = audit.AuditWriter(max_attempts=10, max_retry=2)
+        with self.assertLogs(audit.logger, 'ERROR'):
+            retry = writer._flush([self.entry(None) for _ in range(5)])
+        self.assertEqual(len(retry), 2)
+        self.assertEqual(writer.metrics()['dropped'], 3)
+
+    def test_entries_keep_their_event_time_when_written_late(self):
+        writer = audit.AuditWriter(max_attempts=3)
+        late = self.entry(None)
+        event_time = late.created_at
+        with self.assertLogs(audit.logger, 'ERROR'):
+            retry = writer._flush([late])
+        late.object_id = 1
+        writer._flush(retry)
+        self.assertEqual(AuditLog.objects.get().created_at, event_time)
+
+    def test_an_explicit_created_at_is_kept(self):
+        month_end = datetime(2026, 1, 31, 23, 59, 59, tzinfo=dt_timezone.utc)
+        writer = audit.AuditWriter()
+        writer._flush([AuditLog(action='UPDATE', model_name='Expense', object_id=1, description='Edited', created_at=month_end)])
+        self.assertEqual(AuditLog.objects.get().created_at, month_end)
+
+
+class CategoryRollupTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.employee = make_user(self.company, 'carol')
+        self.categories = [
+            ExpenseCategory.objects.create(name=name, company=self.company) for name in ('Hotel', 'Meals', 'Travel')
+        ]
+
+    def test_totals_look_up_category_names_once(self):
+        for i, category in enumerate(self.categories, start=1):
+            make_expense(self.employee, category, f'{i}0.00', status='APPROVED')
+        with self.assertNumQueries(2):
+            totals = rollups.category_totals(self.company.pk, date(2026, 1, 1), date(2026, 12, 31))
+        self.assertEqual(
+            [(row['category_name'], row['approved_amount'], row['percent']) for row in totals],
+            [('Travel', Decimal('30.00'), 50), ('Meals', Decimal('20.00'), 33), ('Hotel', Decimal('10.00'), 17)],
+        )
+
+    def rollup_rows(self):
+        return sorted(CategoryRollup.objects.values_list(
+            'category_id', 'period', 'bucket_start', 'approved_amount', 'approved_count', 'rejected_amount', 'rejected_count',
+        ))
+
+    def test_deltas_for_many_buckets_are_applied_in_bulk(self):
+        expenses = [
+            make_expense(self.employee, self.categories[i % 3], '10.00', expense_date=date(2026, 1, 1) + timedelta(days=i))
+            for i in range(60)
+        ]
+        make_expense(self.employee, self.categories[0], '5.00', status='APPROVED', expense_date=date(2026, 1, 1))
+
+        transitions = []
+        for i, expense in enumerate(expenses):
+            old_state = expense.stats_state()
+            expense.status = 'APPROVED' if i % 2 else 'REJECTED'
+            transitions.append((old_state, expense.stats_state()))
+        Expense.objects.bulk_update(expenses, ['status'])
+        # The stats UPDATE, then a lookup, one UPDATE and one INSERT (in a
+        # savepoint) for the buckets, however many there are
+        with self.assertNumQueries(6):
+            stats.record_expense_transitions(transitions)
+
+        incremental = self.rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rollup_rows())
+
+        # Undoing them only updates
+        transitions = [(new_state, old_state) for old_state, new_state in transitions]
+        with self.assertNumQueries(3):
+            stats.record_expense_transitions(transitions)
+        self.assertFalse(CategoryRollup.objects.exclude(approved_count=0, rejected_count=0).exclude(
+            category=self.categories[0], bucket_start=date(2026, 1, 1),
+        ).exists())
+
+    def test_missing_buckets_are_counted_rather_than_go_negative(self):
+        approved = make_expense(self.employee, self.categories[0], '30.00', status='APPROVED')
+        make_expense(self.employee, self.categories[0], '20.00', status='REJECTED', expense_date=date(2026, 3, 2))
+        # The day bucket went missing
+        CategoryRollup.objects.filter(period='DAY', bucket_start=approved.expense_date).delete()
+
+        approved.status = 'REJECTED'
+        approved.save(update_fields=['status'])
+        incremental = self.rollup_rows()
+        self.assertFalse([row for row in incremental if any(value < 0 for value in row[3:])])
+        call_command('rebuild_category_rollups', stdout=StringIO())
+        self.assertEqual(incremental, self.rollup_rows())
+
+
+class ExpenseNumberTests(TestCase):
+
+    def test_global_sequence_seeded_inside_a_tenant_sees_every_company(self):
+        acme, globex = make_company('Acme'), make_company('Globex')
+        gina = make_user(globex, 'gina')
+        make_expense(gina, ExpenseCategory.objects.create(name='Meals', company=globex), expense_number='EXP-2026-0041')
+        ExpenseSequence.objects.all().delete()
+
+        with tenancy.using(acme.pk):
+            self.assertEqual(Expense.allocate_numbers(2, company=acme, year=2026), ['EXP-2026-0042', 'EXP-2026-0043'])
+
+    def test_blocks_are_contiguous(self):
+        self.assertEqual(Expense.allocate_numbers(3, year=2026), ['EXP-2026-0001', 'EXP-2026-0002', 'EXP-2026-0003'])
+        self.assertEqual(ExpenseSequence.objects.reserve(2026, 5), 4)
+        self.assertEqual(Expense.allocate_numbers(1, year=2026), ['EXP-2026-0009'])
+        self.assertEqual(Expense.allocate_numbers(1, year=2027), ['EXP-2027-0001'])
+        with self.assertRaises(ValueError):
+            ExpenseSequence.objects.reserve(2026, 0)
+
+    def test_sequence_created_concurrently(self):
+        ExpenseSequence.objects.create(year=2026, last_value=50)
+        update = QuerySet.update
+        calls = []
+
+        def update_before_insert(queryset, **kwargs):
+            # The first UPDATE runs before another transaction inserts the row
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_before_insert):
+            self.assertEqual(ExpenseSequence.objects.reserve(2026, 2), 51)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(ExpenseSequence.objects.get(year=2026, company=None).last_value, 52)
+
+    def test_numbers_past_9999(self):
+        company = make_company()
+        category = ExpenseCategory.objects.create(name='Meals', company=company)
+        employee = make_user(company, 'alice')
+        make_expense(employee, category, expense_number='EXP-2026-9999')
+        make_expense(employee, category, expense_number='EXP-2026-10000')
+        ExpenseSequence.objects.all().delete()
+
+        # '9999' sorts after '10000' as text
+        self.assertEqual(ExpenseSequence.seed_value(2026), 10000)
+        self.assertEqual(Expense.allocate_numbers(2, year=2026), ['EXP-2026-10001', 'EXP-2026-10002'])
+
+    @override_settings(EXPENSE_NUMBER_PER_COMPANY=True)
+    def test_per_company_sequences(self):
+        acme, globex = make_company('Acme'), make_company('Globex')
+        make_expense(make_user(globex, 'gina'), ExpenseCategory.objects.create(name='Meals', company=globex))
+        self.assertEqual(Expense.allocate_numbers(2, company=acme, year=2026), [
+            f'EXP-2026-C{acme.pk}-0001', f'EXP-2026-C{acme.pk}-0002',
+        ])
+        self.assertEqual(Expense.allocate_numbers(1, company=globex, year=2026), [f'EXP-2026-C{globex.pk}-0002'])
+        # Per-company numbers do not seed the global sequence
+        self.assertEqual(ExpenseSequence.seed_value(2026), 0)
+
+
+class AuditArchiveTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir, ignore_errors=True)
+        self.enterContext(override_settings(AUDIT_ARCHIVE_DIR=archive_dir, AUDIT_ASYNC=False))
+        self.archive_dir = Path(archive_dir)
+        self.company = make_company()
+        self.month = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        for username in ('dave', 'erin'):
+            user = make_user(self.company, username)
+            with self.captureOnCommitCallbacks(execute=True):
+                audit.log(user, 'UPDATE', 'Expense', 1, f'Edited by {username}')
+        AuditLog.objects.update(created_at=self.month + timedelta(days=3))
+        User.objects.get(username='erin').delete()
+
+    def test_entries_keep_their_company_after_the_user_is_deleted(self):
+        self.assertEqual(len(list(audit_archive.search(company_id=self.company.pk))), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            segment = audit_archive.archive_month(self.month)
+        self.assertEqual(segment.company_ids, [self.company.pk])
+        rows = list(audit_archive.search(company_id=self.company.pk))
+        self.assertEqual([row['description'] for row in rows], ['Edited by dave', 'Edited by erin'])
+        self.assertIsNone(rows[1]['user_id'])
+
+    def test_a_rolled_back_archive_leaves_no_segment_file(self):
+        with mock.patch.object(AuditLogSegment.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                audit_archive.archive_month(self.month)
+        self.assertEqual(list(self.archive_dir.rglob('*.*')), [])
+        self.assertEqual(AuditLog.objects.count(), 2)
+
+    def test_the_segment_file_is_in_place_before_the_rows_are_deleted(self):
+        def delete(queryset):
+            files = list(self.archive_dir.rglob('*.jsonl.gz'))
+            self.assertEqual(len(files), 1)
+            with gzip.open(files[0], 'rt') as f:
+                self.assertEqual(len(f.readlines()), 2)
+            return real_delete(queryset)
+
+        real_delete = QuerySet.delete
+        with mock.patch.object(QuerySet, 'delete', delete):
+            segment = audit_archive.archive_month(self.month)
+        self.assertTrue((self.archive_dir / segment.path).exists())
+        self.assertEqual(AuditLog.objects.count(), 0)
+
+    def test_a_failed_delete_removes_the_segment_file(self):
+        with mock.patch.object(QuerySet, 'delete', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                audit_archive.archive_month(self.month)
+        self.assertEqual(list(self.archive_dir.rglob('*.*')), [])
+        self.assertFalse(AuditLogSegment.objects.exists())
+        self.assertEqual(AuditLog.objects.count(), 2)
+
+    def test_segments_of_the_same_month_get_distinct_files(self):
+        first = audit_archive.archive_month(self.month)
+        with self.captureOnCommitCallbacks(execute=True):
+            audit.log(None, 'UPDATE', 'Expense', 2, 'Edited again')
+        AuditLog.objects.update(created_at=self.month + timedelta(days=4))
+        second = audit_archive.archive_month(self.month)
+        self.assertNotEqual(first.path, second.path)
+        self.assertEqual([row['description'] for row in audit_archive.read_segment(second)], ['Edited again'])
+        self.assertEqual(len(list(audit_archive.read_segment(first))), 2)
+
+
+@override_settings(SHARED_CACHE=True)
+class InboxCountTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.company = make_company()
+        self.manager = make_user(self.company, 'frank', role='MANAGER')
+        self.employee = make_user(self.company, 'grace', manager=self.manager)
+        category = ExpenseCategory.objects.create(name='Travel', company=self.company)
+        self.expense = make_expense(self.employee, category, status='PENDING', current_approval_step=1)
+        ExpenseApproval.objects.create(expense=self.expense, approver=self.manager, step_number=1)
+
+    def test_a_plain_expense_save_drops_cached_counts(self):
+        self.assertEqual(inbox.pending_count(self.manager), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(inbox.pending_count(self.manager), 1)
+
+        expense = Expense.objects.get(pk=self.expense.pk)
+        expense.status = 'CANCELLED'
+        expense.save(update_fields=['status', 'updated_at'])
+        self.assertEqual(inbox.pending_count(self.manager), 0)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_nothing_to_drop_without_a_shared_cache(self):
+        expense = Expense.objects.get(pk=self.expense.pk)
+        expense.status = 'CANCELLED'
+        with CaptureQueriesContext(connection) as queries:
+            expense.save(update_fields=['status', 'updated_at'])
+        self.assertFalse([query for query in queries if 'expense_approvals' in query['sql']])
+        self.assertEqual(inbox.pending_count(self.manager), 0)
+
+
+@override_settings(AUDIT_ASYNC=False)
+class ExpenseSubmissionTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.manager = make_user(self.company, 'heidi', role='MANAGER')
+        self.employee = make_user(self.company, 'ivan', manager=self.manager)
+        self.category = ExpenseCategory.objects.create(name='Travel', company=self.company)
+
+    def test_submitting_routes_drafts_once(self):
+        drafts = [make_expense(self.employee, self.category) for _ in range(2)]
+        self.client.force_login(self.employee)
+        url = reverse('adminFunc:submit_expenses_api')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'expense_ids': [drafts[0].pk]}, content_type='application/json')
+        self.assertEqual(response.json(), {'submitted': [drafts[0].pk], 'skipped': []})
+        self.assertEqual(Expense.objects.get(pk=drafts[0].pk).status, 'PENDING')
+        self.assertEqual(AuditLog.objects.get().action, 'SUBMIT')
+
+        response = self.client.post(url, {'expense_ids': [d.pk for d in drafts]}, content_type='application/json')
+        self.assertEqual(response.json(), {'submitted': [drafts[1].pk], 'skipped': [drafts[0].pk]})
+        self.assertEqual(ExpenseApproval.objects.filter(approver=self.manager).count(), 2)
+
+    def test_routing_skips_expenses_that_already_have_approvals(self):
+        expense = make_expense(self.employee, self.category)
+        expenses = list(Expense.objects.select_related('employee').filter(pk=expense.pk))
+        self.assertEqual(list(approval_rules.route_expenses(expenses)), [expense.pk])
+        self.assertEqual(approval_rules.route_expenses(expenses), {})
+        self.assertEqual(ExpenseApproval.objects.filter(expense=expense).count(), 1)
+
+    def test_an_approver_listed_twice_is_asked_once(self):
+        cfo = make_user(self.company, 'carol', role='MANAGER')
+        rule = ApprovalRule.objects.create(name='Panel', company=self.company, rule_type='PERCENTAGE', approval_percentage=50)
+        for step_number, approver in enumerate([cfo, cfo, self.manager], start=1):
+            ApprovalStep.objects.create(approval_rule=rule, step_number=step_number, approver=approver)
+        expense = make_expense(self.employee, self.category)
+
+        result = approval_rules.submit(self.employee, [expense.pk])
+        self.assertEqual(result['submitted'], [expense.pk])
+        self.assertEqual(
+            sorted(ExpenseApproval.objects.filter(expense=expense).values_list('step_number', 'approver__username')),
+            [(1, 'heidi'), (2, 'carol'), (2, 'heidi')],
+        )
+
+    def test_rule_index_is_cached_until_the_rules_change(self):
+        approval_rules.get_rule_index(self.company.pk)
+        with self.assertNumQueries(0):
+            index = approval_rules.get_rule_index(self.company.pk)
+        self.assertIsNone(index.match(Decimal('100.00'), self.category.pk))
+
+        rule = ApprovalRule.objects.create(name='All', company=self.company, rule_type='SEQUENTIAL')
+        self.assertEqual(approval_rules.get_rule_index(self.company.pk).match(Decimal('100.00'), self.category.pk).id, rule.pk)
+        ApprovalStep.objects.create(approval_rule=rule, step_number=1, approver=self.manager)
+        self.assertEqual(len(approval_rules.get_rule_index(self.company.pk).match(Decimal('1'), None).steps), 1)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        company = make_company()
+        self.employee = make_user(company, 'alice')
+        category = ExpenseCategory.objects.create(name='Travel', company=company)
+        self.expenses = [make_expense(self.employee, category) for _ in range(7)]
+
+    def pages(self, limit):
+        rows, cursor = keyset_page(Expense.objects.all(), None, limit)
+        seen = [row.pk for row in rows]
+        while cursor is not None:
+            rows, cursor = keyset_page(Expense.objects.all(), cursor, limit)
+            seen += [row.pk for row in rows]
+        return seen
+
+    def test_every_row_once_newest_first(self):
+        self.assertEqual(self.pages(3), [expense.pk for expense in reversed(self.expenses)])
+
+    def test_ties_on_created_at(self):
+        Expense.objects.update(created_at=datetime.now(dt_timezone.utc))
+        self.assertEqual(self.pages(2), sorted((expense.pk for expense in self.expenses), reverse=True))
+
+    def test_exact_last_page_has_no_cursor(self):
+        self.assertIsNone(keyset_page(Expense.objects.all(), None, 7)[1])
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.employee)
+        for cursor in ('not a cursor', 'Zm9vfGJhcg', '!!!'):
+            response = self.client.get(reverse('adminFunc:expense_list_api'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+
+class HierarchyTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.ceo = make_user(self.company, 'ceo', role='ADMIN')
+        self.vp = make_user(self.company, 'vp', role='MANAGER', manager=self.ceo)
+        self.lead = make_user(self.company, 'lead', role='MANAGER', manager=self.vp)
+        self.dev = make_user(self.company, 'dev', manager=self.lead)
+
+    def assertMatchesRebuild(self):
+        maintained = set(UserHierarchy.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        self.assertEqual(hierarchy.rebuild(), (len(maintained), []))
+        self.assertEqual(
+            set(UserHierarchy.objects.values_list('ancestor_id', 'descendant_id', 'depth')), maintained,
+        )
+
+    def test_chain(self):
+        self.assertEqual(hierarchy.ancestor_ids(self.dev.pk), [self.lead.pk, self.vp.pk, self.ceo.pk])
+        self.assertEqual(hierarchy.subordinate_ids(self.vp.pk, max_depth=1), [self.lead.pk])
+        self.assertTrue(hierarchy.is_subordinate(self.dev.pk, self.ceo.pk))
+        self.assertEqual(hierarchy.depth(self.dev.pk), 3)
+        self.assertMatchesRebuild()
+
+    def test_move_carries_the_subtree(self):
+        other = make_user(self.company, 'other', role='MANAGER', manager=self.ceo)
+        self.lead.manager = other
+        self.lead.save()
+        self.assertEqual(hierarchy.ancestor_ids(self.dev.pk), [self.lead.pk, other.pk, self.ceo.pk])
+        self.assertFalse(hierarchy.is_subordinate(self.dev.pk, self.vp.pk))
+        self.assertMatchesRebuild()
+
+    def test_the_migration_builds_the_index_for_existing_users(self):
+        migration = importlib.import_module('adminFunc.migrations.0012_user_hierarchy')
+        UserHierarchy.objects.all().delete()
+        migration.build_hierarchy(django_apps, None)
+        self.assertEqual(hierarchy.ancestor_ids(self.dev.pk), [self.lead.pk, self.vp.pk, self.ceo.pk])
+        self.assertMatchesRebuild()
+
+    def test_cycles_are_rejected(self):
+        self.ceo.manager = self.dev
+        with self.assertRaises(ValidationError):
+            self.ceo.save()
+        self.assertEqual(hierarchy.depth(self.ceo.pk), 0)
+
+    def test_deleting_a_manager_detaches_the_reports(self):
+        self.vp.delete()
+        self.lead.refresh_from_db()
+        self.assertIsNone(self.lead.manager_id)
+        self.assertEqual(hierarchy.ancestor_ids(self.dev.pk), [self.lead.pk])
+        self.assertEqual(hierarchy.subordinate_ids(self.ceo.pk), [])
+        self.assertMatchesRebuild()
+
+
+@override_settings(LOGIN_RATE_WINDOW=300, LOGIN_MAX_FAILURES_PER_USERNAME=5, LOGIN_MAX_FAILURES_PER_IP=20)
+class LoginThrottleTests(TestCase):
+    START = 3000 * 300
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')
+        self.keys = logins.counter_keys(request, ' Alice ')
+
+    def fail(self, times, now):
+        for _ in range(times):
+            logins.record_failure(self.keys, now=now)
+
+    def test_usernames_are_normalized(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(logins.counter_keys(request, 'alice'), self.keys)
+
+    def test_limit_within_a_window(self):
+        self.fail(4, self.START)
+        self.assertEqual(logins.retry_after(self.keys, now=self.START + 1), 0)
+        self.fail(1, self.START)
+        # Locked out until this window ends
+        self.assertEqual(logins.retry_after(self.keys, now=self.START + 100), 200)
+
+    def test_previous_window_decays(self):
+        self.fail(5, self.START + 299)
+        # The previous window weighs 5 * (1 - 30 / 300) = 4.5 a tenth into this one
+        self.assertEqual(logins.retry_after(self.keys, now=self.START + 330), 0)
+        self.fail(1, self.START + 330)
+        # 1 + 4.5 is over the limit until the previous window has decayed below 4
+        self.assertAlmostEqual(logins.retry_after(self.keys, now=self.START + 330), 30, delta=1)
+        self.assertEqual(logins.retry_after(self.keys, now=self.START + 361), 0)
+
+    def test_cleared_after_two_windows(self):
+        self.fail(10, self.START)
+        self.assertGreater(logins.retry_after(self.keys, now=self.START + 300), 0)
+        self.assertEqual(logins.retry_after(self.keys, now=self.START + 600), 0)
+
+    def test_success_clears_the_username_only(self):
+        self.fail(10, self.START)
+        logins.record_success(self.keys, now=self.START + 10)
+        self.assertEqual(logins.retry_after(self.keys, now=self.START + 10), 0)
+        # The address keeps its 10 failures
+        ip_only = {'ip': self.keys['ip']}
+        for _ in range(10):
+            logins.record_failure(ip_only, now=self.START + 10)
+        self.assertGreater(logins.retry_after(ip_only, now=self.START + 10), 0)
+
+
+@override_settings(PROFILING=True, PROFILING_BUDGET_ACTION='raise', AUDIT_ASYNC=False)
+class ViewBudgetTests(TestCase):
+    """The hot views stay within PROFILING_BUDGETS however much data there is"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = make_company()
+        cls.admin = make_user(cls.company, 'judy', role='ADMIN')
+        employees = [make_user(cls.company, f'employee{i}', manager=cls.admin) for i in range(3)]
+        categories = [ExpenseCategory.objects.create(name=name, company=cls.company) for name in ('Hotel', 'Meals', 'Travel')]
+        cls.expenses = [
+            make_expense(employees[i % 3], categories[i % 3], f'{i + 1}.00', expense_date=date(2026, 1, 1) + timedelta(days=i))
+            for i in range(40)
+        ]
+        for employee in employees:
+            approval_rules.submit(employee, [expense.pk for expense in cls.expenses])
+        decisions.decide(cls.admin, [expense.pk for expense in cls.expenses[:10]], 'approve')
+        decisions.decide(cls.admin, [expense.pk for expense in cls.expenses[10:15]], 'reject', 'Missing receipt')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        profiling.stats.reset()
+        self.client.force_login(self.admin)
+
+    def test_dashboard(self):
+        response = self.client.get(reverse('adminFunc:admin_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['pending_approvals_count'], 25)
+        self.assertEqual(len(response.context['category_totals']), 3)
+
+    def test_expense_list_pages(self):
+        url, cursor, seen = reverse('adminFunc:expense_list_api'), None, []
+        while True:
+            response = self.client.get(url, {'limit': 15, **({'cursor': cursor} if cursor else {})})
+            seen += [row['id'] for row in response.json()['results']]
+            cursor = response.json()['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 40)
+
+    def test_inbox_decisions(self):
+        pending = [approval.expense_id for approval in inbox.pending_approvals(self.admin)]
+        response = self.client.post(
+            reverse('adminFunc:decide_expenses_api'),
+            {'expense_ids': pending, 'action': 'approve'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['decided'], sorted(pending))
+        self.assertEqual(inbox.pending_count(self.admin), 0)
+
+    def test_budgets_fail_the_request(self):
+        budgets = {'adminFunc:admin_dashboard': {'queries': 1}}
+        with override_settings(PROFILING_BUDGETS=budgets), self.assertRaises(profiling.BudgetExceeded):
+            self.client.get(reverse('adminFunc:admin_dashboard'))
+
+
+class CountryCurrencyTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        self.snapshot = Path(snapshot_dir) / 'country_currencies.json'
+        settings_override = override_settings(COUNTRY_CURRENCY_SNAPSHOT=str(self.snapshot))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        countries.clear_cache()
+        self.addCleanup(countries.clear_cache)
+
+    def test_names_codes_and_aliases(self):
+        for name in ('United Kingdom', '  united   KINGDOM ', 'GB', 'gb', 'Great Britain'):
+            self.assertEqual(countries.resolve_currency(name), ('GBP', '£'), name)
+        self.assertEqual(countries.resolve_currency('USA'), ('USD', '$'))
+        self.assertEqual(countries.resolve_currency('Narnia'), countries.DEFAULT_CURRENCY)
+        self.assertEqual(countries.resolve_currency(''), countries.DEFAULT_CURRENCY)
+
+    def test_snapshot_overlays_the_bundled_data(self):
+        self.assertEqual(countries.resolve_currency('United States'), ('USD', '$'))
+        countries.write_snapshot([
+            {'name': 'United States', 'cca2': 'US', 'currency': 'USN', 'symbol': '$'},
+            {'name': 'Atlantis', 'cca2': 'XA', 'currency': 'ATL'},
+        ])
+        # Picked up without clearing: the snapshot's mtime changed
+        self.assertEqual(countries.resolve_currency('United States'), ('USN', '$'))
+        self.assertEqual(countries.resolve_currency('xa'), ('ATL', 'ATL'))
+        self.assertEqual(countries.resolve_currency('India'), ('INR', '₹'))
+
+    def test_unreadable_snapshot_is_ignored(self):
+        self.snapshot.write_text('{not json')
+        with self.assertLogs('adminFunc.countries', 'WARNING'):
+            self.assertEqual(countries.resolve_currency('India'), ('INR', '₹'))
+
+    def upstream(self, payload):
+        session = mock.Mock()
+        session.get.return_value.json.return_value = payload
+        return mock.patch.object(countries, 'get_http_session', return_value=session)
+
+    def test_warm_merges_upstream_into_the_snapshot(self):
+        payload = [
+            {'name': {'common': 'India', 'official': 'Republic of India'}, 'cca2': 'IN', 'currencies': {'INR': {'symbol': 'Rs'}}},
+            {'name': {'common': 'Nowhere'}, 'cca2': 'NW', 'currencies': {}},
+        ]
+        with self.upstream(payload):
+            call_command('warm_country_currencies', stdout=StringIO())
+
+        entries = {entry['cca2']: entry for entry in json.loads(self.snapshot.read_text(encoding='utf-8'))}
+        self.assertEqual(entries['IN']['symbol'], 'Rs')
+        self.assertNotIn('NW', entries)
+        self.assertEqual(entries['GB']['currency'], 'GBP')
+        self.assertEqual(countries.resolve_currency('Republic of India'), ('INR', 'Rs'))
+
+    def test_failed_rewrite_keeps_the_old_snapshot(self):
+        countries.write_snapshot([{'name': 'Atlantis', 'cca2': 'XA', 'currency': 'ATL'}])
+        before = self.snapshot.read_bytes()
+
+        with self.upstream([]), mock.patch.object(countries.json, 'dump', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                call_command('warm_country_currencies', stdout=StringIO())
+        self.assertEqual(self.snapshot.read_bytes(), before)
+        self.assertEqual(os.listdir(self.snapshot.parent), [self.snapshot.name])
+
+    def test_upstream_failure(self):
+        with self.upstream([]) as get_session:
+            get_session.return_value.get.side_effect = OSError('unreachable')
+            with self.assertRaises(CommandError):
+                call_command('warm_country_currencies', stdout=StringIO())
+        self.assertFalse(self.snapshot.exists())
+
+
+@override_settings(AUDIT_ASYNC=False)
+class CompanyStatsTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.manager = make_user(self.company, 'heidi', role='MANAGER')
+        self.category = ExpenseCategory.objects.create(name='Travel', company=self.company)
+        stats.get_company_stats(self.company)
+
+    def assertMatchesRebuild(self):
+        stored = CompanyStats.objects.get(company=self.company)
+        self.assertEqual(stats.find_drift(), {})
+        stats.rebuild([self.company.pk])
+        rebuilt = CompanyStats.objects.get(company=self.company)
+        for field in stats.COUNTER_FIELDS:
+            self.assertEqual(getattr(stored, field), getattr(rebuilt, field), field)
+
+    def test_signal_and_bulk_deltas_match_a_rebuild(self):
+        employee = make_user(self.company, 'ivan', manager=self.manager)
+        leaver = make_user(self.company, 'judy', role='ADMIN')
+        expenses = [make_expense(employee, self.category, f'{10 * i}.00') for i in range(1, 7)]
+
+        # Single saves and deletes go through the signals
+        expenses[0].amount = Decimal('15.00')
+        expenses[0].save()
+        expenses[1].status = 'CANCELLED'
+        expenses[1].save(update_fields=['status'])
+        expenses[2].delete()
+        leaver.delete()
+        employee.role = 'MANAGER'
+        employee.save()
+        rule = ApprovalRule.objects.create(name='All', company=self.company, rule_type='SEQUENTIAL')
+
+        # Bulk paths report their transitions
+        approval_rules.submit(employee, [expense.pk for expense in expenses[3:]])
+        decisions.decide(self.manager, [expenses[3].pk], 'approve')
+        decisions.decide(self.manager, [expenses[4].pk], 'reject', 'Duplicate')
+        rule.delete()
+        self.assertMatchesRebuild()
+
+        stored = CompanyStats.objects.get(company=self.company)
+        self.assertEqual(
+            (stored.total_expenses, stored.draft_expenses, stored.pending_expenses, stored.approved_expenses),
+            (5, 1, 1, 1),
+        )
+        self.assertEqual((stored.pending_amount, stored.approved_amount), (Decimal('60.00'), Decimal('40.00')))
+        self.assertEqual((stored.total_users, stored.manager_users), (2, 2))
+
+    def test_check_repairs_drift(self):
+        make_expense(make_user(self.company, 'ivan'), self.category)
+        CompanyStats.objects.filter(company=self.company).update(total_expenses=F('total_expenses') + 3)
+
+        with self.assertRaises(CommandError):
+            call_command('check_company_stats', stdout=StringIO())
+        out = StringIO()
+        call_command('check_company_stats', '--repair', stdout=out)
+        self.assertIn('Repaired stats for 1 companies', out.getvalue())
+        self.assertEqual(stats.find_drift(), {})
+        self.assertEqual(CompanyStats.objects.get(company=self.company).total_expenses, 1)
+
+
+@override_settings(AUDIT_ASYNC=False)
+class DecisionTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.manager = make_user(self.company, 'heidi', role='MANAGER')
+        self.employee = make_user(self.company, 'ivan', manager=self.manager)
+        self.approvers = [make_user(self.company, name, role='MANAGER') for name in ('ann', 'ben', 'cai')]
+        self.cfo = make_user(self.company, 'cfo', role='ADMIN')
+        self.category = ExpenseCategory.objects.create(name='Travel', company=self.company)
+
+    def route(self, rule_type, approvers, percentage=None, requires_manager_approval=False, auto_approver=None):
+        """A new expense routed through a new rule, the only active one"""
+        for previous in ApprovalRule.objects.filter(is_active=True):
+            previous.is_active = False
+            previous.save()
+        rule = ApprovalRule.objects.create(
+            name=rule_type, company=self.company, rule_type=rule_type, approval_percentage=percentage,
+            requires_manager_approval=requires_manager_approval,
+        )
+        for step_number, approver in enumerate(approvers, start=1):
+            ApprovalStep.objects.create(
+                approval_rule=rule, step_number=step_number, approver=approver,
+                can_auto_approve=approver == auto_approver,
+            )
+        expense = make_expense(self.employee, self.category)
+        approval_rules.submit(self.employee, [expense.pk])
+        expense.refresh_from_db()
+        return expense
+
+    def decide(self, approver, expense, action='approve', comment=''):
+        result = decisions.decide(approver, [expense.pk], action, comment)
+        expense.refresh_from_db()
+        return result
+
+    def test_sequential_steps_advance_in_order(self):
+        ann, ben, _ = self.approvers
+        expense = self.route('SEQUENTIAL', [ann, ben], requires_manager_approval=True)
+        self.assertEqual((expense.status, expense.current_approval_step), ('PENDING', 1))
+
+        # Not their step yet
+        self.assertEqual(self.decide(ann, expense), {'decided': [], 'skipped': [expense.pk]})
+        self.decide(self.manager, expense)
+        self.assertEqual((expense.status, expense.current_approval_step), ('PENDING', 2))
+        self.decide(ann, expense)
+        self.assertEqual((expense.status, expense.current_approval_step), ('PENDING', 3))
+        self.decide(ben, expense)
+        self.assertEqual(expense.status, 'APPROVED')
+        self.assertIsNotNone(expense.completed_at)
+
+    def test_percentage_passes_at_the_threshold(self):
+        ann, ben, _ = self.approvers
+        expense = self.route('PERCENTAGE', self.approvers, percentage=60)
+        self.decide(ann, expense)
+        self.assertEqual(expense.status, 'PENDING')
+        self.decide(ben, expense)
+        self.assertEqual(expense.status, 'APPROVED')
+
+    def test_percentage_fails_once_the_threshold_is_unreachable(self):
+        ann, ben, cai = self.approvers
+        expense = self.route('PERCENTAGE', self.approvers, percentage=60)
+        self.decide(ann, expense, 'reject', 'Too much')
+        self.assertEqual(expense.status, 'PENDING')
+        self.decide(ben, expense, 'reject', 'Too much')
+        self.assertEqual(expense.status, 'REJECTED')
+        self.assertEqual(self.decide(cai, expense), {'decided': [], 'skipped': [expense.pk]})
+        self.assertEqual(ExpenseComment.objects.filter(expense=expense).count(), 2)
+
+    def test_hybrid_passes_on_percentage_or_the_specific_approver(self):
+        ann, ben, cai = self.approvers
+        expense = self.route('HYBRID', [ann, ben, cai, self.cfo], percentage=50, auto_approver=self.cfo)
+        self.decide(ann, expense)
+        self.assertEqual(expense.status, 'PENDING')
+        self.decide(ben, expense)
+        self.assertEqual(expense.status, 'APPROVED')
+
+        expense = self.route('HYBRID', [ann, ben, cai, self.cfo], percentage=100, auto_approver=self.cfo)
+        self.decide(self.cfo, expense)
+        self.assertEqual(expense.status, 'APPROVED')
+
+    def test_auto_approve_step_finishes_the_expense(self):
+        ann, _, _ = self.approvers
+        expense = self.route('SEQUENTIAL', [self.cfo, ann], requires_manager_approval=True, auto_approver=self.cfo)
+        self.decide(self.manager, expense)
+        self.decide(self.cfo, expense)
+        self.assertEqual((expense.status, expense.current_approval_step), ('APPROVED', 2))
+        self.assertEqual(ExpenseApproval.objects.get(expense=expense, approver=ann).status, 'PENDING')
+
+    def test_only_actionable_ids_are_decided(self):
+        ann, ben, _ = self.approvers
+        mine = self.route('SEQUENTIAL', [ann])
+        others = self.route('SEQUENTIAL', [ben])
+        draft = make_expense(self.employee, self.category)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = decisions.decide(ann, [mine.pk, others.pk, draft.pk, 999999], 'approve')
+        self.assertEqual(result, {'decided': [mine.pk], 'skipped': sorted([others.pk, draft.pk, 999999])})
+        # Already decided
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(decisions.decide(ann, [mine.pk], 'approve'), {'decided': [], 'skipped': [mine.pk]})
+        self.assertEqual(AuditLog.objects.filter(action='APPROVE').count(), 1)
+
+    def test_reject_needs_a_comment(self):
+        ann, _, _ = self.approvers
+        expense = self.route('SEQUENTIAL', [ann])
+        self.client.force_login(ann)
+        url = reverse('adminFunc:decide_expenses_api')
+        response = self.client.post(url, {'expense_ids': [expense.pk], 'action': 'reject'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'expense_ids': [expense.pk], 'action': 'hold'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url, {'expense_ids': [expense.pk], 'action': 'reject', 'comment': 'No receipt'}, content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'decided': [expense.pk], 'skipped': []})
+        self.assertEqual(Expense.objects.get(pk=expense.pk).status, 'REJECTED')
+
+
+class ImporterTests(TestCase):
+
+    HEADER = 'Employee,Category,Amount,Expense_Date,Description,Reference,Line_Description,Line_Quantity,Line_Unit_Price,Status\n'
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.manager = make_user(self.company, 'judy', role='MANAGER')
+        self.employee = make_user(self.company, 'kim', manager=self.manager)
+        ExpenseCategory.objects.create(name='Travel', company=self.company)
+
+    def run_import(self, body, **options):
+        content = ('\ufeff' + self.HEADER + body).encode()
+        return importer.import_file(self.company, BytesIO(content), 'expenses.csv', **options)
+
+    def test_csv_rows_are_numbered_from_the_header(self):
+        content = ('\ufeff' + self.HEADER + 'kim,Travel,10.00,2026-03-01,Taxi,,,,\n,,,,,,,,\nKIM@example.com,travel,5,2026-03-02,Bus,,,,\n').encode()
+        rows = list(importer.read_csv(BytesIO(content)))
+        self.assertEqual([row_number for row_number, _ in rows], [2, 4])
+        self.assertEqual(rows[0][1]['employee'], 'kim')
+        self.assertEqual(rows[1][1]['expense_date'], '2026-03-02')
+
+        report = self.run_import('kim,Travel,10.00,2026-03-01,Taxi,,,,\nKIM@example.com,travel,5,2026-03-02,Bus,,,,\n')
+        self.assertEqual((report.rows, report.expenses, report.error_count), (2, 2, 0))
+        self.assertEqual(sorted(Expense.objects.values_list('amount', flat=True)), [Decimal('5.00'), Decimal('10.00')])
+
+    def test_rows_sharing_a_reference_form_one_expense(self):
+        report = self.run_import(
+            'kim,Travel,1,2026-03-01,Trip,T1,Hotel,2,120.00\n'
+            'kim,Travel,1,2026-03-01,Trip,T1,Train,1,45.50\n'
+            'kim,Travel,8,2026-03-02,Lunch,,Sandwich,,\n'
+        )
+        self.assertEqual((report.rows, report.expenses, report.lines), (3, 2, 3))
+        trip = Expense.objects.get(description='Trip')
+        self.assertEqual(trip.amount, Decimal('285.50'))
+        self.assertEqual(sorted(trip.line_items.values_list('total_amount', flat=True)), [Decimal('45.50'), Decimal('240.00')])
+        self.assertEqual(Expense.objects.get(description='Lunch').line_items.get().total_amount, Decimal('8.00'))
+
+    def test_errors_are_reported_at_the_offending_row(self):
+        report = self.run_import(
+            'kim,Travel,1,2026-03-01,Trip,T1,Hotel,1,100.00\n'
+            'kim,Travel,1,2026-03-01,Trip,T1,Train,many,45.50\n'
+            'nobody,Travel,5,2026-03-02,Bus,,,,\n'
+            'kim,Travel,1,2026-03-03,Big,T2,Jet,1,6000000000\n'
+            'kim,Travel,1,2026-03-03,Big,T2,Yacht,1,6000000000\n'
+            'kim,Travel,7,2026-03-04,Taxi,,,,\n'
+        )
+        self.assertEqual([(error.row, error.message) for error in report.errors], [
+            (3, "Invalid line_quantity: 'many'"),
+            (4, "Unknown employee: 'nobody'"),
+            (6, "Total of the expense's lines out of range: 12000000000.00"),
+        ])
+        self.assertEqual(list(Expense.objects.values_list('description', flat=True)), ['Taxi'])
+
+    def test_pending_rows_are_routed_before_they_are_saved(self):
+        report = self.run_import('kim,Travel,10.00,2026-03-01,Taxi,,,,,PENDING\nkim,Travel,12.00,2026-03-01,Bus,,,,,PENDING\n')
+        self.assertEqual(report.expenses, 2)
+        for expense in Expense.objects.all():
+            self.assertEqual((expense.status, expense.current_approval_step), ('PENDING', 1))
+            self.assertEqual(list(expense.approvals.values_list('approver_id', flat=True)), [self.manager.pk])
+
+    def test_a_dry_run_writes_nothing(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(self.HEADER + 'kim,Travel,10.00,2026-03-01,Taxi,,,,,PENDING\nnobody,Travel,5,2026-03-02,Bus,,,,\n')
+        self.addCleanup(os.unlink, f.name)
+        out = StringIO()
+        call_command('import_expenses', self.company.pk, f.name, '--dry-run', stdout=out)
+        self.assertIn('Row 3: Unknown employee', out.getvalue())
+        self.assertIn('Validated 1 expenses with 0 lines from 2 rows', out.getvalue())
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(ExpenseApproval.objects.exists())
+
+
+class ExporterTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.employee = make_user(self.company, 'lee')
+        category = ExpenseCategory.objects.create(name='Travel', company=self.company)
+        self.expenses = [make_expense(self.employee, category, amount=f'{100 + i}.00') for i in range(7)]
+        # Ties on created_at are broken by id
+        Expense.objects.filter(pk__in=[e.pk for e in self.expenses[2:5]]).update(created_at=self.expenses[2].created_at)
+
+    def test_resuming_after_any_record_yields_the_rest(self):
+        queryset = Expense.objects.filter(company=self.company)
+        every = list(exporter.records(queryset, chunk_size=3))
+        self.assertEqual(len(every), 7)
+        for position, row in enumerate(every):
+            rest = list(exporter.records(queryset, cursor=row['cursor'], chunk_size=3))
+            self.assertEqual([r['id'] for r in rest], [r['id'] for r in every[position + 1:]])
+        with self.assertRaises(ValueError):
+            exporter.records(queryset, cursor='not-a-cursor')
+
+    def test_csv_text_columns_are_not_formulas(self):
+        Expense.objects.filter(pk=self.expenses[0].pk).update(
+            description='=HYPERLINK("http://evil")', merchant_name='+Cafe', employee_notes='@SUM(A1)',
+        )
+        body = b''.join(exporter.stream(Expense.objects.filter(pk=self.expenses[0].pk))).decode()
+        [row] = csv.DictReader(StringIO(body))
+        self.assertEqual(row['description'], '\'=HYPERLINK("http://evil")')
+        self.assertEqual(row['merchant_name'], "'+Cafe")
+        self.assertEqual(row['employee_notes'], "'@SUM(A1)")
+        self.assertEqual(row['amount'], '100.00')
+
+    def test_gzip_output_decompresses_to_the_same_records(self):
+        queryset = Expense.objects.filter(company=self.company)
+        plain = b''.join(exporter.stream(queryset, 'jsonl'))
+        self.assertEqual(gzip.decompress(b''.join(exporter.stream(queryset, 'jsonl', compress=True))), plain)
+        self.assertEqual(len(plain.splitlines()), 7)
+
+    def test_a_resumed_command_export_appends_the_missing_records(self):
+        path = os.path.join(tempfile.mkdtemp(), 'expenses.jsonl.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        queryset = Expense.objects.filter(company=self.company)
+        first_three = list(exporter.records(queryset))[:3]
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.writelines(exporter.jsonl_lines(first_three))
+
+        call_command('export_expenses', self.company.pk, path, '--cursor', first_three[-1]['cursor'], stdout=StringIO())
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            ids = [json.loads(line)['id'] for line in f]
+        self.assertEqual(ids, [row['id'] for row in exporter.records(queryset)])
+
+
+class ReferenceDataTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.company = make_company()
+        self.manager = make_user(self.company, 'mia', role='MANAGER')
+        self.employee = make_user(self.company, 'ned', manager=self.manager)
+        self.travel = ExpenseCategory.objects.create(name='Travel', company=self.company)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_kept_in_process_without_a_shared_cache(self):
+        self.assertEqual(reference_data.category_name(self.company.pk, self.travel.pk), 'Travel')
+        self.assertEqual(reference_data.manager_tree(self.company.pk).manager_of(self.employee.pk), self.manager.pk)
+        with self.assertNumQueries(0):
+            reference_data.categories(self.company.pk)
+            reference_data.manager_tree(self.company.pk)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_saves_reload_this_process_at_once(self):
+        reference_data.categories(self.company.pk)
+        tree = reference_data.manager_tree(self.company.pk)
+        self.assertEqual(tree.direct_reports(self.manager.pk), [self.employee.pk])
+
+        self.travel.name = 'Trips'
+        self.travel.save()
+        self.employee.manager = None
+        self.employee.save()
+        self.assertEqual(reference_data.category_name(self.company.pk, self.travel.pk), 'Trips')
+        self.assertEqual(reference_data.manager_tree(self.company.pk).direct_reports(self.manager.pk), [])
+
+    @override_settings(SHARED_CACHE=True, CACHE_VERSION_TTL=0)
+    def test_changes_reach_other_workers_through_a_shared_cache(self):
+        shared_cache = LocMemCache('shared', {})
+        worker_a, worker_b = Worker(shared_cache), Worker(shared_cache)
+        with worker_a:
+            self.assertEqual(reference_data.category_name(self.company.pk, self.travel.pk), 'Travel')
+        with worker_b:
+            self.travel.name = 'Trips'
+            self.travel.save()
+        with worker_a:
+            self.assertEqual(reference_data.category_name(self.company.pk, self.travel.pk), 'Trips')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite production mode")
+class SqliteModeTests(unittest.TestCase):
+    """Runs on scratch databases, outside the test database and Django's per-test isolation"""
+
+    def setUp(self):
+        self.enterContext(override_settings(SQLITE_PRODUCTION=True, SQLITE_BUSY_TIMEOUT=50, SQLITE_CACHE_SIZE=-2000))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'db.sqlite3')
+
+    def open(self, alias):
+        """A connection of its own to the scratch database, as settings.py configures it in production mode"""
+        settings_dict = dict(connection.settings_dict, NAME=self.path, OPTIONS={'transaction_mode': 'IMMEDIATE'})
+        self.enterContext(mock.patch.dict(connections.settings, {alias: settings_dict}))
+        self.addCleanup(connections.__delitem__, alias)
+        self.addCleanup(connections[alias].close)
+        return connections[alias]
+
+    def pragma(self, db_connection, name):
+        with db_connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_new_connections_get_the_pragmas(self):
+        db_connection = self.open('scratch')
+        self.assertEqual(self.pragma(db_connection, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(db_connection, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(db_connection, 'busy_timeout'), 50)
+        self.assertEqual(self.pragma(db_connection, 'cache_size'), -2000)
+        self.assertEqual(self.pragma(db_connection, 'temp_store'), 2)  # MEMORY
+
+    def test_transactions_take_the_write_lock_when_they_begin(self):
+        first, second = self.open('first'), self.open('second')
+        with first.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x INTEGER)')
+        with transaction.atomic(using='first'):
+            # Even a read-only transaction holds the lock, so the second waits at BEGIN, not at its first write
+            self.pragma(first, 'user_version')
+            with self.assertRaisesRegex(OperationalError, 'database is locked'):
+                with transaction.atomic(using='second'):
+                    pass
+        with transaction.atomic(using='second'):
+            with second.cursor() as cursor:
+                cursor.execute('INSERT INTO t VALUES (1)')
+
+
+class AsgiViewTests(TestCase):
+    """The async views served through the ASGI handler"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.company = make_company()
+        self.admin = make_user(self.company, 'olga', role='ADMIN')
+        self.employee = make_user(self.company, 'pat', manager=self.admin)
+        category = ExpenseCategory.objects.create(name='Travel', company=self.company)
+        self.expenses = [make_expense(self.employee, category, f'{i + 1}.00') for i in range(5)]
+        approval_rules.submit(self.employee, [expense.pk for expense in self.expenses])
+
+    async def test_dashboard(self):
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(reverse('adminFunc:admin_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['company'], self.company)
+        self.assertEqual(response.context['pending_approvals_count'], 5)
+        self.assertEqual(len(response.context['pending_approvals']), 5)
+
+    async def test_listing(self):
+        await self.async_client.aforce_login(self.employee)
+        response = await self.async_client.get(reverse('adminFunc:expense_list_api'), {'limit': 3})
+        page = response.json()
+        self.assertEqual([row['id'] for row in page['results']], [expense.pk for expense in self.expenses[:-4:-1]])
+        self.assertEqual(page['results'][0]['category'], 'Travel')
+        response = await self.async_client.get(reverse('adminFunc:expense_list_api'), {'cursor': page['next_cursor']})
+        self.assertEqual(len(response.json()['results']), 2)
+
+    async def test_decide(self):
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.post(
+            reverse('adminFunc:decide_expenses_api'),
+            {'expense_ids': [self.expenses[0].pk], 'action': 'approve'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'decided': [self.expenses[0].pk], 'skipped': []})
+        self.assertEqual((await Expense.objects.aget(pk=self.expenses[0].pk)).status, 'APPROVED')
+
+    async def test_export_streams_as_it_is_read(self):
+        produced = []
+        record, buffered = exporter.record, exporter.buffered
+
+        def counted(expense):
+            produced.append(expense.pk)
+            return record(expense)
+
+        await self.async_client.aforce_login(self.admin)
+        # One chunk per record
+        with mock.patch.object(exporter, 'record', counted), \
+                mock.patch.object(exporter, 'buffered', lambda pieces: buffered(pieces, size=1)):
+            response = await self.async_client.get(reverse('adminFunc:export_expenses_api'), {'format': 'jsonl'})
+            self.assertTrue(response.is_async)
+            chunks = []
+            async for chunk in response.streaming_content:
+                chunks.append(chunk)
+                if len(chunks) == 1:
+                    # The first record went out before the rest were read
+                    self.assertEqual(len(produced), 1)
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(produced, [expense.pk for expense in reversed(self.expenses)])
+
+
+class AsgiLoginTests(TransactionTestCase):
+    """Committed data: passwords are checked on the login pool's threads, which have connections of their own"""
+
+    def setUp(self):
+        cache.clear()
+        clear_local()
+        make_user(make_company(), 'olga', role='ADMIN', password='s3cret-Passw0rd')
+        # A pool of one thread, whose connection is closed again before the test database is dropped
+        self.enterContext(override_settings(LOGIN_HASH_WORKERS=1))
+        pool = self.enterContext(mock.patch.object(logins, 'pool', logins.HashPool()))
+        self.addCleanup(lambda: pool.submit(connections.close_all).result())
+
+    async def test_login(self):
+        url = reverse('adminFunc:admin_login')
+        response = await self.async_client.post(url, {'login-email': 'olga', 'login-password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await self.async_client.get(url)).status_code, 200)
+        response = await self.async_client.post(url, {'login-email': 'olga', 'login-password': 's3cret-Passw0rd'})
+        self.assertRedirects(response, reverse('adminFunc:admin_dashboard'), fetch_redirect_response=False)
+        # Signed in now
+        response = await self.async_client.get(url)
+        self.assertRedirects(response, reverse('adminFunc:admin_dashboard'), fetch_redirect_response=False)
+
+
+class ProvisioningTests(TestCase):
+
+    TEMPLATE = {
+        'categories': ['Travel', 'Meals'],
+        'users': [
+            {'key': 'cfo', 'email': 'cfo@{domain}', 'role': 'MANAGER', 'manager': 'admin'},
+            {'email': 'clerk@{domain}', 'manager': 'cfo'},
+        ],
+        'approval_rules': [
+            {'name': 'Large travel', 'rule_type': 'SEQUENTIAL', 'min_amount': '1000', 'categories': ['Travel'],
+             'steps': [{'approver': 'cfo'}, {'approver': 'admin'}]},
+        ],
+    }
+
+    def tenant(self, name, email):
+        return {'name': name, 'country': 'Germany', 'users': [{'key': 'admin', 'email': email, 'role': 'ADMIN'}]}
+
+    def assertMatchesRebuild(self, company):
+        stored = CompanyStats.objects.get(company=company)
+        stats.rebuild([company.pk])
+        rebuilt = CompanyStats.objects.get(company=company)
+        for field in stats.COUNTER_FIELDS:
+            self.assertEqual(getattr(stored, field), getattr(rebuilt, field), field)
+
+    def test_default_template(self):
+        company, users = provisioning.provision(self.tenant('Initech', 'bill@initech.example'))
+        self.assertEqual((company.currency_code, company.currency_symbol), ('EUR', '€'))
+        self.assertEqual(
+            sorted(category.name for category in reference_data.categories(company.pk).values()),
+            sorted(provisioning.DEFAULT_CATEGORIES),
+        )
+        self.assertEqual(users['admin'].company, company)
+        self.assertFalse(users['admin'].has_usable_password())
+        self.assertFalse(ApprovalRule.objects.filter(company=company).exists())
+        self.assertEqual(CompanyStats.objects.get(company=company).active_approval_rules, 0)
+        self.assertMatchesRebuild(company)
+
+    def test_template_users_rules_and_hierarchy(self):
+        company, users = provisioning.provision(self.tenant('Initech', 'bill@initech.example'), self.TEMPLATE)
+        self.assertEqual(users['cfo'].email, 'cfo@initech.invalid')
+        clerk = users['clerk@initech.invalid']
+        self.assertEqual(hierarchy.ancestor_ids(clerk.pk), [users['cfo'].pk, users['admin'].pk])
+
+        rule = ApprovalRule.objects.get(company=company)
+        self.assertEqual([category.name for category in rule.categories.all()], ['Travel'])
+        self.assertEqual(
+            list(rule.approval_steps.order_by('step_number').values_list('approver_id', flat=True)),
+            [users['cfo'].pk, users['admin'].pk],
+        )
+        index = approval_rules.get_rule_index(company.pk)
+        travel = ExpenseCategory.objects.get(company=company, name='Travel')
+        self.assertEqual(index.match(Decimal('5000'), travel.pk).id, rule.pk)
+        self.assertEqual(CompanyStats.objects.get(company=company).active_approval_rules, 1)
+        self.assertMatchesRebuild(company)
+
+    def test_emails_are_unique_across_companies(self):
+        other = make_company('Globex')
+        make_user(other, 'hank')
+        # Invisible to this tenant's scoped manager, but still taken
+        with tenancy.using(make_company('Initrode').pk):
+            with self.assertRaisesMessage(ValueError, 'Users already exist: hank@example.com'):
+                provisioning.provision(self.tenant('Initech', 'hank@example.com'))
+        self.assertFalse(Company.objects.filter(name='Initech').exists())
+
+        with self.assertRaisesMessage(ValueError, 'Users appear more than once: dup@example.com'):
+            provisioning.provision_many([self.tenant('A', 'dup@example.com'), self.tenant('B', 'dup@example.com')])
+
+    def test_a_failed_batch_is_rolled_back(self):
+        tenants = [self.tenant('Initech', 'bill@initech.example'), self.tenant('Initrode', 'joan@initrode.example')]
+        with mock.patch.object(ApprovalStep.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                provisioning.provision_many(tenants, self.TEMPLATE)
+        self.assertFalse(Company.objects.filter(name__in=['Initech', 'Initrode']).exists())
+        self.assertFalse(User.all_objects.filter(email__in=['bill@initech.example', 'joan@initrode.example']).exists())
+        self.assertFalse(ExpenseCategory.all_objects.exists())
+
+        # The batch goes through once the failure is gone
+        self.assertEqual(len(provisioning.provision_many(tenants, self.TEMPLATE)), 2)
@@ -0,0 +1,156 @@
+"""Receipt thumbnails and previews.
+
+Each image receipt gets a few fixed-size derivatives, stored next to the
+original as ``<digest>.<size>.v<version>.<ext>``. They are rendered in a process pool
+once the blob is committed, so uploads never wait on Pillow; if a derivative
+is requested before the pool got to it (or the pool is disabled), it is
+rendered on that first request instead.
+
+URLs and file names carry the content digest and THUMBNAIL_VERSION, so they
+never change for the same image and can be cached forever; bump the version
+when SIZES or the output format change, and derivatives are rendered afresh
+under the new names.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from PIL import UnidentifiedImageError, features
+
+from . import imaging
+from .models import ReceiptBlob
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_VERSION = 1
+
+# Largest first; render() reduces each from the previous one
+SIZES = {
+    'preview': (1200, 1200),
+    'thumb': (160, 160),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def output_format():
+    """(Pillow format, extension): WebP when this Pillow build supports it, else JPEG"""
+    if getattr(settings, 'THUMBNAIL_FORMAT', 'WEBP').upper() == 'WEBP' and features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+
+def is_image(blob):
+    return (blob.content_type or '').startswith('image/')
+
+
+def derivative_name(blob, size, version=None, extension=None):
+    base, _ = os.path.splitext(blob.file.name)
+    return f'{base}.{size}.v{version or THUMBNAIL_VERSION}.{extension or output_format()[1]}'
+
+
+def derivative_names(blob):
+    """Every derivative ``blob`` may have on disk, including those of earlier versions"""
+    return [
+        derivative_name(blob, size, version, extension)
+        for version in range(1, THUMBNAIL_VERSION + 1)
+        for extension in ('webp', 'jpg')
+        for size in SIZES
+    ]
+
+
+def thumbnail_url(blob, size='thumb'):
+    """Cache-busting URL of a derivative, None for receipts that are not images"""
+    if blob is None or not is_image(blob):
+        return None
+    return reverse('adminFunc:receipt_thumbnail', kwargs={
+        'sha256': blob.sha256, 'size': size, 'version': THUMBNAIL_VERSION, 'ext': output_format()[1],
+    })
+
+
+def _targets(blob):
+    image_format = output_format()[0]
+    return [(default_storage.path(derivative_name(blob, size)), dimensions, image_format)
+            for size, dimensions in SIZES.items()]
+
+
+def _quality():
+    return getattr(settings, 'THUMBNAIL_QUALITY', 80)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: workers start clean instead of inheriting DB connections and threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=max(getattr(settings, 'THUMBNAIL_WORKERS', 2), 1),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                atexit.register(_pool.shutdown, wait=True, cancel_futures=True)
+    return _pool
+
+
+def _mark_done(blob_id):
+    def done(future):
+        try:
+            future.result()
+        except Exception:
+            # Left for the lazy fallback to retry on first request
+            logger.exception("Rendering thumbnails for receipt blob %s failed", blob_id)
+            return
+        try:
+            ReceiptBlob.objects.filter(pk=blob_id).update(thumbnails_version=THUMBNAIL_VERSION)
+        finally:
+            close_old_connections()
+    return done
+
+
+def schedule(blob):
+    """Render ``blob``'s derivatives in the pool after the current transaction commits"""
+    if not is_image(blob) or getattr(settings, 'THUMBNAIL_WORKERS', 2) <= 0:
+        return
+
+    def submit():
+        future = _get_pool().submit(imaging.render, default_storage.path(blob.file.name), _targets(blob), _quality())
+        future.add_done_callback(_mark_done(blob.pk))
+
+    transaction.on_commit(submit)
+
+
+def ensure(blob, size):
+    """Storage name of a derivative, rendering all of them in-process if it is missing.
+
+    Returns None when the receipt cannot be decoded as an image.
+    """
+    name = derivative_name(blob, size)
+    if default_storage.exists(name):
+        return name
+    try:
+        imaging.render(default_storage.path(blob.file.name), _targets(blob), _quality())
+    except (UnidentifiedImageError, OSError):
+        logger.warning("Receipt blob %s is not a readable image", blob.pk)
+        return None
+    ReceiptBlob.objects.filter(pk=blob.pk).update(thumbnails_version=THUMBNAIL_VERSION)
+    return name
+
+
+def regenerate(blobs):
+    """Render every image blob in ``blobs`` not yet at THUMBNAIL_VERSION; returns ``(rendered, failed)``"""
+    pool = _get_pool()
+    futures = {
+        blob.pk: pool.submit(imaging.render, default_storage.path(blob.file.name), _targets(blob), _quality())
+        for blob in blobs.exclude(thumbnails_version=THUMBNAIL_VERSION).filter(content_type__startswith='image/')
+    }
+    rendered = [blob_id for blob_id, future in futures.items() if future.exception() is None]
+    ReceiptBlob.objects.filter(pk__in=rendered).update(thumbnails_version=THUMBNAIL_VERSION)
+    return len(rendered), len(futures) - len(rendered)
@@ -7,4 +7,13 @@ urlpatterns = [
     path('login/', views.admin_login, name='admin_login'),
     path('dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('logout/', views.admin_logout, name='admin_logout'),  # Make sure this exists
+    path('api/expenses/', views.expense_list_api, name='expense_list_api'),
+    path('api/expenses/export/', views.export_expenses_api, name='export_expenses_api'),
+    path('api/expenses/import/', views.import_expenses_api, name='import_expenses_api'),
+    path('api/expenses/submit/', views.submit_expenses_api, name='submit_expenses_api'),
+    path('api/approvals/decide/', views.decide_expenses_api, name='decide_expenses_api'),
+    path('api/metrics/', views.metrics_api, name='metrics_api'),
+    path('api/expenses/<int:expense_id>/receipt/', views.upload_receipt_api, name='upload_receipt_api'),
+    path('expenses/<int:expense_id>/receipt/', views.expense_receipt, name='expense_receipt'),
+    path('receipts/<str:sha256>/<slug:size>-v<int:version>.<str:ext>', views.receipt_thumbnail, name='receipt_thumbnail'),
 ]
@@ -1,46 +1,41 @@
 # adminFunc/views.py
-import requests
+import json
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
-from django.contrib.auth import authenticate, login, logout
+from django.urls import reverse
+from django.contrib.auth import alogin, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_POST
 from django.db import transaction
-from .models import User, Company, ExpenseCategory
+from django.utils import timezone
+from .models import User, Company, Expense, ReceiptBlob
+from .filters import filter_expenses
+from .pagination import akeyset_page
+from .countries import resolve_currency
+from .stats import aget_company_stats
+from .rollups import category_totals
+from .inbox import apending_count, pending_approvals
+from .decisions import DECISIONS, decide
+from . import (
+    approval_rules, audit, exporter, importer, logins, ocr, profiling, provisioning, receipts, reference_data, thumbnails,
+)
 
 def get_currency_from_country(country_name):
-    """Get currency code from country using REST Countries API"""
-    try:
-        response = requests.get(f'https://restcountries.com/v3.1/name/{country_name}?fullText=true')
-        if response.status_code == 200:
-            data = response.json()
-            if data and 'currencies' in data[0]:
-                currencies = data[0]['currencies']
-                # Get first currency code
-                currency_code = list(currencies.keys())[0]
-                return currency_code
-    except Exception as e:
-        print(f"Error fetching currency: {e}")
-    
-    # Fallback currency mapping
-    fallback_currencies = {
-        'United States': 'USD',
-        'United Kingdom': 'GBP',
-        'India': 'INR',
-        'Germany': 'EUR',
-        'France': 'EUR',
-        'Canada': 'CAD',
-        'Australia': 'AUD',
-        'Japan': 'JPY',
-        'China': 'CNY',
-        'Brazil': 'BRL',
-    }
-    return fallback_currencies.get(country_name, 'USD')
+    """Get currency code from country using the bundled/snapshotted currency table"""
+    currency_code, _ = resolve_currency(country_name)
+    return currency_code
 
 @never_cache
-def admin_login(request):
+async def admin_login(request):
     """Handle both login and signup"""
-    if request.user.is_authenticated:
+    if (await request.auser()).is_authenticated:
         return redirect('adminFunc:admin_dashboard')
     
     if request.method == 'POST':
@@ -49,19 +44,33 @@ def admin_login(request):
             # Login form submission
             username = request.POST.get('login-email')
             password = request.POST.get('login-password')
-            user = authenticate(request, username=username, password=password)
+            # Throttled, then hashed on the bounded login pool
+            attempt = await logins.aattempt(request, username, password)
             
-            if user is not None:
-                login(request, user)
+            if attempt.user is not None:
+                await alogin(request, attempt.user)
                 return redirect('adminFunc:admin_dashboard')
+            elif attempt.rejected:
+                if attempt.rejected == 'throttled':
+                    messages.error(request, f"Too many failed sign-in attempts. Try again in {attempt.retry_after} seconds.")
+                else:
+                    messages.error(request, "The server is busy signing in other users. Try again in a moment.")
+                response = await sync_to_async(render)(
+                    request, 'adminFunc/login.html', status=429 if attempt.rejected == 'throttled' else 503,
+                )
+                response['Retry-After'] = str(attempt.retry_after)
+                return response
             else:
                 messages.error(request, "Invalid email/username or password")
         
         elif 'email' in request.POST:
-            # Signup form submission
-            return signup_company_admin(request)
+            # Signup form submission. It looks the currency up in the bundled
+            # table (adminFunc.countries) rather than calling a web service,
+            # so there is no network wait to make async and no async HTTP
+            # client; its one transaction runs on a worker thread
+            return await sync_to_async(signup_company_admin)(request)
     
-    return render(request, 'adminFunc/login.html')
+    return await sync_to_async(render)(request, 'adminFunc/login.html')
 
 @transaction.atomic
 def signup_company_admin(request):
@@ -80,53 +89,29 @@ def signup_company_admin(request):
             messages.error(request, "Passwords do not match")
             return redirect('adminFunc:admin_login')
         
-        if User.objects.filter(email=email).exists():
+        # Emails are unique across companies
+        if User.all_objects.filter(email=email).exists():
             messages.error(request, "Email already exists")
             return redirect('adminFunc:admin_login')
         
-        # Get currency for country
-        currency_code = get_currency_from_country(country)
-        
-        # Create Company
-        company = Company.objects.create(
-            name=company_name,
-            country=country,
-            currency_code=currency_code,
-            currency_symbol=currency_code
-        )
-        
-        # Create Admin User
-        first_name = full_name
-        last_name = ""
-        if ' ' in full_name:
-            name_parts = full_name.split(' ', 1)
-            first_name = name_parts[0]
-            last_name = name_parts[1] if len(name_parts) > 1 else ""
-            
-        user = User.objects.create_user(
-            username=email,
-            email=email,
-            password=password,
-            first_name=first_name,
-            last_name=last_name,
-            role='ADMIN',
-            company=company,
-            is_staff=True,
-            is_superuser=True
-        )
-        
-        # Create default expense categories
-        default_categories = [
-            'Travel', 'Meals', 'Accommodation', 'Office Supplies', 
-            'Entertainment', 'Transportation', 'Utilities', 'Other'
-        ]
-        
-        for category_name in default_categories:
-            ExpenseCategory.objects.create(
-                name=category_name,
-                company=company,
-                description=f"Default {category_name} expense category"
-            )
+        # Company, admin and default categories in a handful of bulk INSERTs
+        first_name, _, last_name = (full_name or '').partition(' ')
+        provisioned = provisioning.provision({
+            'name': company_name,
+            'country': country,
+            'users': [{
+                'key': 'admin',
+                'username': email,
+                'email': email,
+                'password': password,
+                'first_name': first_name,
+                'last_name': last_name,
+                'role': 'ADMIN',
+                'is_staff': True,
+                'is_superuser': True,
+            }],
+        })
+        user = provisioned.users['admin']
         
         # Auto-login the user
         login(request, user)
@@ -136,19 +121,251 @@ def signup_company_admin(request):
         messages.error(request, f"Error creating account: {str(e)}")
         return redirect('adminFunc:admin_login')
 
+PENDING_APPROVALS_ON_DASHBOARD = 20
+
 @never_cache
 @login_required
-def admin_dashboard(request):
-    """Admin dashboard - basic version without data"""
-    return render(request, 'adminFunc/adminDashboard.html')
-
-<<<<<<< HEAD
-=======
-
-# # Logout view
-# @never_cache
-# def admin_logout(request):
-#     logout(request)
-#     messages.success(request, 'You have been logged out successfully.')
-#     return redirect('admin:login')
->>>>>>> e0f140f314cc50ecdc285a5ba0edcb1bf980c335
+async def admin_dashboard(request):
+    """Admin dashboard with the company's materialized counters"""
+    user = await request.auser()
+    if user.company_id is None or User.company.is_cached(user):
+        # The auth backend loads the company along with the user
+        company = user.company
+    else:
+        company = await Company.objects.filter(pk=user.company_id).afirst()
+    context = {
+        # Shadows the context processor's lazy request.user
+        'user': user,
+        'company': company,
+        'stats': await aget_company_stats(company) if company else None,
+        'category_totals': await sync_to_async(category_totals)(company.pk) if company else [],
+        'pending_approvals': [
+            approval async for approval in pending_approvals(user)[:PENDING_APPROVALS_ON_DASHBOARD]
+        ],
+        'pending_approvals_count': await apending_count(user),
+    }
+    return await sync_to_async(render)(request, 'adminFunc/adminDashboard.html', context)
+
+
+# Columns shown in the "All Expenses" table
+EXPENSE_LIST_FIELDS = (
+    'id', 'expense_number', 'amount', 'currency_code', 'expense_date', 'status', 'created_at',
+    'employee__first_name', 'employee__last_name', 'employee__email', 'category_id',
+    'receipt_blob__sha256', 'receipt_blob__content_type',
+)
+
+@login_required
+async def expense_list_api(request):
+    """Keyset-paginated, filterable JSON listing of the company's expenses"""
+    company_id = (await request.auser()).company_id
+    if company_id is None:
+        return JsonResponse({'results': [], 'next_cursor': None})
+    
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 200)
+        expenses = Expense.objects.filter(company_id=company_id).select_related('employee', 'receipt_blob')
+        expenses = filter_expenses(expenses, request.GET).only(*EXPENSE_LIST_FIELDS)
+        rows, next_cursor = await akeyset_page(expenses, request.GET.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    category_names = await sync_to_async(reference_data.category_names)(
+        company_id, [expense.category_id for expense in rows],
+    )
+    
+    results = [
+        {
+            'id': expense.id,
+            'expense_number': expense.expense_number,
+            'employee': {
+                'name': expense.employee.get_full_name(),
+                'email': expense.employee.email,
+            },
+            'category': category_names.get(expense.category_id),
+            'amount': expense.amount,
+            'currency_code': expense.currency_code,
+            'expense_date': expense.expense_date,
+            'status': expense.status,
+            'receipt': {
+                'url': reverse('adminFunc:expense_receipt', args=[expense.id]),
+                'thumbnail_url': thumbnails.thumbnail_url(expense.receipt_blob, 'thumb'),
+                'preview_url': thumbnails.thumbnail_url(expense.receipt_blob, 'preview'),
+            } if expense.receipt_blob else None,
+        }
+        for expense in rows
+    ]
+    return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+
+@require_POST
+@login_required
+async def submit_expenses_api(request):
+    """Submit the signed-in user's draft expenses for approval: {"expense_ids": [...]}"""
+    try:
+        payload = json.loads(request.body or b'{}')
+        expense_ids = [int(expense_id) for expense_id in payload.get('expense_ids', [])]
+    except (ValueError, TypeError):
+        return JsonResponse({'error': "expense_ids must be a list of integers"}, status=400)
+    
+    result = await sync_to_async(approval_rules.submit)(
+        await request.auser(), expense_ids, ip_address=request.META.get('REMOTE_ADDR'),
+    )
+    return JsonResponse(result)
+
+
+@require_POST
+@login_required
+async def decide_expenses_api(request):
+    """Approve or reject a batch of expenses: {"expense_ids": [...], "action": "approve"|"reject", "comment": ""}"""
+    try:
+        payload = json.loads(request.body or b'{}')
+        expense_ids = [int(expense_id) for expense_id in payload.get('expense_ids', [])]
+    except (ValueError, TypeError):
+        return JsonResponse({'error': "expense_ids must be a list of integers"}, status=400)
+    
+    action = payload.get('action')
+    if action not in DECISIONS:
+        return JsonResponse({'error': "action must be 'approve' or 'reject'"}, status=400)
+    comment = (payload.get('comment') or '').strip()
+    if action == 'reject' and not comment:
+        return JsonResponse({'error': "A comment is required to reject"}, status=400)
+    
+    result = await sync_to_async(decide)(
+        await request.auser(), expense_ids, action, comment, ip_address=request.META.get('REMOTE_ADDR'),
+    )
+    return JsonResponse(result)
+
+
+
+@require_POST
+@login_required
+def upload_receipt_api(request, expense_id):
+    """Attach the uploaded ``receipt`` file to an expense, reporting duplicates"""
+    expense = Expense.objects.filter(pk=expense_id, company=request.user.company).first()
+    if expense is None:
+        return JsonResponse({'error': "Expense not found"}, status=404)
+    upload = request.FILES.get(receipts.RECEIPT_FIELD)
+    # The upload handler stops spooling an oversized receipt and drops it
+    if getattr(request, 'receipt_too_large', False) or (upload is not None and upload.size > settings.RECEIPT_MAX_UPLOAD_SIZE):
+        return JsonResponse({'error': "Receipt file is too large"}, status=400)
+    if upload is None:
+        return JsonResponse({'error': "No receipt file uploaded"}, status=400)
+    
+    client_key = request.headers.get('Idempotency-Key')
+    
+    # Only the company's own receipts count: blobs are shared between companies
+    already_stored = receipts.known_to_company(expense.company_id, upload)
+    blob, _ = receipts.attach(expense, upload)
+    ocr_job = None
+    if settings.OCR_AUTO_SUBMIT:
+        ocr_job, _ = ocr.submit(expense, key=f'client:{expense.company_id}:{client_key}' if client_key else None)
+    duplicate_of = receipts.duplicates_of(expense)
+    return JsonResponse({
+        'sha256': blob.sha256,
+        'size': blob.size,
+        'url': reverse('adminFunc:expense_receipt', args=[expense.pk]),
+        'already_stored': already_stored,
+        'duplicate_of': duplicate_of,
+        'ocr_job': {'id': ocr_job.pk, 'status': ocr_job.status} if ocr_job else None,
+    })
+
+
+@login_required
+def expense_receipt(request, expense_id):
+    """Serve an expense's receipt file"""
+    expense = (
+        Expense.objects.select_related('receipt_blob')
+        .filter(pk=expense_id, company=request.user.company)
+        .only('expense_number', 'receipt_blob')
+        .first()
+    )
+    if expense is None or expense.receipt_blob is None:
+        raise Http404("No receipt for this expense")
+    blob = expense.receipt_blob
+    filename = expense.expense_number + os.path.splitext(blob.file.name)[1]
+    return receipts.receipt_response(blob, request, filename=filename)
+
+
+@login_required
+def receipt_thumbnail(request, sha256, size, version, ext):
+    """Serve a receipt thumbnail/preview, rendering it on first request if the pool has not yet"""
+    blob = ReceiptBlob.objects.filter(sha256=sha256, expenses__company=request.user.company).first()
+    if blob is None or size not in thumbnails.SIZES or not thumbnails.is_image(blob):
+        raise Http404("No such receipt image")
+    if version != thumbnails.THUMBNAIL_VERSION or ext != thumbnails.output_format()[1]:
+        # A stale page asked for an older rendering; the current URL is cacheable, this one is not
+        return redirect(thumbnails.thumbnail_url(blob, size))
+    name = thumbnails.ensure(blob, size)
+    if name is None:
+        raise Http404("Receipt is not a readable image")
+    image_format, extension = thumbnails.output_format()
+    return receipts.file_response(
+        name, f'image/{image_format.lower()}', f'"{sha256}.{size}.v{thumbnails.THUMBNAIL_VERSION}"', request,
+        filename=f'{size}.{extension}',
+    )
+
+
+@require_POST
+@login_required
+def import_expenses_api(request):
+    """Bulk import expenses from an uploaded CSV/XLSX ``file`` (admins only)"""
+    company = request.user.company
+    if company is None or request.user.role != 'ADMIN':
+        return JsonResponse({'error': "Only company admins can import expenses"}, status=403)
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': "No file uploaded"}, status=400)
+    
+    status = (request.POST.get('status') or 'APPROVED').upper()
+    try:
+        report = importer.import_file(company, upload, upload.name, default_status=status)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(report.as_dict())
+
+
+@login_required
+def export_expenses_api(request):
+    """Stream the company's expenses with their lines, approvals and comments as CSV or JSON Lines (admins only)
+
+    Takes the listing filters plus ``format`` (csv|jsonl), ``gzip=1`` and
+    ``cursor`` (the last record's cursor, to resume an interrupted export).
+    """
+    company = request.user.company
+    if company is None or request.user.role != 'ADMIN':
+        return JsonResponse({'error': "Only company admins can export expenses"}, status=403)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in exporter.EXPORT_FORMATS:
+        return JsonResponse({'error': "format must be 'csv' or 'jsonl'"}, status=400)
+    compress = request.GET.get('gzip') in ('1', 'true')
+    
+    try:
+        expenses = filter_expenses(Expense.objects.filter(company=company), request.GET)
+        chunks = exporter.stream(expenses, export_format, request.GET.get('cursor'), compress)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if isinstance(request, ASGIRequest):
+        chunks = exporter.aiterate(chunks)
+    
+    response = StreamingHttpResponse(chunks, content_type=exporter.content_type(export_format, compress))
+    filename = f"expenses-{timezone.now():%Y%m%d-%H%M%S}.{export_format}{'.gz' if compress else ''}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+def metrics_api(request):
+    """Per-view latency/query percentiles of this process plus audit writer metrics (admins only)"""
+    if request.user.role != 'ADMIN':
+        return JsonResponse({'error': "Only company admins can view metrics"}, status=403)
+    return JsonResponse({
+        'profiling': profiling.enabled(),
+        'views': profiling.stats.snapshot(),
+        'audit': audit.metrics(),
+    })
+
+# Logout view
+@never_cache
+def admin_logout(request):
+    logout(request)
+    messages.success(request, 'You have been logged out successfully.')
+    return redirect('adminFunc:admin_login')
@@ -3,6 +3,19 @@ ASGI config for odooproject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+ASGI deployment profile (requirements-asgi.txt)::
+
+    uvicorn odooproject.asgi:application --host 0.0.0.0 --port 8000 --workers 2
+
+The login, dashboard, expense listing and approval decision views are async,
+so a worker waits on slow clients in its event loop rather than holding a
+thread for each; the remaining (sync) views run on a thread per request.
+Persistent database connections are per thread and are not reused across
+async requests: on PostgreSQL use DB_POOL=True (or DB_CONN_MAX_AGE=0). With
+more than one worker set CACHE_BACKEND=redis (or db) so that sessions, login
+counters and cache invalidations are shared between them. Serve static files
+from the reverse proxy.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
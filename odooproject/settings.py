@@ -48,6 +48,7 @@ SESSION_COOKIE_SECURE = True  # Set to True in production with HTTPS
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Strict'
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
+# SESSION_ENGINE is set below, once the cache is configured
 
 # CSRF protection
 CSRF_COOKIE_SECURE = True  # Set to True in production with HTTPS
@@ -62,13 +63,18 @@ X_FRAME_OPTIONS = 'DENY'
 LOGIN_URL = '/admin/login/'
 LOGIN_REDIRECT_URL = '/admin/dashboard/'
 LOGOUT_REDIRECT_URL = '/admin/login/'
+# Users are loaded with their company and manager and cached per process
+# (adminFunc.backends)
+AUTHENTICATION_BACKENDS = ['adminFunc.backends.CachedModelBackend']
 
 MIDDLEWARE = [
+    'adminFunc.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'adminFunc.tenancy.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -91,17 +97,100 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'odooproject.wsgi.application'
+ASGI_APPLICATION = 'odooproject.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# SQLite is the development default. DB_ENGINE=postgresql selects the
+# production profile (requirements-postgres.txt), configured by the DB_*
+# variables; DB_POOL=True uses psycopg's connection pool instead of
+# persistent per-thread connections.
+DB_ENGINE = config('DB_ENGINE', default='sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL = config('DB_POOL', default=False, cast=bool)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='odooproject'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            # A pooled connection is returned after each request, so it must not persist
+            'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            # Required behind a transaction-pooling PgBouncer
+            'DISABLE_SERVER_SIDE_CURSORS': config('DB_DISABLE_SERVER_SIDE_CURSORS', default=False, cast=bool),
+            'OPTIONS': {
+                'application_name': config('DB_APPLICATION_NAME', default='odooproject'),
+                # Milliseconds; 0 disables the limit
+                'options': f"-c statement_timeout={config('DB_STATEMENT_TIMEOUT', default=30000, cast=int)}",
+            },
+        }
+    }
+    if DB_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=20, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Cache
+# Version keys, counters and cached lookups must be seen by every worker
+# process. CACHE_BACKEND=redis (requirements-redis.txt, CACHE_LOCATION a
+# redis:// URL) or db (run createcachetable first) is shared; the default
+# locmem cache is per process, so a change made in one worker reaches the
+# in-process caches of the others only when their entries expire
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+}
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': config('CACHE_LOCATION', default={
+            'locmem': '', 'redis': 'redis://localhost:6379/0', 'db': 'django_cache',
+        }[CACHE_BACKEND]),
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='odooproject'),
     }
 }
+SHARED_CACHE = config('SHARED_CACHE', default=CACHE_BACKEND != 'locmem', cast=bool)
+# Seconds a process keeps its copy of a version key before reading it again
+CACHE_VERSION_TTL = config('CACHE_VERSION_TTL', default=5, cast=int)
+# Seconds a process keeps a loaded user (adminFunc.backends). Changes made in
+# the same process drop it at once; a deactivation or password change made in
+# another worker reaches it at once through a shared cache, and otherwise only
+# when it expires, so the default is short without one
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=600 if SHARED_CACHE else 5, cast=int)
+
+# cached_db reads sessions from the cache and writes through to the database.
+# A logout in one worker only reaches the others' cached copies through a
+# shared cache, so without one sessions are read from the database
+SESSION_ENGINE = config('SESSION_ENGINE', default=(
+    'django.contrib.sessions.backends.cached_db' if SHARED_CACHE else 'django.contrib.sessions.backends.db'
+))
+
+# SQLite production mode (adminFunc.sqlite_mode)
+# WAL journal and tuned pragmas on every connection and IMMEDIATE
+# transactions (compare with the benchmark_sqlite command)
+SQLITE_PRODUCTION = config('SQLITE_PRODUCTION', default=False, cast=bool)
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)  # ms
+SQLITE_MMAP_SIZE = config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)
+SQLITE_CACHE_SIZE = config('SQLITE_CACHE_SIZE', default=-64000, cast=int)  # negative: KiB
+if DB_ENGINE != 'postgresql' and SQLITE_PRODUCTION:
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
 
 
 # Password validation
@@ -153,3 +242,91 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Expense numbering
+# When enabled each company gets its own EXP-<year>-C<company id>-NNNN sequence
+EXPENSE_NUMBER_PER_COMPANY = config('EXPENSE_NUMBER_PER_COMPANY', default=False, cast=bool)
+
+# Country -> currency lookup
+# Signup reads the bundled table plus this snapshot; only the
+# warm_country_currencies command contacts restcountries.com
+COUNTRY_CURRENCY_SNAPSHOT = config('COUNTRY_CURRENCY_SNAPSHOT', default=str(BASE_DIR / 'country_currencies.json'))
+COUNTRY_CURRENCY_CACHE_TTL = config('COUNTRY_CURRENCY_CACHE_TTL', default=3600, cast=int)
+
+# Exchange rates
+# Lookups fall back to the nearest earlier stored rate within this many days
+EXCHANGE_RATE_MAX_AGE_DAYS = config('EXCHANGE_RATE_MAX_AGE_DAYS', default=30, cast=int)
+EXCHANGE_RATE_LOCAL_CACHE_TTL = config('EXCHANGE_RATE_LOCAL_CACHE_TTL', default=300, cast=int)
+EXCHANGE_RATE_CACHE_TIMEOUT = config('EXCHANGE_RATE_CACHE_TIMEOUT', default=24 * 3600, cast=int)
+
+# Login throttling and hashing (adminFunc.logins)
+# Failed attempts are limited per client IP and per username over a sliding
+# window; LOGIN_FAST_REJECT refuses throttled attempts before hashing.
+# Passwords are checked on LOGIN_HASH_WORKERS threads with at most
+# LOGIN_HASH_QUEUE attempts in flight; more are refused as busy (503)
+LOGIN_RATE_WINDOW = config('LOGIN_RATE_WINDOW', default=300, cast=int)  # seconds
+LOGIN_MAX_FAILURES_PER_IP = config('LOGIN_MAX_FAILURES_PER_IP', default=20, cast=int)
+LOGIN_MAX_FAILURES_PER_USERNAME = config('LOGIN_MAX_FAILURES_PER_USERNAME', default=5, cast=int)
+LOGIN_FAST_REJECT = config('LOGIN_FAST_REJECT', default=True, cast=bool)
+LOGIN_HASH_WORKERS = config('LOGIN_HASH_WORKERS', default=2, cast=int)
+LOGIN_HASH_QUEUE = config('LOGIN_HASH_QUEUE', default=32, cast=int)
+
+# Request profiling (adminFunc.profiling)
+# Per-view query counts, DB time and latency percentiles (api/metrics/,
+# profile_views). Requests over their view's budget are logged ('warn') or
+# fail with BudgetExceeded ('raise', for tests)
+PROFILING = config('PROFILING', default=DEBUG, cast=bool)
+PROFILING_SAMPLES = config('PROFILING_SAMPLES', default=1000, cast=int)  # per view
+PROFILING_BUDGET_ACTION = config('PROFILING_BUDGET_ACTION', default='warn')
+PROFILING_DEFAULT_BUDGET = {'queries': 30, 'duplicates': 5}
+PROFILING_BUDGETS = {
+    'adminFunc:admin_dashboard': {'queries': 15, 'duplicates': 2},
+    'adminFunc:expense_list_api': {'queries': 5, 'duplicates': 1},
+}
+
+# Approver inbox
+INBOX_COUNT_CACHE_TIMEOUT = config('INBOX_COUNT_CACHE_TIMEOUT', default=300, cast=int)
+
+# Audit log writer
+# Entries are written by a background thread in batches; set AUDIT_ASYNC=False
+# to write them synchronously on commit (e.g. in tests)
+AUDIT_ASYNC = config('AUDIT_ASYNC', default=True, cast=bool)
+AUDIT_BATCH_SIZE = config('AUDIT_BATCH_SIZE', default=500, cast=int)
+AUDIT_FLUSH_INTERVAL = config('AUDIT_FLUSH_INTERVAL', default=1.0, cast=float)
+AUDIT_MAX_QUEUE = config('AUDIT_MAX_QUEUE', default=100000, cast=int)
+# Entries that fail to write are retried; after AUDIT_MAX_ATTEMPTS failures,
+# or beyond AUDIT_MAX_RETRY waiting retries, they are dropped and logged
+AUDIT_MAX_ATTEMPTS = config('AUDIT_MAX_ATTEMPTS', default=3, cast=int)
+AUDIT_MAX_RETRY = config('AUDIT_MAX_RETRY', default=10000, cast=int)
+
+# Audit log archival
+# Months older than AUDIT_HOT_MONTHS are moved to gzip JSONL segments here
+AUDIT_ARCHIVE_DIR = config('AUDIT_ARCHIVE_DIR', default=str(BASE_DIR / 'audit_archive'))
+AUDIT_HOT_MONTHS = config('AUDIT_HOT_MONTHS', default=3, cast=int)
+
+# Receipt storage
+# Uploads are spooled to disk and hashed while they stream in; receipts are
+# stored once per SHA-256 under MEDIA_ROOT/receipts/sha256/
+FILE_UPLOAD_HANDLERS = ['adminFunc.receipts.HashingUploadHandler']
+RECEIPT_MAX_UPLOAD_SIZE = config('RECEIPT_MAX_UPLOAD_SIZE', default=20 * 1024 * 1024, cast=int)
+# Set to X-Accel-Redirect (nginx) or X-Sendfile (Apache) to let the web
+# server send receipt files from RECEIPT_SENDFILE_PREFIX + <path in MEDIA_ROOT>
+RECEIPT_SENDFILE_HEADER = config('RECEIPT_SENDFILE_HEADER', default='')
+RECEIPT_SENDFILE_PREFIX = config('RECEIPT_SENDFILE_PREFIX', default='/protected-media/')
+
+# Receipt thumbnails
+# Rendered by a pool of THUMBNAIL_WORKERS processes after upload (0 renders
+# them on first request instead)
+THUMBNAIL_WORKERS = config('THUMBNAIL_WORKERS', default=2, cast=int)
+THUMBNAIL_FORMAT = config('THUMBNAIL_FORMAT', default='WEBP')
+THUMBNAIL_QUALITY = config('THUMBNAIL_QUALITY', default=80, cast=int)
+
+# Receipt OCR
+# Extractor callable (dotted path) run by the run_ocr_worker command;
+# adminFunc.ocr_extractors.tesseract_text needs pytesseract
+OCR_EXTRACTOR = config('OCR_EXTRACTOR', default='adminFunc.ocr_extractors.local_text')
+OCR_AUTO_SUBMIT = config('OCR_AUTO_SUBMIT', default=True, cast=bool)
+OCR_MAX_ATTEMPTS = config('OCR_MAX_ATTEMPTS', default=3, cast=int)
+OCR_RETRY_BACKOFF = config('OCR_RETRY_BACKOFF', default=30, cast=int)
+OCR_COMPANY_CONCURRENCY = config('OCR_COMPANY_CONCURRENCY', default=4, cast=int)
+OCR_LEASE_SECONDS = config('OCR_LEASE_SECONDS', default=300, cast=int)